@@ -0,0 +1,193 @@
+"""Bencode decode and encode throughput, checked against a stored baseline.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_bencode                  # report ops/s and MB/s
+    python -m benchmarks.bench_bencode --save-baseline  # record this machine
+    python -m benchmarks.bench_bencode --check          # fail on regression
+
+Baselines are machine specific: re-record them when moving to new hardware.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import time
+from pathlib import Path
+
+from src.bencode import Decoder, EncodeCache, Encoder, extract, freeze
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+
+
+def make_metainfo(piece_count: int, file_count: int) -> dict:
+    """Build a multi-file metainfo dict with `piece_count` piece hashes."""
+    pieces = b"".join(
+        hashlib.sha1(i.to_bytes(4, "big")).digest() for i in range(piece_count)
+    )
+    files = [
+        {b"length": 1000 + i, b"path": [b"dir%d" % (i % 100), b"file%d.bin" % i]}
+        for i in range(file_count)
+    ]
+    return {
+        b"announce": b"http://tracker.example.com:8080/announce",
+        b"creation date": 1700000000,
+        b"info": {
+            b"files": files,
+            b"name": b"synthetic",
+            b"piece length": 2**18,
+            b"pieces": pieces,
+        },
+    }
+
+
+def make_tracker_response(peer_count: int = 50) -> dict:
+    return {
+        b"complete": 12,
+        b"incomplete": 3,
+        b"interval": 1800,
+        b"min interval": 900,
+        b"peers": bytes(range(6)) * peer_count,
+    }
+
+
+def make_krpc_message() -> dict:
+    """A DHT get_peers response, the typical KRPC payload size."""
+    return {
+        b"r": {
+            b"id": b"a" * 20,
+            b"nodes": b"n" * 26 * 8,
+            b"token": b"aoeusnth",
+            b"values": [b"p" * 6 for _ in range(8)],
+        },
+        b"t": b"aa",
+        b"y": b"r",
+    }
+
+
+def make_wide_dict(width: int = 10_000) -> dict:
+    return {b"key%06d" % i: i for i in range(width)}
+
+
+def make_deep_nesting(depth: int = 400) -> list:
+    value = [b"leaf", 1]
+    for _ in range(depth):
+        value = [value]
+    return value
+
+
+def make_cases(large: bool) -> dict[str, tuple[object, bytes]]:
+    """Return {name: (python value, encoded bytes)} for every scenario."""
+    pieces, files = (200_000, 10_000) if large else (20_000, 1_000)
+    values = {
+        "tracker_response": make_tracker_response(),
+        "krpc_message": make_krpc_message(),
+        "pieces_blob": {b"pieces": b"\x00" * 20 * pieces},
+        "wide_dict": make_wide_dict(),
+        "deep_nesting": make_deep_nesting(),
+        "metainfo": make_metainfo(pieces, files),
+    }
+    return {name: (value, Encoder().encode(value)) for name, value in values.items()}
+
+
+def measure(func, min_time: float, rounds: int) -> float:
+    """Return the best calls per second of `func` over `rounds` timed runs."""
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        if time.perf_counter() - start >= min_time / 10:
+            break
+        calls *= 2
+
+    best = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = max(best, calls / (time.perf_counter() - start))
+    return best
+
+
+def run(large: bool, min_time: float, rounds: int) -> dict[str, dict[str, float]]:
+    results = {}
+    for name, (value, data) in make_cases(large).items():
+        benches = {
+            "decode": lambda: Decoder(data).decode(),
+            "encode": lambda: Encoder().encode(value),
+        }
+        if name == "metainfo":
+            benches["extract"] = lambda: extract(data, [b"info", b"name"])
+
+            # Re-encoding a message around an already encoded info dict.
+            message = {**value, b"info": freeze(value[b"info"])}
+            cached = Encoder(EncodeCache())
+            benches["encode_cached"] = lambda: cached.encode(message)
+
+        for op, func in benches.items():
+            ops = measure(func, min_time, rounds)
+            results[f"{name}.{op}"] = {
+                "ops_per_sec": ops,
+                "mb_per_sec": ops * len(data) / 2**20,
+            }
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Return the benchmarks slower than `threshold` times their baseline."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["ops_per_sec"] / baseline[name]["ops_per_sec"]
+        if ratio < threshold:
+            regressions.append(f"{name}: {ratio:.2f}x of baseline")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--large", action="store_true", help="10x bigger inputs")
+    parser.add_argument("--min-time", type=float, default=1.0)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.7,
+        help="fail --check when throughput falls below this fraction of baseline",
+    )
+    args = parser.parse_args()
+
+    results = run(args.large, args.min_time, args.rounds)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+
+    for name, result in results.items():
+        line = (
+            f"{name:>26}: {result['ops_per_sec']:12.1f} ops/s"
+            f"  {result['mb_per_sec']:9.1f} MB/s"
+        )
+        if name in baseline:
+            ratio = result["ops_per_sec"] / baseline[name]["ops_per_sec"]
+            line += f"  ({ratio:.2f}x baseline)"
+        print(line)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+
+    if args.check:
+        regressions = compare(results, baseline, args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r}", file=sys.stderr)
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,44 +1,139 @@
+from collections import OrderedDict
+
+# Longest digit run accepted for a string length before the input is
+# considered malformed, so a missing colon cannot make us scan the whole
+# buffer. Integers are unbounded and are not limited.
+MAX_LENGTH_DIGITS = 32
+
+# Default limit on the nesting of lists and dictionaries.
+MAX_DEPTH = 512
+
+
+def parse_integer(number: bytes) -> int:
+    if not number.lstrip(b"-").isdigit() or number.count(b"-") > 1:
+        raise ValueError(f"Invalid integer {bytes(number)!r}")
+    return int(number)
+
+
+def parse_length(digits: bytes) -> int:
+    if not digits.isdigit():
+        raise ValueError(f"Invalid string length {bytes(digits)!r}")
+    return int(digits)
+
+
 class Decoder:
-    def __init__(self, source: bytes):
+    def __init__(
+        self,
+        source: bytes,
+        zero_copy: bool = False,
+        record_spans: bool = False,
+        max_depth: int = MAX_DEPTH,
+        max_size: int | None = None,
+        max_string_length: int | None = None,
+    ):
+        if max_size is not None and len(source) > max_size:
+            raise ValueError(f"Input of {len(source)} bytes exceeds {max_size}")
+
         self.source = source
+        self.view = memoryview(source)
         self.current = 0
         self.contents = None
+        # When set, string values are returned as memoryview slices of the
+        # source instead of copies. Dictionary keys are always bytes.
+        self.zero_copy = zero_copy
+        # (start, end) offsets in the source of each value of the outermost
+        # dictionary, keyed like the dictionary itself.
+        self.spans: dict[bytes, tuple[int, int]] | None = {} if record_spans else None
+        self.max_depth = max_depth
+        self.max_string_length = max_string_length
 
     def decode(self) -> bytes | int | list | dict | None:
         return self.decode_one()
 
     def decode_one(self) -> bytes | int | list | dict:
-        c = self.peek()
-        match c:
-            case _ if c.isdigit():
-                return self.read_string()
-
-            case b"i":
-                return self.read_integer()
-
-            case b"l":
-                return self.read_list()
-
-            case b"d":
-                return self.read_dict()
-
-            case _:
+        # Open containers, innermost last. Each entry holds the container,
+        # the pending dictionary key and the offset where its value starts.
+        stack: list[list] = []
+        spans = self.spans
+
+        while True:
+            c = self.peek()
+            if c == b"e" and stack:
+                if stack[-1][1] is not None:
+                    raise ValueError(f"Missing value for key {stack[-1][1]!r}")
+                self.current += 1
+                value = stack.pop()[0]
+
+            elif stack and stack[-1][1] is None and type(stack[-1][0]) is dict:
+                if not c.isdigit():
+                    raise ValueError(f"Expected string key, got {c} instead")
+                top = stack[-1]
+                top[1] = self.read_key()
+                # if keys and k < keys[-1]:
+                #     raise ValueError(
+                #         f"Dictionary keys are not sorted. '{k}' after '{keys[-1]}'"
+                #     )
+                top[2] = self.current
+                continue
+
+            elif c == b"l" or c == b"d":
+                if len(stack) >= self.max_depth:
+                    raise ValueError(f"Nesting deeper than {self.max_depth}")
+                self.current += 1
+                stack.append([[] if c == b"l" else {}, None, 0])
+                continue
+
+            elif c.isdigit():
+                value = self.read_string()
+
+            elif c == b"i":
+                value = self.read_integer()
+
+            else:
                 raise NotImplementedError
 
-    def read_string(self) -> bytes:
-        len = self.read_number()
-        self.expect(b":")
-
-        string = bytearray()
-        for _ in range(len):
-            string += self.advance()
-
-        return bytes(string)
+            if not stack:
+                return value
+
+            top = stack[-1]
+            if top[1] is None:
+                top[0].append(value)
+            else:
+                top[0][top[1]] = value
+                if spans is not None and len(stack) == 1:
+                    spans[top[1]] = (top[2], self.current)
+                top[1] = None
+
+    def read_string(self) -> bytes | memoryview:
+        start, end = self.read_string_span()
+        if self.zero_copy:
+            return self.view[start:end]
+        return self.view[start:end].tobytes()
+
+    def read_key(self) -> bytes:
+        start, end = self.read_string_span()
+        return self.view[start:end].tobytes()
+
+    def read_string_span(self) -> tuple[int, int]:
+        colon = self.find(b":", MAX_LENGTH_DIGITS)
+        length = parse_length(self.source[self.current : colon])
+        if self.max_string_length is not None and length > self.max_string_length:
+            raise ValueError(f"String of length {length} exceeds limit")
+
+        start = colon + 1
+        end = start + length
+        if end > len(self.source):
+            raise IndexError(
+                f"String of length {end - start} at offset {start} exceeds input"
+            )
+
+        self.current = end
+        return start, end
 
     def read_integer(self) -> int:
         self.expect(b"i")
 
-        n = self.read_number()
+        n = self.read_number(self.find(b"e"))
 
         # if n == 0 and (self.current - start > 1):
         #     raise ValueError("Invalid encoding for the integer 0")
@@ -51,49 +146,96 @@ class Decoder:
         return n
 
     def read_list(self) -> list:
-        self.expect(b"l")
+        if self.peek() != b"l":
+            raise ValueError(f"Expected {b'l'}, got {self.peek()} instead")
+        return self.decode_one()
 
-        lst = []
-        while self.peek() != b"e":
-            lst.append(self.decode_one())
+    def read_dict(self) -> dict:
+        if self.peek() != b"d":
+            raise ValueError(f"Expected {b'd'}, got {self.peek()} instead")
+        return self.decode_one()
 
-        self.expect(b"e")
+    def skip(self) -> None:
+        # Hot loop for scanning many files: dispatch on byte values and only
+        # touch the length prefixes of strings.
+        source = self.source
+        size = len(source)
+        depth = 0
+        while True:
+            c = source[self.current]
+            if 0x30 <= c <= 0x39:
+                self.read_string_span()
+
+            elif c == 0x69:  # i
+                self.current = self.find(b"e") + 1
+
+            elif c == 0x6C or c == 0x64:  # l or d
+                if depth >= self.max_depth:
+                    raise ValueError(f"Nesting deeper than {self.max_depth}")
+                depth += 1
+                self.current += 1
+
+            elif c == 0x65 and depth:  # e
+                depth -= 1
+                self.current += 1
+
+            else:
+                raise NotImplementedError
 
-        return lst
+            if not depth:
+                return
+            if self.current >= size:
+                raise IndexError("Unexpected end of input")
+
+    def descend(self, key: bytes | int) -> None:
+        if isinstance(key, int):
+            self.expect(b"l")
+            for _ in range(key):
+                if self.peek() == b"e":
+                    raise IndexError(f"List index {key} out of range")
+                self.skip()
+            if self.peek() == b"e":
+                raise IndexError(f"List index {key} out of range")
+            return
 
-    def read_dict(self) -> dict:
         self.expect(b"d")
-
-        keys = []
-        values = []
-
         while self.peek() != b"e":
-            k = self.read_string()
-            # if keys and k < keys[-1]:
-            #     raise ValueError(
-            #         f"Dictionary keys are not sorted. '{k}' after '{keys[-1]}'"
-            #     )
-
-            keys.append(k)
-            values.append(self.decode_one())
-
-        self.expect(b"e")
-
-        return dict(zip(keys, values))
+            if self.read_key() == key:
+                return
+            self.skip()
+        raise KeyError(key)
+
+    def raw(self, key: bytes) -> memoryview:
+        start, end = self.spans[key]
+        return self.view[start:end]
+
+    def read_number(self, end: int) -> int:
+        n = parse_integer(self.source[self.current : end])
+        self.current = end
+        return n
 
-    def read_number(self) -> int:
-        number = b""
-        while self.peek() in b"0123456789-":
-            number += self.advance()
-        return int(number)
+    def find(self, char: bytes, max_distance: int | None = None) -> int:
+        """Offset of the next `char`, at most `max_distance` bytes ahead."""
+        limit = len(self.source)
+        if max_distance is not None:
+            limit = min(self.current + max_distance, limit)
+        pos = self.source.find(char, self.current, limit)
+        if pos < 0:
+            if limit >= len(self.source):
+                raise IndexError(f"Unexpected end of input, expected {char}")
+            raise ValueError(f"Expected {char} after offset {self.current}")
+        return pos
 
     def peek(self) -> bytes:
-        return self.source[self.current].to_bytes()
+        c = self.source[self.current : self.current + 1]
+        if not c:
+            raise IndexError("Unexpected end of input")
+        return c
 
     def advance(self) -> bytes:
-        c = self.source[self.current]
+        c = self.peek()
         self.current += 1
-        return c.to_bytes()
+        return c
 
     def expect(self, char: bytes) -> bytes:
         if self.peek() != char:
@@ -105,44 +247,317 @@ class Decoder:
         return self.current >= len(self.source)
 
 
+def extract(
+    data: bytes, path: list[bytes | int], **kwargs
+) -> bytes | int | list | dict:
+    """Decode only the value at `path`, jumping over every other subtree.
+
+    Dictionary keys are given as bytes and list indices as ints. Raises
+    KeyError or IndexError when the path does not exist.
+    """
+    decoder = Decoder(data, **kwargs)
+    for key in path:
+        decoder.descend(key)
+    return decoder.decode_one()
+
+
+class StreamDecoder:
+    """Push parser: feed() chunks as they arrive, get back completed values.
+
+    Partially received tokens are kept in `buffer` and parsing resumes where
+    it stopped, so bytes that were already consumed are never scanned again.
+    """
+
+    def __init__(
+        self,
+        max_depth: int = MAX_DEPTH,
+        max_size: int | None = None,
+        max_string_length: int | None = None,
+    ):
+        self.max_depth = max_depth
+        # Limit on the bytes held for the value being parsed: what is left in
+        # `buffer` plus what was already consumed into open containers.
+        self.max_size = max_size
+        self.max_string_length = max_string_length
+        self.consumed = 0
+        self.buffer = bytearray()
+        # Offset in `buffer` up to which we already looked for the terminator
+        # of the pending integer or string length.
+        self.scanned = 0
+        # Open containers, each paired with its pending dictionary key.
+        self.stack: list[list] = []
+
+    def feed(self, chunk: bytes) -> list[bytes | int | list | dict]:
+        buf = self.buffer
+        buf += chunk
+
+        values = []
+        pos = 0
+        value_start = 0
+        size = len(buf)
+        while pos < size:
+            c = buf[pos]
+            if c == 0x65:  # e
+                if not self.stack:
+                    raise ValueError(f"Unexpected b'e' at offset {pos}")
+                container, key = self.stack.pop()
+                if key is not None:
+                    raise ValueError(f"Missing value for key {key!r}")
+                value = container
+                pos += 1
+
+            elif c == 0x6C or c == 0x64:  # l or d
+                if len(self.stack) >= self.max_depth:
+                    raise ValueError(f"Nesting deeper than {self.max_depth}")
+                self.stack.append([[] if c == 0x6C else {}, None])
+                pos += 1
+                continue
+
+            elif c == 0x69:  # i
+                end = self.find(b"e", pos + 1)
+                if end < 0:
+                    break
+                value = parse_integer(buf[pos + 1 : end])
+                pos = end + 1
+
+            elif 0x30 <= c <= 0x39:
+                colon = self.find(b":", pos, MAX_LENGTH_DIGITS)
+                if colon < 0:
+                    break
+                length = parse_length(buf[pos:colon])
+                if (
+                    self.max_string_length is not None
+                    and length > self.max_string_length
+                ):
+                    raise ValueError(f"String of length {length} exceeds limit")
+                end = colon + 1 + length
+                if end > size:
+                    self.scanned = colon
+                    break
+                value = bytes(buf[colon + 1 : end])
+                pos = end
+
+            else:
+                raise NotImplementedError
+
+            self.scanned = 0
+            if self.add(value, values):
+                value_start = pos
+                self.consumed = 0
+
+        if self.max_size is not None:
+            if self.consumed + size - value_start > self.max_size:
+                raise ValueError(f"Value exceeds {self.max_size} bytes")
+
+        self.consumed += pos - value_start
+        del buf[:pos]
+        if self.scanned:
+            self.scanned -= pos
+
+        return values
+
+    def find(self, char: bytes, start: int, max_distance: int | None = None) -> int:
+        buf = self.buffer
+        pos = buf.find(char, max(start, self.scanned))
+        if pos >= 0:
+            return pos
+
+        if max_distance is not None and len(buf) - start > max_distance:
+            raise ValueError(f"Expected {char} after offset {start}")
+        self.scanned = len(buf)
+        return -1
+
+    def add(self, value: bytes | int | list | dict, values: list) -> bool:
+        if not self.stack:
+            values.append(value)
+            return True
+
+        top = self.stack[-1]
+        container, key = top
+        if type(container) is list:
+            container.append(value)
+        elif key is None:
+            if type(value) is not bytes:
+                raise ValueError(f"Dictionary key must be a string, got {value!r}")
+            top[1] = value
+        else:
+            container[key] = value
+            top[1] = None
+        return False
+
+    @property
+    def pending(self) -> bool:
+        return bool(self.buffer or self.stack)
+
+
+class FrozenDict(dict):
+    """A dictionary that refuses modification, see freeze()."""
+
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("FrozenDict is immutable")
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        # The default for dict subclasses refills the copy with __setitem__.
+        return FrozenDict, (dict(self),)
+
+
+def freeze(obj: bytes | int | list | dict) -> bytes | int | tuple | FrozenDict:
+    """Return an immutable copy of `obj` whose encoding an Encoder may cache.
+
+    Lists become tuples and dictionaries become FrozenDicts, recursively.
+    """
+    match obj:
+        case FrozenDict() | tuple():
+            return obj
+
+        case dict():
+            return FrozenDict((k, freeze(v)) for k, v in obj.items())
+
+        case list():
+            return tuple(freeze(i) for i in obj)
+
+        case bytearray() | memoryview():
+            return bytes(obj)
+
+        case _:
+            return obj
+
+
+class EncodeCache:
+    """Bounded LRU of encoded frozen containers, keyed by object identity."""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        # id(obj) -> (obj, encoded). Holding `obj` keeps its id from being
+        # reused by another object while the entry is alive.
+        self.entries: OrderedDict[int, tuple[object, bytes]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, obj: tuple | FrozenDict) -> bytes | None:
+        entry = self.entries.get(id(obj))
+        if entry is None or entry[0] is not obj:
+            return None
+        self.entries.move_to_end(id(obj))
+        return entry[1]
+
+    def put(self, obj: tuple | FrozenDict, data: bytes):
+        self.entries[id(obj)] = (obj, data)
+        self.entries.move_to_end(id(obj))
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
 class Encoder:
-    def encode(self, obj: bytes | int | list | dict) -> bytes:
-        return self.encode_one(obj)
+    # When writing to a file or socket, pending output is flushed once it
+    # grows past this size, and strings at least this large are written
+    # straight from the caller's buffer instead of being copied.
+    FLUSH_SIZE = 2**16
+
+    def __init__(self, cache: EncodeCache | None = None):
+        self.out = bytearray()
+        self.sink = None
+        # Reuses the encoding of frozen containers (see freeze()) that were
+        # already encoded, so mostly static messages only pay for the
+        # parts that changed.
+        self.cache = cache
 
-    def encode_one(self, obj: bytes | int | list | dict) -> bytes:
+    def encode(self, obj: bytes | int | list | dict) -> bytes:
+        return bytes(self.encode_into(obj, bytearray()))
+
+    def encode_into(
+        self, obj: bytes | int | list | dict, buffer: bytearray
+    ) -> bytearray:
+        self.out, self.sink = buffer, None
+        try:
+            self.encode_one(obj)
+        finally:
+            self.out = bytearray()
+        return buffer
+
+    def dump(self, obj: bytes | int | list | dict, fp) -> None:
+        self.out, self.sink = bytearray(), fp
+        try:
+            self.encode_one(obj)
+            self.flush()
+        finally:
+            self.sink = None
+
+    def flush(self):
+        if self.out:
+            self.sink.write(self.out)
+            self.out = bytearray()
+
+    def encode_one(self, obj: bytes | int | list | dict):
         match obj:
+            case FrozenDict() | tuple() if self.cache is not None:
+                self.encode_cached(obj)
+
             case dict():
-                return self.encode_dict(obj)
+                self.encode_dict(obj)
 
-            case list():
-                return self.encode_list(obj)
+            case list() | tuple():
+                self.encode_list(obj)
 
             case int():
-                return self.encode_int(obj)
+                self.encode_int(obj)
 
-            case bytes():
-                return self.encode_string(obj)
+            case bytes() | bytearray() | memoryview():
+                self.encode_string(obj)
 
             case _:
                 raise NotImplementedError
 
-    def encode_string(self, s: bytes) -> bytes:
-        return str(len(s)).encode() + b":" + s
-
-    def encode_int(self, i: int) -> bytes:
-        return f"i{i}e".encode()
-
-    def encode_list(self, lst: list) -> bytes:
-        bstr = bytearray(b"l")
+    def encode_cached(self, obj: tuple | FrozenDict):
+        data = self.cache.get(obj)
+        if data is None:
+            out, sink = self.out, self.sink
+            self.out, self.sink = bytearray(), None
+            try:
+                if isinstance(obj, dict):
+                    self.encode_dict(obj)
+                else:
+                    self.encode_list(obj)
+                data = bytes(self.out)
+            finally:
+                self.out, self.sink = out, sink
+            self.cache.put(obj, data)
+
+        self.write(data)
+
+    def encode_string(self, s: bytes):
+        self.out += b"%d:" % len(s)
+        self.write(s)
+
+    def write(self, data: bytes):
+        if self.sink is None:
+            self.out += data
+        elif len(data) >= self.FLUSH_SIZE:
+            self.flush()
+            self.sink.write(data)
+        else:
+            self.out += data
+            if len(self.out) >= self.FLUSH_SIZE:
+                self.flush()
+
+    def encode_int(self, i: int):
+        self.out += b"i%de" % i
+
+    def encode_list(self, lst: list):
+        self.out += b"l"
         for i in lst:
-            bstr += self.encode_one(i)
-        bstr += b"e"
-        return bytes(bstr)
+            self.encode_one(i)
+        self.out += b"e"
 
-    def encode_dict(self, d: dict) -> bytes:
-        bstr = bytearray(b"d")
+    def encode_dict(self, d: dict):
+        self.out += b"d"
         for k, v in sorted(d.items()):
-            bstr.extend(self.encode_string(k))
-            bstr.extend(self.encode_one(v))
-        bstr += b"e"
-        return bytes(bstr)
+            self.encode_string(k)
+            self.encode_one(v)
+        self.out += b"e"
@@ -0,0 +1,55 @@
+class Bitfield:
+    """One bit per piece, high bit first, as in the `bitfield` message."""
+
+    __slots__ = ("bits", "length")
+
+    def __init__(self, length: int, data: bytes | None = None):
+        self.length = length
+        size = (length + 7) // 8
+        if data is None:
+            self.bits = bytearray(size)
+            return
+
+        if len(data) != size:
+            raise ValueError(f"Bitfield of {len(data)} bytes for {length} pieces")
+        self.bits = bytearray(data)
+        if length % 8 and self.bits[-1] & (0xFF >> length % 8):
+            raise ValueError("Spare bits at the end of the bitfield are set")
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index: int) -> bool:
+        if not 0 <= index < self.length:
+            raise IndexError(f"Piece index {index} out of range")
+        return bool(self.bits[index >> 3] & (0x80 >> (index & 7)))
+
+    def add(self, index: int):
+        if not 0 <= index < self.length:
+            raise IndexError(f"Piece index {index} out of range")
+        self.bits[index >> 3] |= 0x80 >> (index & 7)
+
+    def discard(self, index: int):
+        self.bits[index >> 3] &= ~(0x80 >> (index & 7)) & 0xFF
+
+    def issubset(self, other: "Bitfield") -> bool:
+        """Whether every piece set here is also set in `other`."""
+        return not int.from_bytes(self.bits) & ~int.from_bytes(other.bits)
+
+    def count(self) -> int:
+        return int.from_bytes(self.bits).bit_count()
+
+    @property
+    def complete(self) -> bool:
+        return self.count() == self.length
+
+    def __iter__(self):
+        """Indices of the pieces that are set."""
+        for i, byte in enumerate(self.bits):
+            while byte:
+                bit = byte.bit_length() - 1
+                yield i * 8 + 7 - bit
+                byte ^= 1 << bit
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.bits)
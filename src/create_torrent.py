@@ -0,0 +1,145 @@
+import hashlib
+import os
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+MIN_PIECE_LENGTH = 16 * 2**10
+MAX_PIECE_LENGTH = 16 * 2**20
+# Automatic piece sizes aim for about this many pieces.
+TARGET_PIECE_COUNT = 1500
+
+
+def choose_piece_length(total_length: int) -> int:
+    piece_length = MIN_PIECE_LENGTH
+    while (
+        piece_length < MAX_PIECE_LENGTH
+        and total_length / piece_length > TARGET_PIECE_COUNT
+    ):
+        piece_length *= 2
+    return piece_length
+
+
+def list_files(path: Path) -> list[tuple[Path, list[str]]]:
+    """Files under `path` with their path components, in a stable order."""
+    if path.is_file():
+        return [(path, [path.name])]
+
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for name in sorted(names):
+            p = Path(root) / name
+            files.append((p, list(p.relative_to(path).parts)))
+    return files
+
+
+def read_pieces(files: list[Path], piece_length: int):
+    """Yield the payload split into pieces, reading across file boundaries."""
+    piece = bytearray(piece_length)
+    view = memoryview(piece)
+    filled = 0
+    for file in files:
+        with open(file, "rb", buffering=0) as f:
+            while n := f.readinto(view[filled:]):
+                filled += n
+                if filled == piece_length:
+                    yield piece
+                    piece = bytearray(piece_length)
+                    view = memoryview(piece)
+                    filled = 0
+    if filled:
+        yield view[:filled]
+
+
+def hash_pieces(
+    files: list[Path],
+    piece_length: int,
+    workers: int | None = None,
+    progress: Callable[[int, int], None] | None = None,
+) -> bytes:
+    """SHA-1 of every piece, hashed in a thread pool while the next are read.
+
+    hashlib releases the GIL while hashing large buffers, so the pool uses
+    every core. The number of pieces in flight is bounded to keep memory
+    proportional to `workers * piece_length`.
+    """
+    workers = workers or os.cpu_count() or 1
+    total_length = sum(f.stat().st_size for f in files)
+    piece_count = -(-total_length // piece_length)
+
+    hashes = []
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for piece in read_pieces(files, piece_length):
+            pending.append(executor.submit(lambda p: hashlib.sha1(p).digest(), piece))
+            if len(pending) >= 2 * workers:
+                hashes.append(pending.popleft().result())
+                if progress:
+                    progress(len(hashes), piece_count)
+
+        while pending:
+            hashes.append(pending.popleft().result())
+            if progress:
+                progress(len(hashes), piece_count)
+
+    return b"".join(hashes)
+
+
+def create_torrent(
+    path: str,
+    piece_length: int | None = None,
+    trackers: list[str] | list[list[str]] = (),
+    workers: int | None = None,
+    progress: Callable[[int, int], None] | None = None,
+    comment: str | None = None,
+    private: bool = False,
+) -> dict:
+    """Build the metainfo dictionary of a (v1) torrent for a file or directory.
+
+    `trackers` is either a list of announce URLs or a list of tiers, each a
+    list of URLs (BEP 12). `progress` is called with the number of pieces
+    hashed so far and the total piece count.
+    """
+    root = Path(path)
+    files = list_files(root)
+    if not files:
+        raise ValueError(f"No files to add under {path}")
+
+    total_length = sum(f.stat().st_size for f, _ in files)
+    if piece_length is None:
+        piece_length = choose_piece_length(total_length)
+    if piece_length < MIN_PIECE_LENGTH or piece_length & (piece_length - 1):
+        raise ValueError(f"Invalid piece length {piece_length}")
+
+    info = {
+        b"name": root.name.encode(),
+        b"piece length": piece_length,
+        b"pieces": hash_pieces([f for f, _ in files], piece_length, workers, progress),
+    }
+    if root.is_file():
+        info[b"length"] = total_length
+    else:
+        info[b"files"] = [
+            {b"length": f.stat().st_size, b"path": [p.encode() for p in parts]}
+            for f, parts in files
+        ]
+    if private:
+        info[b"private"] = 1
+
+    metainfo = {
+        b"info": info,
+        b"creation date": int(time.time()),
+        b"created by": b"py-torrent",
+    }
+    tiers = [[t] if isinstance(t, str) else list(t) for t in trackers]
+    if tiers:
+        metainfo[b"announce"] = tiers[0][0].encode()
+    if len(tiers) > 1 or any(len(t) > 1 for t in tiers):
+        metainfo[b"announce-list"] = [[url.encode() for url in t] for t in tiers]
+    if comment:
+        metainfo[b"comment"] = comment.encode()
+
+    return metainfo
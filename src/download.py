@@ -0,0 +1,312 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .bitfield import Bitfield
+from .peer import BLOCK_SIZE
+from .picker import PiecePicker
+from .storage import Storage
+from .torrent_info import TorrentInfo
+
+logger = logging.getLogger(__name__)
+
+# State of each block of a piece being downloaded. RECEIVING blocks are
+# being received in place, straight into the piece's buffer.
+MISSING, REQUESTED, RECEIVING, RECEIVED = range(4)
+
+# Threads hashing and writing completed pieces; hashlib releases the GIL
+# while hashing large buffers.
+VERIFY_WORKERS = min(4, os.cpu_count() or 1)
+
+
+class Piece:
+    """A piece being downloaded: its buffer and the state of every block."""
+
+    __slots__ = (
+        "index",
+        "length",
+        "owner",
+        "data",
+        "blocks",
+        "received",
+        "sources",
+        "hasher",
+        "hashed",
+    )
+
+    def __init__(self, index: int, length: int, owner=None):
+        self.index = index
+        self.length = length
+        # The peer the piece was started for.
+        self.owner = owner
+        self.data = bytearray(length)
+        self.blocks = bytearray(-(-length // BLOCK_SIZE))
+        self.received = 0
+        # Peers that sent blocks of the piece.
+        self.sources = set()
+        # SHA-1 of the first `hashed` bytes, fed as blocks arrive in order.
+        self.hasher = hashlib.sha1()
+        self.hashed = 0
+
+    def block_length(self, block: int) -> int:
+        return min(BLOCK_SIZE, self.length - block * BLOCK_SIZE)
+
+    def next_missing(self) -> int:
+        """Index of the first block not requested yet, -1 if there is none."""
+        return self.blocks.find(MISSING)
+
+    @property
+    def complete(self) -> bool:
+        return self.received == len(self.blocks)
+
+    def hash_received(self):
+        """Feed the hash with the blocks received in order since last time."""
+        end = self.hashed // BLOCK_SIZE
+        while end < len(self.blocks) and self.blocks[end] == RECEIVED:
+            end += 1
+        stop = min(end * BLOCK_SIZE, self.length)
+        if stop > self.hashed:
+            self.hasher.update(memoryview(self.data)[self.hashed : stop])
+            self.hashed = stop
+
+    def reset(self):
+        self.blocks[:] = bytes(len(self.blocks))
+        self.received = 0
+        self.sources.clear()
+        self.hasher = hashlib.sha1()
+        self.hashed = 0
+
+
+class Download:
+    """Which pieces and blocks of a torrent are needed, requested and done.
+
+    Completed pieces are checked against their SHA-1 hash before being
+    written to `storage`; pieces that fail are downloaded again. Blocks are
+    hashed as they arrive in order, and the rest of the hash and the write
+    run in a pool of `workers` threads so as not to stall the event loop.
+    """
+
+    def __init__(
+        self, torrent: TorrentInfo, storage: Storage, workers: int = VERIFY_WORKERS
+    ):
+        if not len(torrent.pieces):
+            raise ValueError("Downloading v2-only torrents is not supported")
+        self.torrent = torrent
+        self.storage = storage
+        self.layout = torrent.layout
+        self.piece_count = self.layout.piece_count
+        self.have = Bitfield(self.piece_count)
+        # Pieces neither done nor started, by how many peers have them. The
+        # caller counts the pieces of every peer it downloads from in it.
+        self.picker = PiecePicker(self.piece_count)
+        self.active: dict[int, Piece] = {}
+        # Complete pieces being verified and written.
+        self.verifying: dict[int, Piece] = {}
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="verify")
+        # Bytes of verified pieces received from peers.
+        self.downloaded = 0
+        self.hash_failures = 0
+        # Number of pieces that failed verification, per peer that sent
+        # every block of them.
+        self.strikes = Counter()
+
+    @property
+    def complete(self) -> bool:
+        return self.have.complete
+
+    @property
+    def left(self) -> int:
+        done = sum(self.layout.piece_size(i) for i in self.have)
+        return max(self.layout.total_length - done, 0)
+
+    def check(self) -> int:
+        """Mark the pieces already on disk as done, to resume a download."""
+        for index in range(self.piece_count):
+            data = self.storage.read_piece(index)
+            if data is not None and self.torrent.pieces.verify(index, data):
+                self.have.add(index)
+                self.picker.remove(index)
+        logger.info(f"Resuming with {self.have.count()}/{self.piece_count} pieces")
+        return self.have.count()
+
+    def interesting(self, available: Bitfield) -> bool:
+        """Whether a peer with `available` pieces has any we still need."""
+        return not available.issubset(self.have)
+
+    def next_request(
+        self, available: Bitfield, peer=None
+    ) -> tuple[int, int, int] | None:
+        """The next block to request from `peer`, which has `available` pieces.
+
+        Peers finish the pieces they started before beginning new ones, so
+        that each piece usually comes from a single peer. New pieces are
+        picked rarest first, and pieces started by other peers are only
+        shared once there is no new piece left to begin.
+        """
+        for piece in self.active.values():
+            if (
+                piece.owner == peer
+                and available[piece.index]
+                and (block := piece.next_missing()) >= 0
+            ):
+                return self.request(piece, block)
+
+        index = self.picker.pick(available)
+        if index is not None:
+            self.picker.remove(index)
+            piece = Piece(index, self.layout.piece_size(index), peer)
+            self.active[index] = piece
+            return self.request(piece, 0)
+
+        for piece in self.active.values():
+            if available[piece.index] and (block := piece.next_missing()) >= 0:
+                return self.request(piece, block)
+        return None
+
+    @property
+    def endgame(self) -> bool:
+        """Whether every block that peers can send us has been requested."""
+        return not self.picker.available() and all(
+            piece.next_missing() < 0 for piece in self.active.values()
+        )
+
+    def endgame_request(
+        self, available: Bitfield, pending
+    ) -> tuple[int, int, int] | None:
+        """A block requested from other peers but not in `pending` yet.
+
+        In endgame mode, blocks are requested from several peers at once so
+        that a slow peer can't hold up the end of the download.
+        """
+        for piece in self.active.values():
+            if not available[piece.index]:
+                continue
+            for block, state in enumerate(piece.blocks):
+                begin = block * BLOCK_SIZE
+                if state == REQUESTED and (piece.index, begin) not in pending:
+                    return piece.index, begin, piece.block_length(block)
+        return None
+
+    def request(self, piece: Piece, block: int) -> tuple[int, int, int]:
+        piece.blocks[block] = REQUESTED
+        return piece.index, block * BLOCK_SIZE, piece.block_length(block)
+
+    def release(self, index: int, begin: int):
+        """Make a requested block available again, e.g. after a peer left."""
+        piece = self.active.get(index)
+        if piece is not None and piece.blocks[begin // BLOCK_SIZE] == REQUESTED:
+            piece.blocks[begin // BLOCK_SIZE] = MISSING
+
+    def block_buffer(self, index: int, begin: int, length: int) -> memoryview | None:
+        """Where to receive a requested block in place, None if unexpected.
+
+        The block is then RECEIVING until block_written() or abandon() is
+        called for it, and no other copy of it is accepted meanwhile.
+        """
+        piece = self.active.get(index)
+        block, rest = divmod(begin, BLOCK_SIZE)
+        if (
+            piece is None
+            or rest
+            or block >= len(piece.blocks)
+            or piece.blocks[block] != REQUESTED
+            or length != piece.block_length(block)
+        ):
+            return None
+        piece.blocks[block] = RECEIVING
+        return memoryview(piece.data)[begin : begin + length]
+
+    def abandon(self, index: int, begin: int):
+        """Give up on a block being received in place, e.g. as a peer left."""
+        piece = self.active.get(index)
+        if piece is not None and piece.blocks[begin // BLOCK_SIZE] == RECEIVING:
+            piece.blocks[begin // BLOCK_SIZE] = MISSING
+
+    def block_written(self, index: int, begin: int, source=None) -> Piece | None:
+        """Like block_received(), for a block received into its block_buffer()."""
+        piece = self.active.get(index)
+        block = begin // BLOCK_SIZE
+        if piece is None or piece.blocks[block] != RECEIVING:
+            return None
+        return self.block_done(piece, block, source)
+
+    def block_received(
+        self, index: int, begin: int, data: bytes, source=None
+    ) -> Piece | None:
+        """Store a block from `source`; return its piece once it is complete.
+
+        The complete piece must then be passed to verify(). Blocks that were
+        not asked for, are being received in place or were already received
+        are ignored.
+        """
+        piece = self.active.get(index)
+        block, rest = divmod(begin, BLOCK_SIZE)
+        if (
+            piece is None
+            or rest
+            or block >= len(piece.blocks)
+            or piece.blocks[block] >= RECEIVING
+            or len(data) != piece.block_length(block)
+        ):
+            logger.debug(f"Ignoring unexpected block {index=} {begin=}")
+            return None
+
+        piece.data[begin : begin + len(data)] = data
+        return self.block_done(piece, block, source)
+
+    def block_done(self, piece: Piece, block: int, source) -> Piece | None:
+        begin = block * BLOCK_SIZE
+        piece.blocks[block] = RECEIVED
+        piece.received += 1
+        piece.sources.add(source)
+        if begin == piece.hashed:
+            piece.hash_received()
+        if not piece.complete:
+            return None
+
+        del self.active[piece.index]
+        self.verifying[piece.index] = piece
+        return piece
+
+    async def verify(self, piece: Piece) -> bool:
+        """Check a complete piece against its hash and write it if it matches.
+
+        Returns False if the piece failed verification, in which case it is
+        downloaded again.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            verified = await loop.run_in_executor(
+                self.executor, self.check_and_write, piece
+            )
+        finally:
+            del self.verifying[piece.index]
+
+        if not verified:
+            logger.warning(f"Piece {piece.index} failed verification")
+            self.hash_failures += 1
+            # A piece assembled from several peers can't be blamed on one.
+            if len(piece.sources) == 1:
+                self.strikes.update(piece.sources)
+            piece.reset()
+            self.active[piece.index] = piece
+            return False
+
+        self.have.add(piece.index)
+        self.downloaded += piece.length
+        return True
+
+    def check_and_write(self, piece: Piece) -> bool:
+        """Finish hashing a piece and write it out; runs in a worker thread."""
+        piece.hasher.update(memoryview(piece.data)[piece.hashed :])
+        if piece.hasher.digest() != self.torrent.pieces.piece_hash(piece.index):
+            return False
+        self.storage.write(piece.index, 0, piece.data)
+        return True
+
+    def close(self):
+        """Wait for the pieces being written."""
+        self.executor.shutdown()
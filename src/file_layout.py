@@ -0,0 +1,143 @@
+from array import array
+from bisect import bisect_right
+from typing import NamedTuple
+
+
+class FileEntry(NamedTuple):
+    path: str
+    length: int
+    # Offset of the file's first byte in the torrent's concatenated payload.
+    offset: int
+
+
+class V2File(NamedTuple):
+    path: str
+    length: int
+    # Root of the file's SHA-256 Merkle tree, None for empty files.
+    pieces_root: bytes | None
+
+
+def parse_file_tree(info: dict) -> list[V2File]:
+    """Flatten the BitTorrent v2 `file tree` of an info dictionary."""
+    name = str(info[b"name"], "utf-8")
+    tree = info[b"file tree"]
+
+    files = []
+
+    def walk(node: dict, path: list[str]):
+        for key, child in node.items():
+            if key == b"":
+                root = child.get(b"pieces root")
+                files.append(V2File("/".join(path), child[b"length"], root))
+            else:
+                walk(child, path + [str(key, "utf-8")])
+
+    # A single file sits at the root of the tree under the torrent's name,
+    # anything else is stored in a directory named after the torrent.
+    single = len(tree) == 1 and b"" in next(iter(tree.values()))
+    walk(tree, [] if single else [name])
+    return files
+
+
+class Extent(NamedTuple):
+    file_index: int
+    file_offset: int
+    length: int
+
+
+class FileLayout:
+    """Maps byte ranges of the torrent payload onto the files that hold them.
+
+    The start offset of every file is kept in a prefix-sum array, so finding
+    the first file of a range is a binary search regardless of file count.
+    """
+
+    def __init__(
+        self,
+        files: list[tuple[str, int]],
+        piece_length: int,
+        padding: set[int] | None = None,
+    ):
+        self.piece_length = piece_length
+        self.files: list[FileEntry] = []
+        self.offsets = array("q")
+        # Indices of the padding files (BEP 47) that align files to pieces.
+        # They are part of the piece space but are never stored.
+        self.padding = padding or set()
+
+        offset = 0
+        for path, length in files:
+            if length < 0:
+                raise ValueError(f"Negative length for file {path!r}")
+            self.files.append(FileEntry(path, length, offset))
+            self.offsets.append(offset)
+            offset += length
+        self.total_length = offset
+
+    @classmethod
+    def from_info(cls, info: dict) -> "FileLayout":
+        name = str(info[b"name"], "utf-8")
+        piece_length = info[b"piece length"]
+        if b"length" in info:
+            return cls([(name, info[b"length"])], piece_length)
+
+        files = []
+        padding = set()
+        if b"files" in info:
+            for f in info[b"files"]:
+                path = "/".join([name] + [str(p, "utf-8") for p in f[b"path"]])
+                if b"p" in bytes(f.get(b"attr", b"")):
+                    padding.add(len(files))
+                files.append((path, f[b"length"]))
+            return cls(files, piece_length, padding)
+
+        # v2-only torrents: every file starts on a piece boundary.
+        offset = 0
+        for f in parse_file_tree(info):
+            if gap := -offset % piece_length:
+                padding.add(len(files))
+                files.append((f"{name}/.pad/{gap}", gap))
+                offset += gap
+            files.append((f.path, f.length))
+            offset += f.length
+        return cls(files, piece_length, padding)
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    @property
+    def data_length(self) -> int:
+        """Size of the payload, not counting padding files."""
+        return self.total_length - sum(self.files[i].length for i in self.padding)
+
+    @property
+    def piece_count(self) -> int:
+        return -(-self.total_length // self.piece_length)
+
+    def piece_size(self, piece: int) -> int:
+        if not 0 <= piece < self.piece_count:
+            raise IndexError(f"Piece index {piece} out of range")
+        return min(self.piece_length, self.total_length - piece * self.piece_length)
+
+    def piece_extents(self, piece: int) -> list[Extent]:
+        return self.extents(piece, 0, self.piece_size(piece))
+
+    def extents(self, piece: int, offset: int, length: int) -> list[Extent]:
+        start = piece * self.piece_length + offset
+        if offset < 0 or length < 0 or start + length > self.total_length:
+            raise ValueError(
+                f"Range ({piece=}, {offset=}, {length=}) is outside the payload"
+            )
+
+        result = []
+        i = bisect_right(self.offsets, start) - 1
+        while length > 0:
+            f = self.files[i]
+            file_offset = start - f.offset
+            size = min(f.length - file_offset, length)
+            if size > 0:
+                result.append(Extent(i, file_offset, size))
+                start += size
+                length -= size
+            i += 1
+        return result
@@ -0,0 +1,128 @@
+import hashlib
+from functools import lru_cache
+
+# BitTorrent v2 (BEP 52) hashes files as binary SHA-256 Merkle trees whose
+# leaves are the hashes of 16 KiB blocks. Leaves past the end of a file are
+# zero, so the tree always has a power of two leaves.
+BLOCK_SIZE = 16 * 2**10
+HASH_SIZE = 32
+
+
+def sha256(data: bytes | memoryview) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+@lru_cache(maxsize=64)
+def pad_hash(height: int) -> bytes:
+    """Root of a subtree made of 2**height zero leaves."""
+    if height == 0:
+        return bytes(HASH_SIZE)
+    h = pad_hash(height - 1)
+    return sha256(h + h)
+
+
+def next_power_of_two(n: int) -> int:
+    return 1 << max(n - 1, 0).bit_length()
+
+
+def log2(n: int) -> int:
+    if n <= 0 or n & (n - 1):
+        raise ValueError(f"{n} is not a power of two")
+    return n.bit_length() - 1
+
+
+def merkle_root(
+    hashes: list[bytes], leaf_count: int | None = None, height: int = 0
+) -> bytes:
+    """Root of the tree over `hashes`, padded up to `leaf_count` leaves.
+
+    `height` is the level of `hashes` in the full tree: padding at level h is
+    the root of an all-zero subtree of height h, which lets a piece layer be
+    hashed up to the file root without materialising the padding blocks.
+    """
+    count = leaf_count or next_power_of_two(len(hashes))
+    if len(hashes) > count:
+        raise ValueError(f"{len(hashes)} hashes do not fit in {count} leaves")
+
+    if not hashes:
+        return pad_hash(height + log2(count))
+
+    layer = list(hashes)
+    level = height
+    while count > 1:
+        if len(layer) % 2:
+            layer.append(pad_hash(level))
+        layer = [sha256(layer[i] + layer[i + 1]) for i in range(0, len(layer), 2)]
+        count //= 2
+        level += 1
+    return layer[0]
+
+
+def block_hashes(data: bytes | memoryview) -> list[bytes]:
+    view = memoryview(data)
+    return [sha256(view[i : i + BLOCK_SIZE]) for i in range(0, len(view), BLOCK_SIZE)]
+
+
+def piece_root(data: bytes | memoryview, piece_length: int) -> bytes:
+    """Hash of one piece as stored in `piece layers`."""
+    return merkle_root(block_hashes(data), piece_length // BLOCK_SIZE)
+
+
+def file_root(data: bytes | memoryview) -> bytes:
+    """The `pieces root` of a whole file."""
+    return merkle_root(block_hashes(data))
+
+
+def piece_layer(data: bytes | memoryview, piece_length: int) -> list[bytes]:
+    view = memoryview(data)
+    return [
+        piece_root(view[i : i + piece_length], piece_length)
+        for i in range(0, len(view), piece_length)
+    ]
+
+
+def layer_root(layer: list[bytes], piece_length: int) -> bytes:
+    """The `pieces root` computed from a file's piece layer."""
+    return merkle_root(layer, height=log2(piece_length // BLOCK_SIZE))
+
+
+def proof(
+    hashes: list[bytes], index: int, leaf_count: int | None = None
+) -> list[bytes]:
+    """Uncle hashes needed to verify `hashes[index]` against the root."""
+    count = leaf_count or next_power_of_two(len(hashes))
+    layer = list(hashes)
+    uncles = []
+    level = 0
+    while count > 1:
+        if len(layer) % 2:
+            layer.append(pad_hash(level))
+        uncles.append(layer[index ^ 1])
+        layer = [sha256(layer[i] + layer[i + 1]) for i in range(0, len(layer), 2)]
+        index //= 2
+        count //= 2
+        level += 1
+    return uncles
+
+
+def verify_proof(leaf: bytes, index: int, uncles: list[bytes], root: bytes) -> bool:
+    h = leaf
+    for uncle in uncles:
+        h = sha256(uncle + h) if index & 1 else sha256(h + uncle)
+        index //= 2
+    return h == root
+
+
+def bad_blocks(
+    data: bytes | memoryview, hashes: list[bytes], root: bytes, leaf_count: int
+) -> list[int]:
+    """Indices of the 16 KiB blocks of `data` that do not match `hashes`.
+
+    `hashes` are the block hashes of the subtree, e.g. received from a peer,
+    and are first checked against the trusted `root` (a piece layer entry or
+    a small file's pieces root). Raises ValueError if they do not match it.
+    """
+    if merkle_root(hashes, leaf_count) != root:
+        raise ValueError("Block hashes do not match the expected root")
+
+    return [i for i, h in enumerate(block_hashes(data)) if h != hashes[i]]
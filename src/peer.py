@@ -0,0 +1,455 @@
+import asyncio
+import logging
+import struct
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import NamedTuple
+
+from .bitfield import Bitfield
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL = b"BitTorrent protocol"
+HANDSHAKE_SIZE = 68
+
+CHOKE, UNCHOKE, INTERESTED, NOT_INTERESTED, HAVE, BITFIELD, REQUEST, PIECE, CANCEL = (
+    range(9)
+)
+
+BLOCK_SIZE = 16 * 2**10
+# Larger messages are refused. The biggest legitimate ones are bitfields of
+# huge torrents and piece messages carrying a block.
+MAX_MESSAGE_SIZE = 2**20
+
+# Requests kept in flight per peer cover this many seconds of its download
+# rate, like libtorrent's request_queue_time. The depth is in blocks.
+REQUEST_QUEUE_TIME = 3
+MIN_QUEUE_DEPTH = 2
+INITIAL_QUEUE_DEPTH = 4
+MAX_QUEUE_DEPTH = 500
+# The download rate is sampled over intervals of this many seconds.
+RATE_INTERVAL = 1.0
+
+# Messages are framed out of a receive buffer of this size, which grows
+# when a message doesn't fit, such as the bitfield of a huge torrent.
+RECEIVE_BUFFER_SIZE = 64 * 2**10
+# Reading from the socket pauses while this many messages are unread.
+MAX_QUEUED_MESSAGES = 64
+
+
+class PeerError(Exception):
+    pass
+
+
+class RequestQueue:
+    """Outstanding block requests to a peer, sized to its bandwidth-delay product.
+
+    Like TCP, the queue starts in slow start: every block received allows one
+    more request in flight, until the measured rate stops growing. From then
+    on the depth follows `rate * queue_time`, so that a peer always has
+    enough requests queued to stay busy for one round trip and more.
+    """
+
+    def __init__(
+        self,
+        queue_time: float = REQUEST_QUEUE_TIME,
+        min_depth: int = MIN_QUEUE_DEPTH,
+        max_depth: int = MAX_QUEUE_DEPTH,
+    ):
+        self.queue_time = queue_time
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.depth = max(min_depth, min(INITIAL_QUEUE_DEPTH, max_depth))
+        self.slow_start = True
+        # (piece, offset) -> length of every request in flight
+        self.pending: dict[tuple[int, int], int] = {}
+        # Download rate in bytes per second.
+        self.rate = 0.0
+        self.sample_start: float | None = None
+        self.sample_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def free(self) -> int:
+        return max(self.depth - len(self.pending), 0)
+
+    def add(self, index: int, begin: int, length: int):
+        if self.sample_start is None:
+            self.sample_start = time.monotonic()
+        self.pending[index, begin] = length
+
+    def received(
+        self, index: int, begin: int, length: int, now: float | None = None
+    ) -> bool:
+        """Account for a block; False if it was not requested from this peer."""
+        if self.pending.get((index, begin)) != length:
+            return False
+        del self.pending[index, begin]
+
+        now = time.monotonic() if now is None else now
+        if self.slow_start:
+            self.depth = min(self.depth + 1, self.max_depth)
+        self.sample_bytes += length
+        elapsed = now - self.sample_start
+        if elapsed >= RATE_INTERVAL:
+            self.update_rate(self.sample_bytes / elapsed)
+            self.sample_start = now
+            self.sample_bytes = 0
+        return True
+
+    def update_rate(self, sample: float):
+        if self.slow_start and sample < self.rate * 1.1:
+            # The queue grew without the rate following: the link is full.
+            self.slow_start = False
+        self.rate = sample if not self.rate else (self.rate + sample) / 2
+        if not self.slow_start:
+            depth = int(self.rate * self.queue_time / BLOCK_SIZE)
+            self.depth = max(self.min_depth, min(depth, self.max_depth))
+
+    def cancel(self, index: int, begin: int) -> int | None:
+        """Forget a request answered by another peer; its length if it was sent."""
+        return self.pending.pop((index, begin), None)
+
+    def clear(self) -> list[tuple[int, int]]:
+        """Forget every request in flight, e.g. when choked, and return them."""
+        requests = list(self.pending)
+        self.pending.clear()
+        self.sample_start = None
+        self.sample_bytes = 0
+        return requests
+
+
+class Block(NamedTuple):
+    """The block of a piece message; `data` is None if it was received in
+    place, into the buffer the connection's sink returned for it."""
+
+    index: int
+    begin: int
+    length: int
+    data: bytes | None
+
+
+class PeerConnection(asyncio.BufferedProtocol):
+    """A connection speaking the peer wire protocol (BEP 3).
+
+    Messages are framed out of a reusable receive buffer. When a piece
+    message starts, `sink` is called with the index, offset and length of
+    its block: if it returns a buffer of that length, the block is copied
+    there and the rest of it is received straight from the socket into it,
+    without allocating anything.
+    """
+
+    def __init__(self, piece_count: int):
+        self.transport: asyncio.Transport | None = None
+        self.peer_id: bytes | None = None
+        # What the remote peer has, and whether it lets us download.
+        self.bitfield = Bitfield(piece_count)
+        self.choking = True
+        self.interested = False
+        self.requests = RequestQueue()
+        self.sink: Callable[[int, int, int], memoryview | None] | None = None
+
+        # Data received but not framed yet is buffer[start:end].
+        self.buffer = bytearray(RECEIVE_BUFFER_SIZE)
+        self.start = self.end = 0
+        self.handshake_done = False
+        # The block being received in place, and the buffer it goes to.
+        self.receiving: Block | None = None
+        self.target: memoryview | None = None
+        self.filled = 0
+
+        self.messages = deque()
+        self.waiter: asyncio.Future | None = None
+        self.error: BaseException | None = None
+        self.closed = False
+        self.reading_paused = False
+        self.writing_paused = False
+        self.drain_waiter: asyncio.Future | None = None
+
+    @classmethod
+    async def open(
+        cls,
+        address: tuple[str, int],
+        info_hash: bytes,
+        peer_id: bytes,
+        piece_count: int,
+        timeout: float = 10,
+    ) -> "PeerConnection":
+        loop = asyncio.get_running_loop()
+        _, conn = await asyncio.wait_for(
+            loop.create_connection(lambda: cls(piece_count), *address), timeout
+        )
+        try:
+            await asyncio.wait_for(conn.handshake(info_hash, peer_id), timeout)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    async def handshake(self, info_hash: bytes, peer_id: bytes):
+        self.transport.write(
+            struct.pack(">B19s8x20s20s", len(PROTOCOL), PROTOCOL, info_hash, peer_id)
+        )
+        await self.drain()
+
+        response = await self.receive()
+        length, protocol, _, remote_hash, self.peer_id = struct.unpack(
+            ">B19s8s20s20s", response
+        )
+        if length != len(PROTOCOL) or protocol != PROTOCOL:
+            raise PeerError(f"Unknown protocol {protocol!r}")
+        if remote_hash != info_hash:
+            raise PeerError("Peer answered with a different info hash")
+        logger.debug(f"Handshake with {self.peer_id!r}")
+
+    # Protocol callbacks, run by the event loop.
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+
+    def connection_lost(self, exc: Exception | None):
+        self.closed = True
+        if self.error is None:
+            self.error = exc or EOFError("Connection closed by the peer")
+        for waiter in (self.waiter, self.drain_waiter):
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        if self.drain_waiter is not None and not self.drain_waiter.done():
+            self.drain_waiter.set_result(None)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self.target is not None:
+            return self.target[self.filled :]
+        if self.end == len(self.buffer):
+            # Move the start of the next message to the front, growing the
+            # buffer if the message is larger.
+            pending = self.end - self.start
+            size = max(RECEIVE_BUFFER_SIZE, self.message_size(), pending + 1)
+            if size > len(self.buffer):
+                buffer = bytearray(size)
+                buffer[:pending] = self.buffer[self.start : self.end]
+                self.buffer = buffer
+            else:
+                self.buffer[:pending] = self.buffer[self.start : self.end]
+            self.start, self.end = 0, pending
+        return memoryview(self.buffer)[self.end :]
+
+    def buffer_updated(self, nbytes: int):
+        if self.target is not None:
+            self.filled += nbytes
+            if self.filled == len(self.target):
+                self.deliver((PIECE, self.receiving))
+                self.receiving = self.target = None
+            return
+        self.end += nbytes
+        try:
+            self.frame()
+        except PeerError as e:
+            self.error = e
+            self.transport.close()
+
+    def message_size(self) -> int:
+        """Size of the message starting the buffer, header included."""
+        if not self.handshake_done:
+            return HANDSHAKE_SIZE
+        if self.end - self.start < 4:
+            return 4
+        (length,) = struct.unpack_from(">I", self.buffer, self.start)
+        return 4 + min(length, MAX_MESSAGE_SIZE)
+
+    def frame(self):
+        """Queue every complete message in the buffer."""
+        buffer = self.buffer
+        while not self.closed:
+            start = self.start
+            available = self.end - start
+            if not self.handshake_done:
+                if available < HANDSHAKE_SIZE:
+                    break
+                self.deliver(bytes(buffer[start : start + HANDSHAKE_SIZE]))
+                self.start += HANDSHAKE_SIZE
+                self.handshake_done = True
+                continue
+
+            if available < 4:
+                break
+            (length,) = struct.unpack_from(">I", buffer, start)
+            if length > MAX_MESSAGE_SIZE:
+                raise PeerError(f"Message of {length} bytes is too large")
+            if length == 0:
+                self.deliver(None)
+                self.start += 4
+                continue
+
+            if (
+                available >= 13
+                and buffer[start + 4] == PIECE
+                and length > 9
+                and self.sink is not None
+                and self.receive_in_place(length - 9)
+            ):
+                if self.target is not None:
+                    break
+                continue
+
+            if available < 4 + length:
+                break
+            self.deliver(
+                (buffer[start + 4], bytes(buffer[start + 5 : start + 4 + length]))
+            )
+            self.start += 4 + length
+
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def receive_in_place(self, length: int) -> bool:
+        """Start receiving the block of the piece message in the buffer into
+        the sink; False if the sink doesn't want it."""
+        start = self.start
+        index, begin = struct.unpack_from(">II", self.buffer, start + 5)
+        target = self.sink(index, begin, length)
+        if target is None:
+            return False
+
+        copied = min(self.end - start - 13, length)
+        target[:copied] = memoryview(self.buffer)[start + 13 : start + 13 + copied]
+        self.start += 13 + copied
+        block = Block(index, begin, length, None)
+        if copied == length:
+            self.deliver((PIECE, block))
+        else:
+            self.receiving, self.target, self.filled = block, target, copied
+        return True
+
+    def deliver(self, message):
+        self.messages.append(message)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+        if len(self.messages) >= MAX_QUEUED_MESSAGES and not self.reading_paused:
+            self.reading_paused = True
+            self.transport.pause_reading()
+
+    async def receive(self):
+        """The next item framed out of the stream."""
+        while not self.messages:
+            if self.closed:
+                raise self.error
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+
+        message = self.messages.popleft()
+        if self.reading_paused and len(self.messages) <= MAX_QUEUED_MESSAGES // 2:
+            self.reading_paused = False
+            if not self.closed:
+                self.transport.resume_reading()
+        return message
+
+    def abandoned_blocks(self) -> list[Block]:
+        """Blocks received in place, fully or not, that were never read."""
+        blocks = [
+            message[1]
+            for message in self.messages
+            if isinstance(message, tuple) and isinstance(message[1], Block)
+        ]
+        if self.receiving is not None:
+            blocks.append(self.receiving)
+        return blocks
+
+    async def read_message(self) -> tuple[int, bytes | Block] | None:
+        """Read the next message; None is a keep-alive.
+
+        The payload of piece messages is returned as a Block. Choke, unchoke,
+        have and bitfield messages also update the state of the connection.
+        Have messages for pieces the peer already announced carry no news and
+        are returned as None too.
+        """
+        message = await self.receive()
+        if message is None:
+            return None
+
+        msg_id, payload = message
+        try:
+            if msg_id == PIECE and not isinstance(payload, Block):
+                index, begin, data = parse_piece(payload)
+                payload = Block(index, begin, len(data), data)
+            elif msg_id == CHOKE:
+                self.choking = True
+            elif msg_id == UNCHOKE:
+                self.choking = False
+            elif msg_id == HAVE:
+                index = parse_have(payload)
+                if self.bitfield[index]:
+                    return None
+                self.bitfield.add(index)
+            elif msg_id == BITFIELD:
+                self.bitfield = Bitfield(len(self.bitfield), payload)
+        except (ValueError, IndexError, struct.error) as e:
+            raise PeerError(f"Invalid message {msg_id}: {e}") from e
+        return msg_id, payload
+
+    def send(self, msg_id: int, payload: bytes = b""):
+        self.transport.write(struct.pack(">IB", len(payload) + 1, msg_id) + payload)
+
+    def send_interested(self):
+        if not self.interested:
+            self.interested = True
+            self.send(INTERESTED)
+
+    def send_not_interested(self):
+        if self.interested:
+            self.interested = False
+            self.send(NOT_INTERESTED)
+
+    def send_have(self, index: int):
+        self.send(HAVE, struct.pack(">I", index))
+
+    def send_request(self, index: int, begin: int, length: int):
+        self.send(REQUEST, struct.pack(">III", index, begin, length))
+
+    def send_requests(self, requests: list[tuple[int, int, int]]):
+        """Send several requests with a single write."""
+        self.transport.write(
+            b"".join(struct.pack(">IBIII", 13, REQUEST, *r) for r in requests)
+        )
+
+    def send_cancel(self, index: int, begin: int, length: int):
+        self.send(CANCEL, struct.pack(">III", index, begin, length))
+
+    async def drain(self):
+        """Wait until the data written so far has mostly been sent."""
+        if self.writing_paused and not self.closed:
+            self.drain_waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.drain_waiter
+            finally:
+                self.drain_waiter = None
+        if self.closed:
+            raise self.error
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+def parse_piece(payload: bytes) -> tuple[int, int, bytes]:
+    """Split the payload of a piece message into index, offset and block."""
+    if len(payload) < 8:
+        raise PeerError("Truncated piece message")
+    index, begin = struct.unpack_from(">II", payload)
+    return index, begin, payload[8:]
+
+
+def parse_have(payload: bytes) -> int:
+    (index,) = struct.unpack(">I", payload)
+    return index
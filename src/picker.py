@@ -0,0 +1,102 @@
+import random
+from array import array
+from itertools import chain
+
+from .bitfield import Bitfield
+
+# Position of the pieces that are no longer wanted.
+REMOVED = 0xFFFFFFFF
+
+
+class PiecePicker:
+    """Rarest-first choice of the next piece to download.
+
+    `availability` counts the connected peers having each piece. Wanted
+    pieces are kept in `order`, sorted by availability: pieces seen at `a`
+    peers fill order[starts[a]:starts[a + 1]]. When a peer gains or loses a
+    piece, the piece is swapped with the last or first piece of its run and
+    the boundary between the two runs moves by one, so keeping the order
+    costs O(1).
+    """
+
+    def __init__(self, piece_count: int):
+        self.availability = array("H", bytes(2 * piece_count))
+        self.order = array("I", range(piece_count))
+        self.position = array("I", range(piece_count))
+        # starts[-1] is the number of wanted pieces.
+        self.starts = [0, piece_count]
+
+    def __len__(self) -> int:
+        """Number of pieces still wanted."""
+        return self.starts[-1]
+
+    def available(self) -> int:
+        """Number of wanted pieces that at least one peer has."""
+        return self.starts[-1] - self.starts[1]
+
+    def swap(self, i: int, j: int):
+        a, b = self.order[i], self.order[j]
+        self.order[i], self.order[j] = b, a
+        self.position[a], self.position[b] = j, i
+
+    def increment(self, index: int):
+        """Count one more peer having the piece."""
+        count = self.availability[index]
+        self.availability[index] = count + 1
+        if self.position[index] == REMOVED:
+            return
+        starts = self.starts
+        if count + 2 == len(starts):
+            starts.append(starts[-1])
+        # The piece becomes the first of the next run.
+        starts[count + 1] -= 1
+        self.swap(self.position[index], starts[count + 1])
+
+    def decrement(self, index: int):
+        """Count one less peer having the piece."""
+        count = self.availability[index]
+        self.availability[index] = count - 1
+        if self.position[index] == REMOVED:
+            return
+        # The piece becomes the last of the previous run.
+        self.swap(self.position[index], self.starts[count])
+        self.starts[count] += 1
+
+    def add_peer(self, bitfield: Bitfield):
+        for index in bitfield:
+            self.increment(index)
+
+    def remove_peer(self, bitfield: Bitfield):
+        for index in bitfield:
+            self.decrement(index)
+
+    def remove(self, index: int):
+        """Stop offering a piece, once it is downloaded or being downloaded."""
+        if self.position[index] == REMOVED:
+            return
+        # Move the piece up to the last run, then past its end.
+        starts = self.starts
+        for count in range(self.availability[index], len(starts) - 1):
+            starts[count + 1] -= 1
+            self.swap(self.position[index], starts[count + 1])
+        self.position[index] = REMOVED
+
+    def pick(self, available: Bitfield) -> int | None:
+        """The rarest wanted piece in `available`, None if there is none.
+
+        Each run of equally rare pieces is scanned from a random offset, to
+        break ties at random. Only pieces counted in `availability` are
+        considered, so the pieces of a peer must have been added with
+        add_peer() or increment().
+        """
+        order = self.order
+        starts = self.starts
+        for count in range(1, len(starts) - 1):
+            start, end = starts[count], starts[count + 1]
+            if start == end:
+                continue
+            offset = random.randrange(start, end)
+            for i in chain(range(offset, end), range(start, offset)):
+                if available[order[i]]:
+                    return order[i]
+        return None
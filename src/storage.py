@@ -0,0 +1,84 @@
+import os
+import threading
+from pathlib import Path
+
+from .file_layout import FileLayout
+
+
+class Storage:
+    """Reads and writes piece data in the files of a torrent under `root`.
+
+    Files are created on first write and opened at most once. Padding files
+    are never stored: writes to them are dropped and reads return zeros.
+    Reads and writes may be made from several threads at once.
+    """
+
+    def __init__(self, layout: FileLayout, root: str | Path):
+        self.layout = layout
+        self.root = Path(root)
+        self.handles = {}
+        self.lock = threading.Lock()
+
+    def path(self, file_index: int) -> Path:
+        path = Path(self.layout.files[file_index].path)
+        # Paths come from the metainfo and must stay inside `root`.
+        if path.is_absolute() or ".." in path.parts:
+            raise ValueError(f"Unsafe file path {str(path)!r}")
+        return self.root / path
+
+    def open(self, file_index: int, create: bool):
+        f = self.handles.get(file_index)
+        if f is not None:
+            return f
+
+        with self.lock:
+            f = self.handles.get(file_index)
+            if f is not None:
+                return f
+            path = self.path(file_index)
+            if not path.exists():
+                if not create:
+                    return None
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.touch()
+            f = self.handles[file_index] = open(path, "r+b", buffering=0)
+            return f
+
+    def write(self, piece: int, offset: int, data: bytes | memoryview):
+        view = memoryview(data)
+        for extent in self.layout.extents(piece, offset, len(view)):
+            chunk, view = view[: extent.length], view[extent.length :]
+            if extent.file_index in self.layout.padding:
+                continue
+            f = self.open(extent.file_index, create=True)
+            os.pwrite(f.fileno(), chunk, extent.file_offset)
+
+    def read(self, piece: int, offset: int, length: int) -> bytes | None:
+        """Read a range of the payload; None if part of it was never written."""
+        data = bytearray(length)
+        view = memoryview(data)
+        for extent in self.layout.extents(piece, offset, length):
+            chunk, view = view[: extent.length], view[extent.length :]
+            if extent.file_index in self.layout.padding:
+                continue
+            f = self.open(extent.file_index, create=False)
+            if f is None:
+                return None
+            n = os.preadv(f.fileno(), [chunk], extent.file_offset)
+            if n < extent.length:
+                return None
+        return bytes(data)
+
+    def read_piece(self, piece: int) -> bytes | None:
+        return self.read(piece, 0, self.layout.piece_size(piece))
+
+    def create_empty_files(self):
+        """Empty files hold no piece data, so nothing else creates them."""
+        for i, f in enumerate(self.layout.files):
+            if f.length == 0 and i not in self.layout.padding:
+                self.open(i, create=True)
+
+    def close(self):
+        for f in self.handles.values():
+            f.close()
+        self.handles.clear()
@@ -0,0 +1,363 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+
+from .download import Download, Piece
+from .peer import (
+    BITFIELD,
+    CHOKE,
+    HAVE,
+    PIECE,
+    PeerConnection,
+    PeerError,
+    parse_have,
+)
+from .torrent_info import TorrentInfo
+from .tracker import TrackerClient
+
+logger = logging.getLogger(__name__)
+
+# Peers connected, or being connected to, at the same time.
+MAX_CONNECTIONS = 30
+# Seconds a peer may leave our requests unanswered before it is dropped.
+PEER_TIMEOUT = 30
+# Seconds a peer we have nothing to ask may stay silent before it is dropped.
+IDLE_TIMEOUT = 120
+# While new peers are waiting for a free connection slot, the slowest peer
+# connected for at least this many seconds is dropped this often.
+ROTATE_INTERVAL = 15
+# Peers that alone sent this many pieces failing verification are banned.
+MAX_STRIKES = 2
+# Complete pieces waiting to be verified before peers stop being read from.
+MAX_VERIFYING = 8
+# Announces in a row without any peer or progress before giving up.
+MAX_ANNOUNCES = 5
+# Delay between announces while no peer is connected or waiting.
+RETRY_DELAY = 5
+
+Address = tuple[str, int]
+
+
+class SwarmManager:
+    """Downloads a torrent from up to `max_connections` peers concurrently.
+
+    Every connected peer pulls blocks from the shared `download`, so each
+    one gets a share of the work proportional to its upload rate. Peers that
+    disconnect, stop answering or send corrupt data are replaced by the next
+    peers found by the trackers, and while peers are waiting for a free slot
+    the slowest connected peer is periodically dropped to make room.
+    """
+
+    def __init__(
+        self,
+        torrent: TorrentInfo,
+        download: Download,
+        peer_id: bytes,
+        tracker: TrackerClient,
+        max_connections: int = MAX_CONNECTIONS,
+        peer_timeout: float = PEER_TIMEOUT,
+        rotate_interval: float = ROTATE_INTERVAL,
+        max_verifying: int = MAX_VERIFYING,
+    ):
+        self.torrent = torrent
+        self.download = download
+        self.peer_id = peer_id
+        self.tracker = tracker
+        self.max_connections = max_connections
+        self.peer_timeout = peer_timeout
+        self.rotate_interval = rotate_interval
+
+        # Peers not tried yet, in the order they were found.
+        self.candidates: deque[Address] = deque()
+        # Peers waiting, being connected to or connected.
+        self.known: set[Address] = set()
+        self.banned: set[Address] = set()
+        self.tasks: dict[Address, asyncio.Task] = {}
+        self.connections: dict[Address, PeerConnection] = {}
+        self.connected_at: dict[Address, float] = {}
+        # Once every block has been requested, blocks still in flight are
+        # requested from several peers and cancelled when one arrives.
+        self.endgame = False
+        # Pieces being verified; when too many are queued, sessions wait
+        # for some to finish before reading more from their peer.
+        self.max_verifying = max_verifying
+        self.verifying: set[asyncio.Task] = set()
+        # A storage error that ended the download.
+        self.error: OSError | None = None
+        # Set whenever a slot frees up, peers are found or a piece completes.
+        self.changed = asyncio.Event()
+
+    def add_peers(self, peers: list[Address]):
+        for address in peers:
+            if address not in self.known and address not in self.banned:
+                self.known.add(address)
+                self.candidates.append(address)
+        self.changed.set()
+
+    @property
+    def starving(self) -> bool:
+        return not self.connections and not self.candidates
+
+    async def run(self) -> bool:
+        """Download until every piece is done or the trackers have no peers.
+
+        Returns whether the download is complete.
+        """
+        announcer = asyncio.create_task(self.announce_loop())
+        next_rotation = time.monotonic() + self.rotate_interval
+        try:
+            while (
+                not self.download.complete
+                and not announcer.done()
+                and self.error is None
+            ):
+                self.connect()
+                now = time.monotonic()
+                if now >= next_rotation:
+                    self.drop_slowest(now)
+                    next_rotation = now + self.rotate_interval
+
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(
+                        self.changed.wait(), next_rotation - time.monotonic()
+                    )
+                except TimeoutError:
+                    pass
+        finally:
+            tasks = [announcer, *self.tasks.values(), *self.verifying]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self.error is not None:
+            raise self.error
+        return self.download.complete
+
+    async def announce_loop(self):
+        """Announce at the trackers' interval, or sooner while without peers.
+
+        Swarms smaller than `max_connections` are the norm, so the interval
+        is only cut short when no peer is connected or waiting.
+        """
+        event = "started"
+        fruitless = 0
+        try:
+            while True:
+                have = self.download.have.count()
+                peers = await self.tracker.announce(
+                    event, downloaded=self.download.downloaded, left=self.download.left
+                )
+                event = None
+                self.add_peers(peers)
+
+                due = self.tracker.next_announce()
+                await asyncio.sleep(RETRY_DELAY)
+                while time.monotonic() < due and not self.starving:
+                    await asyncio.sleep(RETRY_DELAY)
+
+                if self.connections or self.download.have.count() > have:
+                    fruitless = 0
+                else:
+                    fruitless += 1
+                    if fruitless >= MAX_ANNOUNCES:
+                        logger.warning("No peer to download from, giving up")
+                        return
+        finally:
+            self.changed.set()
+
+    def connect(self):
+        """Start connecting to waiting peers while there are free slots."""
+        while self.candidates and len(self.tasks) < self.max_connections:
+            address = self.candidates.popleft()
+            self.tasks[address] = asyncio.create_task(self.session(address))
+
+    def drop_slowest(self, now: float):
+        """Make room for a waiting peer by dropping the slowest connected one."""
+        if not self.candidates or len(self.tasks) < self.max_connections:
+            return
+        rates = [
+            (conn.requests.rate, address)
+            for address, conn in self.connections.items()
+            if now - self.connected_at[address] >= self.rotate_interval
+        ]
+        if rates:
+            rate, address = min(rates)
+            logger.info(f"Replacing {address}, the slowest peer at {rate:.0f} B/s")
+            self.tasks[address].cancel()
+
+    async def session(self, address: Address):
+        try:
+            await self.download_from(address)
+        except (PeerError, OSError, EOFError, TimeoutError) as e:
+            logger.info(f"Peer {address} failed: {e!r}")
+        finally:
+            del self.tasks[address]
+            # Peers that left may be tried again if the trackers return them.
+            self.known.discard(address)
+            self.changed.set()
+
+    async def download_from(self, address: Address):
+        """Download pieces from one peer until it has nothing more we need."""
+        download = self.download
+        conn = await PeerConnection.open(
+            address, self.torrent.swarm_hash, self.peer_id, download.piece_count
+        )
+        logger.info(f"Connected to {address}, peer id {conn.peer_id!r}")
+        conn.sink = functools.partial(self.block_buffer, conn)
+        self.connections[address] = conn
+        self.connected_at[address] = time.monotonic()
+
+        picker = download.picker
+        try:
+            while not download.complete:
+                if not conn.choking and conn.interested:
+                    self.fill_requests(conn, address)
+                    if not conn.requests and not download.interesting(conn.bitfield):
+                        logger.info(f"Nothing more to download from {address}")
+                        return
+                await conn.drain()
+
+                timeout = self.peer_timeout if conn.requests else IDLE_TIMEOUT
+                previous = conn.bitfield
+                message = await asyncio.wait_for(conn.read_message(), timeout)
+                if message is None:
+                    continue
+
+                msg_id, payload = message
+                if msg_id == PIECE:
+                    index, begin, length, data = payload
+                    expected = conn.requests.received(index, begin, length)
+                    if expected and self.endgame:
+                        self.cancel_duplicates(index, begin)
+                    if data is None:
+                        # Received in place: the data is there even if the
+                        # request was since released.
+                        piece = download.block_written(index, begin, address)
+                    elif expected:
+                        piece = download.block_received(index, begin, data, address)
+                    else:
+                        continue
+                    if piece is not None:
+                        task = asyncio.create_task(self.verify(piece))
+                        self.verifying.add(task)
+                        task.add_done_callback(self.verifying.discard)
+                        while len(self.verifying) >= self.max_verifying:
+                            await asyncio.wait(
+                                self.verifying, return_when=asyncio.FIRST_COMPLETED
+                            )
+                elif msg_id == CHOKE:
+                    # Choking discards our outstanding requests.
+                    self.release(conn.requests.clear())
+                elif msg_id == BITFIELD:
+                    picker.remove_peer(previous)
+                    picker.add_peer(conn.bitfield)
+                    if download.interesting(conn.bitfield):
+                        conn.send_interested()
+                elif msg_id == HAVE:
+                    index = parse_have(payload)
+                    picker.increment(index)
+                    if not download.have[index]:
+                        conn.send_interested()
+        finally:
+            del self.connections[address], self.connected_at[address]
+            picker.remove_peer(conn.bitfield)
+            conn.close()
+            for block in conn.abandoned_blocks():
+                download.abandon(block.index, block.begin)
+            self.release(conn.requests.clear())
+
+    def fill_requests(self, conn: PeerConnection, address: Address):
+        """Top up the peer's request pipeline to its current queue depth."""
+        download = self.download
+        requests = []
+        for _ in range(conn.requests.free()):
+            request = download.next_request(conn.bitfield, address)
+            # In endgame mode, peers take one block in flight elsewhere at a
+            # time, once they have nothing else to do.
+            if (
+                request is None
+                and not conn.requests
+                and (self.endgame or self.start_endgame())
+            ):
+                request = download.endgame_request(conn.bitfield, conn.requests.pending)
+            if request is None:
+                break
+            conn.requests.add(*request)
+            requests.append(request)
+        if requests:
+            conn.send_requests(requests)
+
+    async def verify(self, piece: Piece):
+        sources = set(piece.sources)
+        try:
+            verified = await self.download.verify(piece)
+        except OSError as e:
+            logger.error(f"Failed to write piece {piece.index}: {e!r}")
+            self.error = e
+            self.changed.set()
+            return
+
+        if verified:
+            self.piece_completed(piece.index)
+            return
+        # The piece's blocks are up for grabs again.
+        self.wake()
+        for address in sources:
+            if self.download.strikes[address] >= MAX_STRIKES:
+                logger.info(f"Banning {address} for sending corrupt data")
+                self.banned.add(address)
+                if address in self.tasks:
+                    self.tasks[address].cancel()
+
+    def block_buffer(
+        self, conn: PeerConnection, index: int, begin: int, length: int
+    ) -> memoryview | None:
+        """Where `conn` receives a block we requested from it."""
+        if conn.requests.pending.get((index, begin)) != length:
+            return None
+        return self.download.block_buffer(index, begin, length)
+
+    def start_endgame(self) -> bool:
+        if not self.download.endgame:
+            return False
+        logger.info("All blocks requested, entering endgame mode")
+        self.endgame = True
+        # Idle peers can now help with the blocks in flight.
+        asyncio.get_running_loop().call_soon(self.wake)
+        return True
+
+    def cancel_duplicates(self, index: int, begin: int):
+        """Cancel the requests for a block that arrived from another peer."""
+        for conn in self.connections.values():
+            length = conn.requests.cancel(index, begin)
+            if length is not None:
+                conn.send_cancel(index, begin, length)
+
+    def release(self, requests: list[tuple[int, int]]):
+        """Return blocks no longer requested from a peer to the download."""
+        if not requests:
+            return
+        for index, begin in requests:
+            if self.endgame and any(
+                (index, begin) in conn.requests.pending
+                for conn in self.connections.values()
+            ):
+                continue
+            self.download.release(index, begin)
+        self.wake()
+
+    def wake(self):
+        """Hand blocks that became available again to peers with free slots."""
+        if self.download.complete:
+            return
+        for address, conn in self.connections.items():
+            if not conn.choking and conn.interested and conn.requests.free():
+                self.fill_requests(conn, address)
+
+    def piece_completed(self, index: int):
+        for conn in self.connections.values():
+            conn.send_have(index)
+        self.changed.set()
@@ -1,15 +1,99 @@
 import hashlib
+import mmap
+import os
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import NamedTuple
 
 import requests
 
+from . import merkle
 from .bencode import Decoder, Encoder
+from .file_layout import FileEntry, FileLayout, V2File, parse_file_tree
+from .tracker import response_peers
 
 PEER_ID = "Hj5kP9xZ2qLmNb7vYc3w"
 
 
+class LoadResult(NamedTuple):
+    path: str
+    torrent: "TorrentInfo | None"
+    error: Exception | None
+
+
+class PieceHashes(Sequence):
+    """The SHA-1 piece hashes, as views into the original `pieces` string."""
+
+    __slots__ = ("view",)
+
+    HASH_SIZE = 20
+
+    def __init__(self, pieces: bytes | memoryview):
+        if len(pieces) % self.HASH_SIZE:
+            raise ValueError(
+                f"Length of pieces ({len(pieces)}) is not a multiple of 20"
+            )
+        self.view = memoryview(pieces)
+
+    def __len__(self) -> int:
+        return len(self.view) // self.HASH_SIZE
+
+    def __getitem__(self, index: int | slice) -> memoryview | list[memoryview]:
+        if isinstance(index, slice):
+            return [self.piece_hash(i) for i in range(*index.indices(len(self)))]
+        return self.piece_hash(index)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, PieceHashes):
+            return self.view == other.view
+        return list(self) == other
+
+    def piece_hash(self, index: int) -> memoryview:
+        count = len(self.view) // self.HASH_SIZE
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError(f"Piece index {index} out of range")
+
+        start = index * self.HASH_SIZE
+        return self.view[start : start + self.HASH_SIZE]
+
+    def verify(self, index: int, data: bytes | memoryview) -> bool:
+        return hashlib.sha1(data).digest() == self.piece_hash(index)
+
+
 class TorrentInfo:
-    def __init__(self, metainfo: dict):
+    __slots__ = (
+        "metainfo",
+        "raw_info",
+        "hashes",
+        "pieces",
+        "layout",
+        "v2_files",
+        "layers",
+    )
+
+    def __init__(self, metainfo: dict, raw_info: bytes | memoryview | None = None):
         self.metainfo = metainfo
+        # The info dictionary exactly as it appeared in the metainfo file. The
+        # info hash must be computed over these bytes: re-encoding `info` only
+        # gives the same result when the original encoding was canonical.
+        self.raw_info = raw_info
+        # The SHA-1 and SHA-256 info hashes, computed on first use: hashing
+        # reads the whole info dictionary, pieces included, which a memory
+        # mapped file otherwise only pages in when they are used.
+        self.hashes: tuple[tuple, tuple | None] | None = None
+        self.index()
+
+    def index(self):
+        self.pieces = PieceHashes(self.info.get(b"pieces", b""))
+        self.layout = FileLayout.from_info(self.info)
+        self.v2_files: list[V2File] = []
+        if b"file tree" in self.info:
+            self.v2_files = parse_file_tree(self.info)
+        # Piece layers of v2 files, by file index, once checked.
+        self.layers: dict[int, list[memoryview]] = {}
 
     def __str__(self):
         str = f"Tracker URL: {self.url}\n"
@@ -24,24 +108,110 @@ class TorrentInfo:
         return self.metainfo[b"info"]
 
     @property
-    def info_hash(self):
-        data = Encoder().encode(self.info)
+    def info_hash(self) -> tuple[bytes, str]:
+        """SHA-1 of the info dictionary, as a digest and in hex."""
+        if self.hashes is None:
+            self.hash_info()
+        return self.hashes[0]
+
+    @property
+    def info_hash_v2(self) -> tuple[bytes, str] | None:
+        """SHA-256 of the info dictionary for v2 torrents, None otherwise."""
+        if self.hashes is None:
+            self.hash_info()
+        return self.hashes[1]
+
+    def hash_info(self):
+        data = self.raw_info
+        if data is None:
+            data = Encoder().encode(self.info)
         sha1_hash = hashlib.sha1(data)
-        return (sha1_hash.digest(), sha1_hash.hexdigest())
+        info_hash = (sha1_hash.digest(), sha1_hash.hexdigest())
+
+        info_hash_v2 = None
+        if self.meta_version == 2:
+            sha256_hash = hashlib.sha256(data)
+            info_hash_v2 = (sha256_hash.digest(), sha256_hash.hexdigest())
+        self.hashes = (info_hash, info_hash_v2)
+
+    def __getstate__(self):
+        raw_info = self.raw_info
+        # Views into the file buffer cannot be pickled, ship a copy instead.
+        if isinstance(raw_info, memoryview):
+            raw_info = raw_info.tobytes()
+        return (self.metainfo, raw_info, self.hashes)
+
+    def __setstate__(self, state):
+        self.metainfo, self.raw_info, self.hashes = state
+        self.index()
+
+    @property
+    def meta_version(self) -> int:
+        return self.info.get(b"meta version", 1)
+
+    @property
+    def is_hybrid(self) -> bool:
+        return self.meta_version == 2 and b"pieces" in self.info
+
+    @property
+    def swarm_hash(self) -> bytes:
+        """The 20-byte hash sent to trackers and peers.
+
+        v1 and hybrid torrents use the SHA-1 info hash, v2-only torrents the
+        SHA-256 info hash truncated to 20 bytes.
+        """
+        if self.meta_version == 2 and not self.is_hybrid:
+            return self.info_hash_v2[0][:20]
+        return self.info_hash[0]
+
+    def piece_layer(self, file_index: int) -> list[memoryview]:
+        """The SHA-256 hash of every piece of a v2 file.
+
+        Files no larger than one piece have no layer: their pieces root is
+        the hash of their only piece. Raises ValueError if the layer stored
+        in the metainfo does not hash to the file's pieces root. Layers are
+        checked on first use and kept, so verifying a piece is one lookup.
+        """
+        if (hashes := self.layers.get(file_index)) is not None:
+            return hashes
+        f = self.v2_files[file_index]
+        if f.pieces_root is None:
+            return []
+        if f.length <= self.piece_length:
+            return [memoryview(f.pieces_root)]
+
+        layer = memoryview(self.metainfo[b"piece layers"][f.pieces_root])
+        hashes = [
+            layer[i : i + merkle.HASH_SIZE]
+            for i in range(0, len(layer), merkle.HASH_SIZE)
+        ]
+        root = merkle.layer_root([bytes(h) for h in hashes], self.piece_length)
+        if root != f.pieces_root:
+            raise ValueError(f"Piece layer of {f.path!r} does not match its root")
+        self.layers[file_index] = hashes
+        return hashes
+
+    def verify_piece_v2(
+        self, file_index: int, piece: int, data: bytes | memoryview
+    ) -> bool:
+        """Check `piece` of a v2 file, counting pieces from the file's start."""
+        f = self.v2_files[file_index]
+        expected = self.piece_layer(file_index)[piece]
+        if f.length <= self.piece_length:
+            return merkle.file_root(data) == expected
+        return merkle.piece_root(data, self.piece_length) == expected
 
     @property
     def url(self):
-        return self.metainfo[b"announce"].decode()
+        return str(self.metainfo[b"announce"], "utf-8")
 
     @property
     def length(self):
-        return self.info[b"length"]
+        return self.layout.data_length
 
     @property
-    def pieces(self):
-        all = self.info[b"pieces"]
-        pieces = [all[i : i + 20] for i in range(0, len(all), 20)]
-        return pieces
+    def files(self) -> list[FileEntry]:
+        return self.layout.files
 
     @property
     def piece_length(self):
@@ -50,16 +220,16 @@ class TorrentInfo:
     @property
     def file(self):
         if b"files" not in self.info:
-            return self.info[b"name"].decode()
+            return str(self.info[b"name"], "utf-8")
 
         # For multi-file torrents, return the first file's path
         first_file = self.info[b"files"][0]
-        path_components = [p.decode() for p in first_file[b"path"]]
+        path_components = [str(p, "utf-8") for p in first_file[b"path"]]
         return "/".join(path_components)
 
     def get_peers(self):
         req = {
-            "info_hash": self.info_hash[0],
+            "info_hash": self.swarm_hash,
             "peer_id": PEER_ID,
             "port": 6881,
             "uploaded": 0,
@@ -71,26 +241,62 @@ class TorrentInfo:
         r = requests.get(self.url, params=req)
 
         if r.ok:
-            d = Decoder(r.content).read_dict()
-            all_peers = d[b"peers"]
-
-            peer_list = []
-            peers = [all_peers[i : i + 6] for i in range(0, len(all_peers), 6)]
-
-            for p in peers:
-                ip = ".".join([repr(int(x)) for x in p[:4]])
-                port = int.from_bytes(p[4:])
-
-                peer_list.append((ip, port))
-
-            return peer_list
+            return response_peers(Decoder(r.content).read_dict())
 
         else:
             raise Exception(r.status_code)
 
     @classmethod
-    def from_file(cls, file: str) -> "TorrentInfo | None":
+    def from_file(cls, file: str, use_mmap: bool = False) -> "TorrentInfo | None":
         with open(file, mode="rb") as f:
-            d = Decoder(f.read())
+            if use_mmap:
+                # Strings are views into the mapping, so only the pages that
+                # hold the structure are read until a field is actually used.
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                d = Decoder(source, zero_copy=True, record_spans=True)
+            else:
+                d = Decoder(f.read(), record_spans=True)
         metainfo = d.read_dict()
-        return TorrentInfo(metainfo)
+        raw_info = d.raw(b"info") if b"info" in d.spans else None
+        return TorrentInfo(metainfo, raw_info)
+
+    @classmethod
+    def load_many(
+        cls, paths: Iterable[str], workers: int | None = None
+    ) -> Iterator[LoadResult]:
+        """Parse and hash torrent files in a process pool, in completion order.
+
+        A file that fails to load is reported through `LoadResult.error`
+        instead of aborting the batch. Only a few files per worker are
+        queued at a time, so `paths` may be lazy and a caller that stops
+        iterating early does not wait for the rest of the batch.
+        """
+        workers = workers or os.cpu_count() or 1
+        paths = iter(paths)
+        pending = {}
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            while True:
+                for path in islice(paths, 2 * workers - len(pending)):
+                    pending[executor.submit(_load_one, path)] = path
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    try:
+                        yield future.result()
+                    except Exception as e:
+                        yield LoadResult(path, None, e)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+
+def _load_one(path: str) -> LoadResult:
+    try:
+        torrent = TorrentInfo.from_file(path)
+        # Hash in the worker: the hashes are pickled along with the result.
+        torrent.hash_info()
+        return LoadResult(path, torrent, None)
+    except Exception as e:
+        return LoadResult(path, None, e)
@@ -0,0 +1,570 @@
+import asyncio
+import logging
+import random
+import socket
+import struct
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, NamedTuple
+from urllib.parse import urlencode, urlsplit
+
+from .bencode import Decoder
+
+if TYPE_CHECKING:
+    from .torrent_info import TorrentInfo
+
+logger = logging.getLogger(__name__)
+
+# Tracker responses are small. Anything larger is refused rather than buffered.
+MAX_RESPONSE_SIZE = 4 * 2**20
+
+# Delay before retrying a tracker that failed, doubled on each failure.
+RETRY_INTERVAL = 60
+MAX_RETRY_INTERVAL = 1800
+
+# UDP tracker protocol (BEP 15).
+UDP_PROTOCOL_ID = 0x41727101980
+UDP_CONNECT, UDP_ANNOUNCE, UDP_SCRAPE, UDP_ERROR = range(4)
+UDP_EVENTS = {None: 0, "completed": 1, "started": 2, "stopped": 3}
+# A request is retransmitted after 15 * 2**n seconds, n = 0..8.
+UDP_TIMEOUT = 15
+UDP_MAX_RETRIES = 8
+# Connection ids may be used for one minute after they were received.
+UDP_CONNECTION_TTL = 60
+# At most 74 info hashes per scrape, keeping the request in one MTU.
+UDP_MAX_SCRAPE = 74
+
+
+class TrackerError(Exception):
+    pass
+
+
+class AnnounceResponse(NamedTuple):
+    peers: list[tuple[str, int]]
+    interval: int
+    min_interval: int | None = None
+    complete: int | None = None
+    incomplete: int | None = None
+    tracker_id: bytes | None = None
+
+
+def decode_peers(peers: bytes) -> list[tuple[str, int]]:
+    """Decode compact IPv4 peers: a 4 byte address and a 2 byte port each."""
+    view = memoryview(peers)
+    view = view[: len(view) - len(view) % 6]
+    ntoa = socket.inet_ntoa
+    return [(ntoa(ip), port) for ip, port in struct.iter_unpack(">4sH", view)]
+
+
+def decode_peers6(peers: bytes) -> list[tuple[str, int]]:
+    """Decode compact IPv6 peers (BEP 7): 16 byte addresses, 2 byte ports."""
+    view = memoryview(peers)
+    view = view[: len(view) - len(view) % 18]
+    ntop = socket.inet_ntop
+    return [
+        (ntop(socket.AF_INET6, ip), port)
+        for ip, port in struct.iter_unpack(">16sH", view)
+    ]
+
+
+def response_peers(response: dict) -> list[tuple[str, int]]:
+    """Peers of a decoded announce response, in compact or dictionary form."""
+    peers = response.get(b"peers", b"")
+    if isinstance(peers, list):
+        result = [
+            (str(p[b"ip"], "utf-8"), p[b"port"])
+            for p in peers
+            if isinstance(p, dict) and b"ip" in p and b"port" in p
+        ]
+    else:
+        result = decode_peers(peers)
+    if peers6 := response.get(b"peers6"):
+        result += decode_peers6(peers6)
+    return result
+
+
+def parse_announce_response(body: bytes) -> AnnounceResponse:
+    d = Decoder(body, max_size=MAX_RESPONSE_SIZE).read_dict()
+    if b"failure reason" in d:
+        raise TrackerError(str(d[b"failure reason"], "utf-8", "replace"))
+
+    return AnnounceResponse(
+        peers=response_peers(d),
+        interval=d.get(b"interval", 1800),
+        min_interval=d.get(b"min interval"),
+        complete=d.get(b"complete"),
+        incomplete=d.get(b"incomplete"),
+        tracker_id=d.get(b"tracker id"),
+    )
+
+
+class HTTPConnectionPool:
+    """Keep-alive HTTP/1.1 connections for GET requests, reused per host."""
+
+    def __init__(self, max_idle_per_host: int = 4):
+        self.max_idle_per_host = max_idle_per_host
+        # (scheme, host, port) -> idle (reader, writer) pairs
+        self.idle: defaultdict[tuple, list] = defaultdict(list)
+
+    async def get(self, url: str) -> tuple[int, bytes]:
+        parts = urlsplit(url)
+        https = parts.scheme == "https"
+        key = (parts.scheme, parts.hostname, parts.port or (443 if https else 80))
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        request = (
+            f"GET {target} HTTP/1.1\r\n"
+            f"Host: {parts.netloc}\r\n"
+            "User-Agent: py-torrent\r\n"
+            "Accept-Encoding: identity\r\n"
+            "Connection: keep-alive\r\n\r\n"
+        ).encode()
+
+        # An idle connection may have been closed by the server in the
+        # meantime: fall back to a fresh connection if a reused one fails.
+        while self.idle[key]:
+            reader, writer = self.idle[key].pop()
+            try:
+                return await self.send(key, reader, writer, request)
+            except (ConnectionError, EOFError):
+                logger.debug(f"Stale connection to {key}, reconnecting")
+
+        reader, writer = await asyncio.open_connection(key[1], key[2], ssl=https)
+        return await self.send(key, reader, writer, request)
+
+    async def send(self, key, reader, writer, request: bytes) -> tuple[int, bytes]:
+        try:
+            writer.write(request)
+            await writer.drain()
+
+            status_line = await reader.readuntil(b"\r\n")
+            status = int(status_line.split()[1])
+
+            headers = {}
+            while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip().lower()
+
+            keep_alive = headers.get("connection") != "close"
+            if headers.get("transfer-encoding") == "chunked":
+                body = await self.read_chunked(reader)
+            elif "content-length" in headers:
+                length = int(headers["content-length"])
+                if length > MAX_RESPONSE_SIZE:
+                    raise TrackerError(f"Response of {length} bytes is too large")
+                body = await reader.readexactly(length)
+            else:
+                body = await self.read_to_eof(reader)
+                keep_alive = False
+        except BaseException:
+            writer.close()
+            raise
+
+        if keep_alive and len(self.idle[key]) < self.max_idle_per_host:
+            self.idle[key].append((reader, writer))
+        else:
+            writer.close()
+        return status, body
+
+    async def read_to_eof(self, reader: asyncio.StreamReader) -> bytes:
+        """Body of a response delimited by the server closing the connection."""
+        body = bytearray()
+        while chunk := await reader.read(2**16):
+            body += chunk
+            if len(body) > MAX_RESPONSE_SIZE:
+                raise TrackerError("Response is too large")
+        return bytes(body)
+
+    async def read_chunked(self, reader: asyncio.StreamReader) -> bytes:
+        body = bytearray()
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                # Trailers, if any, end with an empty line.
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return bytes(body)
+            if len(body) + size > MAX_RESPONSE_SIZE:
+                raise TrackerError("Chunked response is too large")
+            body += await reader.readexactly(size + 2)
+            del body[-2:]
+
+    def close(self):
+        for connections in self.idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.idle.clear()
+
+
+class ScrapeResponse(NamedTuple):
+    complete: int
+    downloaded: int
+    incomplete: int
+
+
+class UDPTrackerProtocol(asyncio.DatagramProtocol):
+    """Routes responses to the request waiting for their transaction id."""
+
+    def __init__(self):
+        self.transport: asyncio.DatagramTransport | None = None
+        self.waiters: dict[int, asyncio.Future] = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < 8:
+            return
+        (transaction_id,) = struct.unpack_from(">I", data, 4)
+        waiter = self.waiters.pop(transaction_id, None)
+        if waiter and not waiter.done():
+            waiter.set_result(data)
+
+    def error_received(self, exc: Exception):
+        # ICMP errors, e.g. port unreachable. Retransmission handles them.
+        logger.debug(f"UDP tracker error: {exc!r}")
+
+    def connection_lost(self, exc: Exception | None):
+        for waiter in self.waiters.values():
+            if not waiter.done():
+                waiter.set_exception(ConnectionError("UDP endpoint closed"))
+        self.waiters.clear()
+
+
+class UDPTracker:
+    """A UDP tracker endpoint (BEP 15), shared by all torrents announced to it.
+
+    The connection id handed out by the tracker is cached for its lifetime so
+    that announces and scrapes cost a single round trip. Unanswered requests
+    are retransmitted after `timeout * 2**n` seconds, up to `max_retries`.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        timeout: float = UDP_TIMEOUT,
+        max_retries: int = UDP_MAX_RETRIES,
+    ):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.protocol: UDPTrackerProtocol | None = None
+        self.connection_id: int | None = None
+        self.connection_expiry = 0.0
+        self.connecting: asyncio.Future | None = None
+
+    async def open(self):
+        if self.protocol is None:
+            loop = asyncio.get_running_loop()
+            _, self.protocol = await loop.create_datagram_endpoint(
+                UDPTrackerProtocol, remote_addr=(self.host, self.port)
+            )
+
+    async def connect(self) -> int:
+        if self.connection_id is not None and time.monotonic() < self.connection_expiry:
+            return self.connection_id
+
+        # Concurrent requests share a single connect exchange.
+        if self.connecting is None:
+            self.connecting = asyncio.ensure_future(self.request(UDP_CONNECT))
+        try:
+            data = await asyncio.shield(self.connecting)
+        finally:
+            if self.connecting is not None and self.connecting.done():
+                self.connecting = None
+
+        (self.connection_id,) = struct.unpack_from(">Q", data)
+        self.connection_expiry = time.monotonic() + UDP_CONNECTION_TTL
+        return self.connection_id
+
+    async def request(self, action: int, payload: bytes = b"") -> bytes:
+        """Send a request and return the body of its response."""
+        await self.open()
+        # close() may drop self.protocol while we wait.
+        protocol = self.protocol
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            if action == UDP_CONNECT:
+                connection_id = UDP_PROTOCOL_ID
+            else:
+                connection_id = await self.connect()
+
+            transaction_id = random.getrandbits(32)
+            waiter = loop.create_future()
+            protocol.waiters[transaction_id] = waiter
+            protocol.transport.sendto(
+                struct.pack(">QII", connection_id, action, transaction_id) + payload
+            )
+            try:
+                data = await asyncio.wait_for(waiter, self.timeout * 2**attempt)
+            except TimeoutError:
+                logger.debug(f"No response from {self.host}:{self.port}, retrying")
+                continue
+            finally:
+                protocol.waiters.pop(transaction_id, None)
+
+            (response_action,) = struct.unpack_from(">I", data)
+            if response_action == UDP_ERROR:
+                raise TrackerError(str(data[8:], "utf-8", "replace"))
+            if response_action != action:
+                raise TrackerError(f"Expected action {action}, got {response_action}")
+            return data[8:]
+
+        raise TrackerError(f"No response from {self.host}:{self.port}")
+
+    async def announce(
+        self,
+        info_hash: bytes,
+        peer_id: bytes,
+        port: int,
+        uploaded: int,
+        downloaded: int,
+        left: int,
+        event: str | None = None,
+        key: int = 0,
+        num_want: int = -1,
+    ) -> AnnounceResponse:
+        payload = struct.pack(
+            ">20s20sQQQIIIiH",
+            info_hash,
+            peer_id,
+            downloaded,
+            left,
+            uploaded,
+            UDP_EVENTS[event],
+            0,
+            key,
+            num_want,
+            port,
+        )
+        data = await self.request(UDP_ANNOUNCE, payload)
+        if len(data) < 12:
+            raise TrackerError("Truncated announce response")
+        interval, incomplete, complete = struct.unpack_from(">III", data)
+        # Trackers reached over IPv6 return IPv6 peers.
+        ipv6 = self.protocol.transport.get_extra_info("socket").family == (
+            socket.AF_INET6
+        )
+        return AnnounceResponse(
+            peers=(decode_peers6 if ipv6 else decode_peers)(data[12:]),
+            interval=interval,
+            complete=complete,
+            incomplete=incomplete,
+        )
+
+    async def scrape(self, info_hashes: list[bytes]) -> dict[bytes, ScrapeResponse]:
+        """Scrape any number of torrents, `UDP_MAX_SCRAPE` per request."""
+        batches = [
+            info_hashes[i : i + UDP_MAX_SCRAPE]
+            for i in range(0, len(info_hashes), UDP_MAX_SCRAPE)
+        ]
+        responses = await asyncio.gather(
+            *[self.request(UDP_SCRAPE, b"".join(batch)) for batch in batches]
+        )
+
+        result = {}
+        for batch, data in zip(batches, responses, strict=True):
+            if len(data) < 12 * len(batch):
+                raise TrackerError("Truncated scrape response")
+            for info_hash, stats in zip(batch, struct.iter_unpack(">III", data)):
+                result[info_hash] = ScrapeResponse(*stats)
+        return result
+
+    def close(self):
+        if self.connecting is not None:
+            self.connecting.cancel()
+            self.connecting = None
+        if self.protocol is not None:
+            self.protocol.transport.close()
+            self.protocol = None
+
+
+class UDPTrackerPool:
+    """UDP tracker endpoints keyed by host and port, with their connection ids."""
+
+    def __init__(
+        self, timeout: float = UDP_TIMEOUT, max_retries: int = UDP_MAX_RETRIES
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.trackers: dict[tuple[str, int], UDPTracker] = {}
+
+    def get(self, url: str) -> UDPTracker:
+        parts = urlsplit(url)
+        if parts.port is None:
+            raise TrackerError(f"No port in UDP tracker URL {url}")
+        key = (parts.hostname, parts.port)
+        if key not in self.trackers:
+            self.trackers[key] = UDPTracker(*key, self.timeout, self.max_retries)
+        return self.trackers[key]
+
+    def close(self):
+        for tracker in self.trackers.values():
+            tracker.close()
+        self.trackers.clear()
+
+
+class Tracker:
+    def __init__(self, url: str):
+        self.url = url
+        self.interval: int | None = None
+        self.min_interval: int | None = None
+        self.last_announce: float | None = None
+        self.last_failure: float | None = None
+        self.failures = 0
+        self.tracker_id: bytes | None = None
+
+    def next_announce(self) -> float:
+        if self.failures:
+            delay = RETRY_INTERVAL * 2 ** (self.failures - 1)
+            return self.last_failure + min(delay, MAX_RETRY_INTERVAL)
+        if self.last_announce is None:
+            return 0.0
+        return self.last_announce + (self.interval or 0)
+
+    def can_announce(self, now: float) -> bool:
+        if self.last_announce is None or self.min_interval is None:
+            return True
+        return now >= self.last_announce + self.min_interval
+
+
+class TrackerClient:
+    """Announces a torrent to every tier of its HTTP and UDP trackers (BEP 12).
+
+    All tiers are announced to concurrently. Within a tier, trackers are
+    tried in order until one answers, and the one that answered is moved to
+    the front so it is tried first next time.
+    """
+
+    def __init__(
+        self,
+        torrent: "TorrentInfo",
+        peer_id: bytes,
+        port: int = 6881,
+        timeout: float = 15,
+        pool: HTTPConnectionPool | None = None,
+        udp_pool: UDPTrackerPool | None = None,
+    ):
+        self.torrent = torrent
+        self.peer_id = peer_id
+        self.port = port
+        self.timeout = timeout
+        self.pool = pool or HTTPConnectionPool()
+        # UDP requests are retransmitted within the timeout, see announce_to().
+        self.udp_pool = udp_pool or UDPTrackerPool(timeout / 4)
+        # Lets UDP trackers recognise us if our IP address changes.
+        self.key = random.getrandbits(32)
+
+        announce_list = torrent.metainfo.get(b"announce-list")
+        if announce_list:
+            urls = [[str(u, "utf-8") for u in tier] for tier in announce_list]
+        else:
+            urls = [[torrent.url]]
+        self.tiers: list[list[Tracker]] = []
+        for tier in urls:
+            trackers = [Tracker(u) for u in tier]
+            random.shuffle(trackers)
+            self.tiers.append(trackers)
+
+    async def announce(
+        self,
+        event: str | None = None,
+        uploaded: int = 0,
+        downloaded: int = 0,
+        left: int | None = None,
+    ) -> list[tuple[str, int]]:
+        """Announce to all tiers and return the de-duplicated peers."""
+        params = {
+            "info_hash": self.torrent.swarm_hash,
+            "peer_id": self.peer_id,
+            "port": self.port,
+            "uploaded": uploaded,
+            "downloaded": downloaded,
+            "left": self.torrent.length if left is None else left,
+            "compact": 1,
+        }
+        if event:
+            params["event"] = event
+
+        responses = await asyncio.gather(
+            *[self.announce_tier(tier, params) for tier in self.tiers]
+        )
+
+        # dict.fromkeys keeps the first occurrence order.
+        peers = dict.fromkeys(
+            peer for response in responses if response for peer in response.peers
+        )
+        return list(peers)
+
+    async def announce_tier(
+        self, tier: list[Tracker], params: dict
+    ) -> AnnounceResponse | None:
+        now = time.monotonic()
+        for tracker in list(tier):
+            if not tracker.can_announce(now):
+                logger.debug(f"Skipping {tracker.url}: min interval not elapsed")
+                continue
+            try:
+                response = await self.announce_to(tracker, params)
+            except Exception as e:
+                logger.info(f"Announce to {tracker.url} failed: {e!r}")
+                tracker.failures += 1
+                tracker.last_failure = time.monotonic()
+                continue
+
+            tracker.failures = 0
+            tracker.last_announce = time.monotonic()
+            tracker.interval = response.interval
+            tracker.min_interval = response.min_interval
+            tier.remove(tracker)
+            tier.insert(0, tracker)
+            return response
+        return None
+
+    async def announce_to(self, tracker: Tracker, params: dict) -> AnnounceResponse:
+        if tracker.url.startswith("udp://"):
+            # Retransmissions alone could take hours to give up, holding back
+            # the other tiers and the next tracker of this one. Leave time for
+            # two of them, sent `t` and `3 * t` after the request.
+            deadline = max(self.timeout, 4 * self.udp_pool.timeout)
+            return await asyncio.wait_for(
+                self.udp_pool.get(tracker.url).announce(
+                    params["info_hash"],
+                    params["peer_id"],
+                    params["port"],
+                    params["uploaded"],
+                    params["downloaded"],
+                    params["left"],
+                    params.get("event"),
+                    self.key,
+                ),
+                deadline,
+            )
+
+        query = dict(params)
+        if tracker.tracker_id:
+            query["trackerid"] = tracker.tracker_id
+
+        separator = "&" if "?" in tracker.url else "?"
+        status, body = await asyncio.wait_for(
+            self.pool.get(tracker.url + separator + urlencode(query)), self.timeout
+        )
+        if status != 200:
+            raise TrackerError(f"HTTP {status}")
+
+        response = parse_announce_response(body)
+        if response.tracker_id:
+            tracker.tracker_id = response.tracker_id
+        return response
+
+    def next_announce(self) -> float:
+        """Monotonic time at which the next regular announce is due."""
+        return min(t.next_announce() for tier in self.tiers for t in tier[:1])
+
+    def close(self):
+        self.pool.close()
+        self.udp_pool.close()
@@ -0,0 +1,448 @@
+import argparse
+import asyncio
+import hashlib
+import ipaddress
+import logging
+import os
+import random
+import struct
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from .bencode import Encoder
+from .tracker import (
+    UDP_ANNOUNCE,
+    UDP_CONNECT,
+    UDP_ERROR,
+    UDP_MAX_SCRAPE,
+    UDP_PROTOCOL_ID,
+    UDP_SCRAPE,
+    ScrapeResponse,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 1800
+# Peers returned per announce unless the client asks for fewer.
+DEFAULT_NUMWANT = 50
+# How often peers that stopped announcing are removed.
+SWEEP_INTERVAL = 60
+# Seconds an HTTP client may keep a connection open without a full request.
+KEEP_ALIVE_TIMEOUT = 60
+# UDP connection ids are valid for two of these windows (BEP 15).
+UDP_CONNECTION_WINDOW = 60
+
+UDP_EVENT_NAMES = {0: None, 1: "completed", 2: "started", 3: "stopped"}
+
+
+class Peer:
+    __slots__ = ("peer_id", "compact", "seeder", "expires")
+
+    def __init__(self, peer_id: bytes, compact: bytes, seeder: bool, expires: float):
+        self.peer_id = peer_id
+        # Address and port as sent in compact peer lists: 6 bytes for IPv4,
+        # 18 bytes for IPv6.
+        self.compact = compact
+        self.seeder = seeder
+        self.expires = expires
+
+
+class Swarm:
+    """The peers of one torrent.
+
+    Peers are kept in a list, with their position indexed by peer id, so that
+    adding, removing and drawing a random sample are all O(1) per peer.
+    """
+
+    __slots__ = ("peers", "index", "complete", "downloaded")
+
+    def __init__(self):
+        self.peers: list[Peer] = []
+        self.index: dict[bytes, int] = {}
+        self.complete = 0
+        self.downloaded = 0
+
+    def __len__(self) -> int:
+        return len(self.peers)
+
+    @property
+    def incomplete(self) -> int:
+        return len(self.peers) - self.complete
+
+    def update(self, peer_id: bytes, compact: bytes, seeder: bool, expires: float):
+        i = self.index.get(peer_id)
+        if i is None:
+            self.index[peer_id] = len(self.peers)
+            self.peers.append(Peer(peer_id, compact, seeder, expires))
+            self.complete += seeder
+            return
+
+        peer = self.peers[i]
+        self.complete += seeder - peer.seeder
+        peer.compact = compact
+        peer.seeder = seeder
+        peer.expires = expires
+
+    def remove(self, peer_id: bytes):
+        i = self.index.pop(peer_id, None)
+        if i is None:
+            return
+        peer = self.peers[i]
+        self.complete -= peer.seeder
+        # Move the last peer into the freed slot.
+        last = self.peers.pop()
+        if last is not peer:
+            self.peers[i] = last
+            self.index[last.peer_id] = i
+
+    def sample(self, count: int, exclude: bytes | None = None) -> list[Peer]:
+        """Up to `count` random peers, other than `exclude`."""
+        n = min(count + 1, len(self.peers))
+        return [p for p in random.sample(self.peers, n) if p.peer_id != exclude][:count]
+
+    def expire(self, now: float) -> int:
+        expired = [p.peer_id for p in self.peers if p.expires <= now]
+        for peer_id in expired:
+            self.remove(peer_id)
+        return len(expired)
+
+    def stats(self) -> ScrapeResponse:
+        return ScrapeResponse(self.complete, self.downloaded, self.incomplete)
+
+
+def compact_address(host: str, port: int) -> bytes:
+    ip = ipaddress.ip_address(host)
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.packed + port.to_bytes(2, "big")
+
+
+class TrackerServer:
+    """In-memory BitTorrent tracker serving HTTP and, optionally, UDP.
+
+    Announces only ever return compact peer lists (BEP 23), split into
+    `peers` and `peers6` (BEP 7). Peers that have not re-announced within
+    `peer_timeout` seconds are dropped from their swarm.
+    """
+
+    def __init__(
+        self,
+        interval: int = DEFAULT_INTERVAL,
+        min_interval: int | None = None,
+        peer_timeout: float | None = None,
+        max_numwant: int = DEFAULT_NUMWANT,
+        keep_alive_timeout: float = KEEP_ALIVE_TIMEOUT,
+    ):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.peer_timeout = peer_timeout or 2 * interval
+        self.max_numwant = max_numwant
+        self.keep_alive_timeout = keep_alive_timeout
+        self.swarms: dict[bytes, Swarm] = {}
+        self.secret = os.urandom(16)
+        self.encoder = Encoder()
+        self.servers: list[asyncio.AbstractServer] = []
+        self.transports: list[asyncio.DatagramTransport] = []
+        # Connected HTTP clients, closed with the server.
+        self.clients: set[asyncio.StreamWriter] = set()
+        self.sweeper: asyncio.Task | None = None
+
+    def announce(
+        self,
+        info_hash: bytes,
+        peer_id: bytes,
+        compact: bytes,
+        left: int,
+        event: str | None = None,
+        numwant: int | None = None,
+    ) -> tuple[Swarm, list[Peer]]:
+        """Record an announce; return the swarm and the peers to hand out."""
+        swarm = self.swarms.get(info_hash)
+        if swarm is None:
+            swarm = self.swarms[info_hash] = Swarm()
+
+        if event == "stopped":
+            swarm.remove(peer_id)
+            return swarm, []
+        if event == "completed":
+            swarm.downloaded += 1
+        swarm.update(peer_id, compact, left == 0, time.monotonic() + self.peer_timeout)
+
+        if numwant is None or numwant < 0:
+            numwant = self.max_numwant
+        return swarm, swarm.sample(min(numwant, self.max_numwant), peer_id)
+
+    def scrape(self, info_hashes: list[bytes]) -> dict[bytes, ScrapeResponse]:
+        """Statistics of the given torrents, or of all of them if none given."""
+        if not info_hashes:
+            return {h: swarm.stats() for h, swarm in self.swarms.items()}
+        empty = ScrapeResponse(0, 0, 0)
+        return {
+            h: swarm.stats() if (swarm := self.swarms.get(h)) else empty
+            for h in info_hashes
+        }
+
+    def expire(self) -> int:
+        now = time.monotonic()
+        expired = sum(swarm.expire(now) for swarm in self.swarms.values())
+        for info_hash in [h for h, swarm in self.swarms.items() if not swarm]:
+            del self.swarms[info_hash]
+        return expired
+
+    async def sweep(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            if expired := self.expire():
+                logger.debug(f"Expired {expired} peers")
+
+    async def start(
+        self, host: str | None = None, port: int = 8080, udp_port: int | None = None
+    ):
+        """Listen for HTTP announces on `port`, and UDP ones on `udp_port`.
+
+        Port 0 picks a free port; see `http_port()` and `udp_port()`.
+        """
+        loop = asyncio.get_running_loop()
+        self.servers.append(await asyncio.start_server(self.handle, host, port))
+        if udp_port is not None:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: TrackerDatagramProtocol(self),
+                local_addr=(host or "0.0.0.0", udp_port),
+            )
+            self.transports.append(transport)
+        self.sweeper = asyncio.create_task(self.sweep())
+
+    def http_port(self) -> int:
+        return self.servers[0].sockets[0].getsockname()[1]
+
+    def udp_port(self) -> int:
+        return self.transports[0].get_extra_info("sockname")[1]
+
+    async def close(self):
+        if self.sweeper:
+            self.sweeper.cancel()
+        for transport in self.transports:
+            transport.close()
+        for server in self.servers:
+            server.close()
+        # wait_closed() waits for every connection, idle keep-alive ones too.
+        for writer in self.clients:
+            writer.close()
+        for server in self.servers:
+            await server.wait_closed()
+        self.servers.clear()
+        self.transports.clear()
+
+    # HTTP
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        host = writer.get_extra_info("peername")[0]
+        self.clients.add(writer)
+        try:
+            while request := await asyncio.wait_for(
+                self.read_request(reader), self.keep_alive_timeout
+            ):
+                method, target, keep_alive = request
+                status, body = self.handle_request(method, target, host)
+                writer.write(
+                    b"HTTP/1.1 %s\r\n"
+                    b"Content-Type: text/plain\r\n"
+                    b"Content-Length: %d\r\n"
+                    b"%s\r\n%s"
+                    % (
+                        status,
+                        len(body),
+                        b"" if keep_alive else b"Connection: close\r\n",
+                        body,
+                    )
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, TimeoutError) as e:
+            logger.debug(f"Dropping HTTP client {host}: {e!r}")
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def read_request(
+        self, reader: asyncio.StreamReader
+    ) -> tuple[str, str, bool] | None:
+        """Method, target and keep-alive flag of the next request, None at EOF."""
+        if not (request_line := await reader.readline()):
+            return None
+        method, target, version = request_line.decode("latin-1").split()
+        keep_alive = version == "HTTP/1.1"
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "connection":
+                keep_alive = value.strip().lower() != "close"
+        return method, target, keep_alive
+
+    def handle_request(
+        self, method: str, target: str, host: str
+    ) -> tuple[bytes, bytes]:
+        parts = urlsplit(target)
+        if method != "GET":
+            return b"405 Method Not Allowed", b""
+        # Binary values such as info_hash are percent-encoded bytes.
+        query = parse_qs(parts.query, encoding="latin-1")
+
+        if parts.path.endswith("/announce"):
+            try:
+                body = self.http_announce(query, host)
+            except (KeyError, ValueError) as e:
+                body = self.encoder.encode(
+                    {b"failure reason": b"invalid request %r" % e}
+                )
+            return b"200 OK", body
+        if parts.path.endswith("/scrape"):
+            hashes = [h.encode("latin-1") for h in query.get("info_hash", [])]
+            files = {
+                h: {
+                    b"complete": stats.complete,
+                    b"downloaded": stats.downloaded,
+                    b"incomplete": stats.incomplete,
+                }
+                for h, stats in self.scrape(hashes).items()
+            }
+            return b"200 OK", self.encoder.encode({b"files": files})
+        return b"404 Not Found", b""
+
+    def http_announce(self, query: dict, host: str) -> bytes:
+        info_hash = query["info_hash"][0].encode("latin-1")
+        peer_id = query["peer_id"][0].encode("latin-1")
+        if len(info_hash) != 20 or len(peer_id) != 20:
+            raise ValueError("info_hash and peer_id must be 20 bytes")
+        port = int(query["port"][0])
+        if not 0 <= port < 65536:
+            raise ValueError(f"invalid port {port}")
+        numwant = int(query["numwant"][0]) if "numwant" in query else None
+        swarm, peers = self.announce(
+            info_hash,
+            peer_id,
+            compact_address(host, port),
+            int(query["left"][0]),
+            query.get("event", [None])[0],
+            numwant,
+        )
+
+        response = {
+            b"complete": swarm.complete,
+            b"incomplete": swarm.incomplete,
+            b"interval": self.interval,
+            b"peers": b"".join(p.compact for p in peers if len(p.compact) == 6),
+        }
+        if self.min_interval is not None:
+            response[b"min interval"] = self.min_interval
+        if peers6 := b"".join(p.compact for p in peers if len(p.compact) == 18):
+            response[b"peers6"] = peers6
+        return self.encoder.encode(response)
+
+    # UDP (BEP 15)
+
+    def connection_id(self, addr: tuple, window: int) -> int:
+        """Connection ids are a keyed hash of the client address and time.
+
+        They can be checked without keeping any per-client state.
+        """
+        h = hashlib.blake2b(
+            f"{addr[0]}:{addr[1]}:{window}".encode(), key=self.secret, digest_size=8
+        )
+        return int.from_bytes(h.digest())
+
+    def valid_connection_id(self, connection_id: int, addr: tuple) -> bool:
+        window = int(time.time() // UDP_CONNECTION_WINDOW)
+        if connection_id == self.connection_id(addr, window):
+            return True
+        # Ids from the previous window are still valid, so that clients get
+        # the full minute BEP 15 allows them.
+        return connection_id == self.connection_id(addr, window - 1)
+
+    def handle_datagram(self, data: bytes, addr: tuple) -> bytes | None:
+        if len(data) < 16:
+            return None
+        connection_id, action, transaction_id = struct.unpack_from(">QII", data)
+
+        if action == UDP_CONNECT:
+            if connection_id != UDP_PROTOCOL_ID:
+                return None
+            window = int(time.time() // UDP_CONNECTION_WINDOW)
+            return struct.pack(
+                ">IIQ", UDP_CONNECT, transaction_id, self.connection_id(addr, window)
+            )
+
+        if not self.valid_connection_id(connection_id, addr):
+            return (
+                struct.pack(">II", UDP_ERROR, transaction_id) + b"Invalid connection id"
+            )
+
+        if action == UDP_ANNOUNCE and len(data) >= 98:
+            info_hash, peer_id, _, left, _, event, _, _, numwant, port = (
+                struct.unpack_from(">20s20sQQQIIIiH", data, 16)
+            )
+            compact = compact_address(addr[0], port)
+            swarm, peers = self.announce(
+                info_hash, peer_id, compact, left, UDP_EVENT_NAMES.get(event), numwant
+            )
+            # Only peers of the requester's address family fit in the reply.
+            return struct.pack(
+                ">IIIII",
+                UDP_ANNOUNCE,
+                transaction_id,
+                self.interval,
+                swarm.incomplete,
+                swarm.complete,
+            ) + b"".join(p.compact for p in peers if len(p.compact) == len(compact))
+
+        if action == UDP_SCRAPE:
+            hashes = [data[i : i + 20] for i in range(16, len(data) - 19, 20)]
+            hashes = hashes[:UDP_MAX_SCRAPE]
+            if hashes:
+                stats = self.scrape(hashes)
+                return struct.pack(">II", UDP_SCRAPE, transaction_id) + b"".join(
+                    struct.pack(">III", *stats[h]) for h in hashes
+                )
+
+        return struct.pack(">II", UDP_ERROR, transaction_id) + b"Invalid request"
+
+
+class TrackerDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: TrackerServer):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        if reply := self.server.handle_datagram(data, addr):
+            self.transport.sendto(reply, addr)
+
+
+async def serve(args):
+    server = TrackerServer(args.interval)
+    await server.start(args.host, args.port, args.udp_port)
+    logger.info(
+        f"Tracker listening on http://{args.host or '0.0.0.0'}:{server.http_port()}"
+        "/announce"
+    )
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local BitTorrent tracker.")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--udp-port", type=int, default=None)
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,17 @@
+import io
+import pickle
+from copy import deepcopy
+
 import pytest
-from src.bencode import Decoder, Encoder
+from src.bencode import (
+    Decoder,
+    EncodeCache,
+    Encoder,
+    FrozenDict,
+    StreamDecoder,
+    extract,
+    freeze,
+)
 
 
 class TestDecoder:
@@ -83,6 +95,287 @@ class TestDecoder:
         with pytest.raises(IndexError):
             decoder.decode()
 
+    def test_decode_invalid_integer(self):
+        """Test that malformed integers raise ValueError."""
+        for data in (b"ie", b"i-e", b"i1-2e", b"i--1e", b"i4x2e"):
+            with pytest.raises(ValueError):
+                Decoder(data).decode()
+
+    def test_decode_unterminated_string_length(self):
+        """Test that a missing colon does not scan the whole input."""
+        decoder = Decoder(b"1" * 1000 + b":")
+        with pytest.raises(ValueError):
+            decoder.decode()
+
+    def test_decode_big_integer(self):
+        """Test that integers are not limited in size."""
+        for n in (2**128, -(2**1000)):
+            assert Decoder(Encoder().encode(n)).decode() == n
+            decoder = Decoder(Encoder().encode([n, b"x"]))
+            decoder.skip()
+            assert decoder.is_at_end()
+
+    def test_decode_large_string(self):
+        """Test decoding a string much larger than its length prefix."""
+        blob = bytes(range(256)) * 4096
+        decoder = Decoder(b"%d:" % len(blob) + blob)
+        assert decoder.decode() == blob
+        assert decoder.is_at_end()
+
+    def test_decode_bytearray_source(self):
+        """Test decoding from a mutable buffer."""
+        decoder = Decoder(bytearray(b"d3:cow3:moo4:spaml1:a1:bee"))
+        assert decoder.decode() == {b"cow": b"moo", b"spam": [b"a", b"b"]}
+
+
+class TestDecoderLimits:
+    """Test suite for the Decoder limits on untrusted input."""
+
+    def test_deep_nesting_within_limit(self):
+        """Test that nesting beyond the recursion limit decodes without recursion."""
+        depth = 5000
+        decoder = Decoder(b"l" * depth + b"e" * depth, max_depth=depth)
+        value = decoder.decode()
+        for _ in range(depth - 1):
+            value = value[0]
+        assert value == []
+
+    def test_max_depth(self):
+        """Test that nesting deeper than max_depth raises ValueError."""
+        assert Decoder(b"llleee", max_depth=3).decode() == [[[]]]
+        with pytest.raises(ValueError):
+            Decoder(b"lllleeee", max_depth=3).decode()
+
+    def test_default_max_depth(self):
+        """Test that hostile nesting is rejected by default."""
+        with pytest.raises(ValueError):
+            Decoder(b"l" * 100_000).decode()
+
+    def test_max_size(self):
+        """Test that oversized input is rejected up front."""
+        with pytest.raises(ValueError):
+            Decoder(b"4:spam", max_size=5)
+
+    def test_max_string_length(self):
+        """Test that long strings are rejected before being read."""
+        assert Decoder(b"4:spam", max_string_length=4).decode() == b"spam"
+        with pytest.raises(ValueError):
+            Decoder(b"l4:spam5:eggsse", max_string_length=4).decode()
+
+    def test_non_string_key(self):
+        """Test that dictionary keys must be strings."""
+        with pytest.raises(ValueError):
+            Decoder(b"di1ei2ee").decode()
+
+    def test_missing_dict_value(self):
+        """Test that a dictionary closed after a key raises ValueError."""
+        for data in (b"d3:fooe", b"d1:ai1e1:be", b"ld3:fooee"):
+            with pytest.raises(ValueError):
+                Decoder(data).decode()
+
+
+class TestZeroCopyDecoder:
+    """Test suite for the Decoder returning views into its source."""
+
+    def test_strings_are_views(self):
+        """Test that string values are memoryviews over the source."""
+        source = b"l4:spam4:eggse"
+        decoded = Decoder(source, zero_copy=True).decode()
+        assert all(isinstance(s, memoryview) for s in decoded)
+        assert decoded[0].obj is source
+        assert decoded == [b"spam", b"eggs"]
+
+    def test_dict_keys_are_bytes(self):
+        """Test that dictionary keys are copied so they stay hashable bytes."""
+        decoded = Decoder(b"d4:infod6:pieces3:abcee", zero_copy=True).decode()
+        assert list(decoded) == [b"info"]
+        assert type(list(decoded[b"info"])[0]) is bytes
+        assert decoded[b"info"][b"pieces"] == b"abc"
+
+
+class TestDecoderSpans:
+    """Test suite for byte spans recorded by the Decoder."""
+
+    def test_spans_of_outermost_dict(self):
+        """Test that each top-level value maps to its original bytes."""
+        source = b"d8:announce3:url4:infod4:name1:a6:pieces2:xxe1:zi1ee"
+        decoder = Decoder(source, record_spans=True)
+        decoder.decode()
+        assert decoder.raw(b"announce") == b"3:url"
+        assert decoder.raw(b"info") == b"d4:name1:a6:pieces2:xxe"
+        assert decoder.raw(b"z") == b"i1e"
+        assert set(decoder.spans) == {b"announce", b"info", b"z"}
+
+    def test_nested_dicts_not_recorded(self):
+        """Test that only the outermost dictionary is indexed."""
+        decoder = Decoder(b"d1:ald1:bi1eee1:ci2ee", record_spans=True)
+        decoder.decode()
+        assert set(decoder.spans) == {b"a", b"c"}
+
+    def test_spans_disabled_by_default(self):
+        """Test that spans are not recorded unless requested."""
+        decoder = Decoder(b"d1:ai1ee")
+        decoder.decode()
+        assert decoder.spans is None
+
+
+class TestExtract:
+    """Test suite for path-based extraction without a full decode."""
+
+    DATA = Encoder().encode(
+        {
+            b"announce": b"http://tracker",
+            b"info": {
+                b"files": [
+                    {b"length": 12, b"path": [b"a", b"b.txt"]},
+                    {b"length": 34, b"path": [b"c.txt"]},
+                ],
+                b"name": b"test",
+                b"pieces": b"x" * 40,
+            },
+        }
+    )
+
+    def test_extract_nested_key(self):
+        """Test extracting a value nested in dictionaries."""
+        assert extract(self.DATA, [b"info", b"name"]) == b"test"
+
+    def test_extract_subtree(self):
+        """Test that the value at the path is fully decoded."""
+        files = extract(self.DATA, [b"info", b"files"])
+        assert files[1] == {b"length": 34, b"path": [b"c.txt"]}
+
+    def test_extract_list_index(self):
+        """Test extracting through list indices."""
+        assert extract(self.DATA, [b"info", b"files", 1, b"length"]) == 34
+        assert extract(self.DATA, [b"info", b"files", 0, b"path", 1]) == b"b.txt"
+
+    def test_extract_empty_path(self):
+        """Test that an empty path decodes the whole value."""
+        assert extract(b"li1ee", []) == [1]
+
+    def test_extract_missing_key(self):
+        """Test that a missing key raises KeyError."""
+        with pytest.raises(KeyError):
+            extract(self.DATA, [b"info", b"length"])
+
+    def test_extract_index_out_of_range(self):
+        """Test that a list index past the end raises IndexError."""
+        with pytest.raises(IndexError):
+            extract(self.DATA, [b"info", b"files", 2])
+
+    def test_extract_wrong_type(self):
+        """Test that descending into a non-container raises ValueError."""
+        with pytest.raises(ValueError):
+            extract(self.DATA, [b"announce", b"host"])
+
+    def test_skip_leaves_decoder_after_value(self):
+        """Test that skip() jumps exactly over one value."""
+        decoder = Decoder(b"ld1:ali1ei2eee4:spami3ee")
+        decoder.expect(b"l")
+        decoder.skip()
+        assert decoder.decode_one() == b"spam"
+        decoder.skip()
+        assert decoder.peek() == b"e"
+
+
+class TestStreamDecoder:
+    """Test suite for the incremental StreamDecoder."""
+
+    SAMPLE = b"d8:intervali1800e5:peers12:abcdefghijkl4:tagsl3:foo3:baree"
+    EXPECTED = {
+        b"interval": 1800,
+        b"peers": b"abcdefghijkl",
+        b"tags": [b"foo", b"bar"],
+    }
+
+    def test_single_chunk(self):
+        """Test that a complete value is returned from a single feed."""
+        decoder = StreamDecoder()
+        assert decoder.feed(self.SAMPLE) == [self.EXPECTED]
+        assert not decoder.pending
+
+    @pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 16])
+    def test_split_across_chunks(self, chunk_size):
+        """Test that parsing resumes mid-token across chunk boundaries."""
+        decoder = StreamDecoder()
+        values = []
+        for i in range(0, len(self.SAMPLE), chunk_size):
+            values += decoder.feed(self.SAMPLE[i : i + chunk_size])
+        assert values == [self.EXPECTED]
+        assert not decoder.pending
+
+    def test_multiple_values(self):
+        """Test that consecutive values are returned in order."""
+        decoder = StreamDecoder()
+        assert decoder.feed(b"i1e4:spa") == [1]
+        assert decoder.pending
+        assert decoder.feed(b"mle") == [b"spam", []]
+
+    def test_consumed_bytes_are_released(self):
+        """Test that completed tokens are dropped from the internal buffer."""
+        decoder = StreamDecoder()
+        decoder.feed(b"l4:spam10:01234")
+        assert decoder.buffer == b"10:01234"
+        decoder.feed(b"56789e")
+        assert decoder.buffer == b""
+
+    def test_unexpected_end_marker(self):
+        """Test that a stray end marker raises ValueError."""
+        with pytest.raises(ValueError):
+            StreamDecoder().feed(b"e")
+
+    def test_non_string_key(self):
+        """Test that dictionary keys must be strings."""
+        with pytest.raises(ValueError):
+            StreamDecoder().feed(b"di1ei2ee")
+
+    def test_missing_dict_value(self):
+        """Test that a dictionary closed after a key raises ValueError."""
+        with pytest.raises(ValueError):
+            StreamDecoder().feed(b"d3:keye")
+
+    def test_unterminated_string_length(self):
+        """Test that an overlong string length is rejected without more input."""
+        decoder = StreamDecoder()
+        decoder.feed(b"1" * 16)
+        with pytest.raises(ValueError):
+            decoder.feed(b"1" * 32)
+
+    def test_big_integer(self):
+        """Test that integers split across chunks are not limited in size."""
+        decoder = StreamDecoder()
+        assert decoder.feed(b"i" + b"1" * 40) == []
+        assert decoder.feed(b"1" * 40 + b"e") == [int(b"1" * 80)]
+
+    def test_invalid_type(self):
+        """Test that invalid bencode raises exception."""
+        with pytest.raises(NotImplementedError):
+            StreamDecoder().feed(b"x")
+
+    def test_max_depth(self):
+        """Test that nesting deeper than max_depth raises ValueError."""
+        decoder = StreamDecoder(max_depth=2)
+        assert decoder.feed(b"llee") == [[[]]]
+        with pytest.raises(ValueError):
+            decoder.feed(b"lll")
+
+    def test_max_string_length(self):
+        """Test that a long string is rejected as soon as its length is known."""
+        decoder = StreamDecoder(max_string_length=4)
+        assert decoder.feed(b"4:spam") == [b"spam"]
+        with pytest.raises(ValueError):
+            decoder.feed(b"100:")
+
+    def test_max_size(self):
+        """Test that a value growing past max_size is rejected mid-stream."""
+        decoder = StreamDecoder(max_size=16)
+        assert decoder.feed(b"l4:spame" * 4) == [[b"spam"]] * 4
+        decoder.feed(b"l4:spam")
+        decoder.feed(b"4:eggs")
+        with pytest.raises(ValueError):
+            decoder.feed(b"4:ham")
+
 
 class TestEncoder:
     """Test suite for the Bencode Encoder."""
@@ -168,6 +461,134 @@ class TestEncoder:
             encoder.encode("string")  # str instead of bytes
 
 
+class TestEncoderTargets:
+    """Test suite for encoding into caller-provided buffers and files."""
+
+    DATA = {b"list": [b"spam", b"eggs"], b"int": 42}
+    ENCODED = b"d3:inti42e4:listl4:spam4:eggsee"
+
+    def test_encode_into_appends(self):
+        """Test that encode_into appends to an existing buffer."""
+        buffer = bytearray(b"prefix")
+        result = Encoder().encode_into(self.DATA, buffer)
+        assert result is buffer
+        assert buffer == b"prefix" + self.ENCODED
+
+    def test_dump_to_file(self):
+        """Test that dump writes the same bytes as encode."""
+        fp = io.BytesIO()
+        Encoder().dump(self.DATA, fp)
+        assert fp.getvalue() == self.ENCODED
+
+    def test_dump_writes_large_strings_without_copy(self):
+        """Test that large strings are handed to the writer as-is."""
+        blob = b"x" * (Encoder.FLUSH_SIZE * 2)
+        writes = []
+
+        class Sink:
+            def write(self, data):
+                writes.append(data)
+
+        Encoder().dump({b"pieces": blob, b"name": b"a"}, Sink())
+        assert any(w is blob for w in writes)
+        assert b"".join(writes) == Encoder().encode({b"name": b"a", b"pieces": blob})
+
+    def test_encode_buffer_types(self):
+        """Test that bytearray and memoryview values are encoded as strings."""
+        encoder = Encoder()
+        assert encoder.encode([bytearray(b"ab"), memoryview(b"cd")]) == b"l2:ab2:cde"
+
+    def test_encoder_reusable_after_error(self):
+        """Test that a failed encode does not leak output into the next one."""
+        encoder = Encoder()
+        with pytest.raises(NotImplementedError):
+            encoder.encode([b"ok", "not bytes"])
+        assert encoder.encode(b"spam") == b"4:spam"
+
+
+class TestEncodeCache:
+    """Test suite for memoized encoding of frozen subtrees."""
+
+    INFO = {b"name": b"test", b"pieces": b"x" * 40, b"files": [{b"length": 1}]}
+
+    class CountingEncoder(Encoder):
+        def __init__(self, cache):
+            super().__init__(cache)
+            self.dicts = 0
+
+        def encode_dict(self, d):
+            self.dicts += 1
+            super().encode_dict(d)
+
+    def test_freeze(self):
+        """Test that freeze converts containers recursively."""
+        frozen = freeze({b"a": [{b"b": bytearray(b"c")}]})
+        assert isinstance(frozen, FrozenDict)
+        assert isinstance(frozen[b"a"], tuple)
+        assert isinstance(frozen[b"a"][0], FrozenDict)
+        assert type(frozen[b"a"][0][b"b"]) is bytes
+        assert freeze(frozen) is frozen
+
+    def test_frozen_dict_is_immutable(self):
+        """Test that FrozenDict rejects modification."""
+        frozen = FrozenDict({b"a": 1})
+        with pytest.raises(TypeError):
+            frozen[b"b"] = 2
+        with pytest.raises(TypeError):
+            frozen.update({b"b": 2})
+        with pytest.raises(TypeError):
+            del frozen[b"a"]
+
+    def test_frozen_dict_copies(self):
+        """Test that FrozenDicts can be pickled and copied."""
+        frozen = freeze({b"a": [{b"b": 1}]})
+        for copy in (pickle.loads(pickle.dumps(frozen)), deepcopy(frozen)):
+            assert copy == frozen
+            assert isinstance(copy, FrozenDict)
+            assert isinstance(copy[b"a"][0], FrozenDict)
+        assert copy[b"a"][0] is not frozen[b"a"][0]
+
+    def test_cached_encoding_matches(self):
+        """Test that cached output is identical to a plain encode."""
+        info = freeze(self.INFO)
+        encoder = Encoder(EncodeCache())
+        expected = Encoder().encode(self.INFO)
+        assert encoder.encode(info) == expected
+        assert encoder.encode(info) == expected
+
+    def test_unchanged_subtree_is_reused(self):
+        """Test that only the changed parts of a message are re-encoded."""
+        info = freeze(self.INFO)
+        encoder = self.CountingEncoder(EncodeCache())
+
+        first = encoder.encode({b"info": info, b"announce": b"http://a"})
+        assert encoder.dicts == 3
+
+        second = encoder.encode({b"info": info, b"announce": b"http://b"})
+        assert encoder.dicts == 4  # only the outer, mutable dict
+        assert first.replace(b"http://a", b"http://b") == second
+
+    def test_cache_is_bounded(self):
+        """Test that the least recently used entries are evicted."""
+        cache = EncodeCache(maxsize=2)
+        encoder = Encoder(cache)
+        a, b, c = freeze([1]), freeze([2]), freeze([3])
+        for obj in (a, b, a, c):
+            encoder.encode(obj)
+        assert len(cache) == 2
+        assert cache.get(a) == b"li1ee"
+        assert cache.get(b) is None
+
+    def test_cache_with_dump(self):
+        """Test that cached subtrees are written out when dumping."""
+        fp = io.BytesIO()
+        info = freeze(self.INFO)
+        encoder = Encoder(EncodeCache())
+        encoder.encode(info)
+        encoder.dump({b"info": info}, fp)
+        assert fp.getvalue() == Encoder().encode({b"info": self.INFO})
+
+
 class TestRoundTrip:
     """Test that encoding and decoding are inverse operations."""
 
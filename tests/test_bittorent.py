@@ -2,6 +2,7 @@ import asyncio
 import logging
 import shutil
 import tempfile
+import threading
 import time
 from pathlib import Path
 
@@ -9,6 +10,7 @@ import libtorrent as lt
 import pytest
 
 from src.client import SimpleClient
+from src.tracker_server import TrackerServer
 from .utils import create_payload, create_torrent_file, copy_payload, calculate_sha256
 
 logging.basicConfig(format="%(levelname)s:%(name)s:%(message)s", level=logging.DEBUG)
@@ -31,6 +33,23 @@ def workspace():
     return str(tmp_path)
 
 
+@pytest.fixture(autouse=True)
+def tracker():
+    """Run the tracker at TRACKER_URL on its own event loop"""
+    loop = asyncio.new_event_loop()
+    server = TrackerServer(interval=5)
+    loop.run_until_complete(server.start("localhost", 8080))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
 @pytest.fixture
 def create_mock_peer():
     sessions = []
@@ -79,7 +98,7 @@ def create_mock_peer():
 
 @pytest.mark.asyncio
 async def test_simple_download(workspace, create_mock_peer):
-    """Test downloading first piece from a single seeder using our Client"""
+    """Test downloading a torrent from a single seeder using our Client"""
     # Create a small payload (smaller than default piece size)
     payload_file = create_payload(workspace, 16 * 2**10)
     torrent_file = create_torrent_file(payload_file, TRACKER_URL, workspace)
@@ -94,14 +113,14 @@ async def test_simple_download(workspace, create_mock_peer):
     download_dir = Path(workspace) / "download"
     download_dir.mkdir(exist_ok=True)
 
-    # Attempt to fetch the first piece
-    logger.info("Attempting to fetch first piece with our client")
+    # Attempt to download the torrent
+    logger.info("Attempting to download with our client")
     client = SimpleClient()
-    result = await client.fetch_first_piece(torrent_file, str(download_dir))
+    result = await client.download(torrent_file, str(download_dir))
 
     # Verify we successfully connected and fetched without errors
-    assert result, "Client should have successfully fetched the first piece"
-    logger.info("Successfully fetched first piece!")
+    assert result, "Client should have successfully downloaded the torrent"
+    logger.info("Successfully downloaded the torrent!")
 
     # Verify the downloaded file exists
     downloaded_file = download_dir / Path(payload_file).name
@@ -0,0 +1,265 @@
+import asyncio
+import os
+import threading
+from unittest.mock import Mock
+
+import pytest
+import pytest_asyncio
+
+from src.bencode import Encoder
+from src.client import SimpleClient
+from src.create_torrent import create_torrent
+from src.download import Download
+from src.storage import Storage
+from src.swarm import SwarmManager
+from src.torrent_info import TorrentInfo
+from src.tracker import TrackerClient
+from src.tracker_server import TrackerServer, compact_address
+
+from .utils import FakeSeeder
+
+PIECE_LENGTH = 32 * 2**10
+
+
+@pytest.mark.asyncio
+class TestDownloadEngine:
+    """Test suite for downloading whole torrents from local seeders."""
+
+    @pytest.fixture
+    def payload(self, tmp_path):
+        """A multi-file payload whose files straddle piece boundaries."""
+        root = tmp_path / "seed" / "payload"
+        (root / "sub").mkdir(parents=True)
+        (root / "a.bin").write_bytes(os.urandom(100_000))
+        (root / "sub" / "b.bin").write_bytes(os.urandom(50_000))
+        (root / "z.bin").write_bytes(b"")
+        return root
+
+    @pytest_asyncio.fixture
+    async def tracker(self):
+        server = TrackerServer()
+        await server.start("127.0.0.1", 0)
+        yield server
+        await server.close()
+
+    @pytest.fixture
+    def torrent_file(self, payload, tracker, tmp_path):
+        url = f"http://127.0.0.1:{tracker.http_port()}/announce"
+        metainfo = create_torrent(str(payload), PIECE_LENGTH, [url])
+        path = tmp_path / "payload.torrent"
+        path.write_bytes(Encoder().encode(metainfo))
+        return str(path)
+
+    async def add_seeder(self, tracker, torrent_file, payload, **kwargs):
+        torrent = TorrentInfo.from_file(torrent_file)
+        data = b"".join(
+            (payload / path).read_bytes() for path in ("a.bin", "sub/b.bin")
+        )
+        seeder = FakeSeeder(torrent.info_hash[0], data, PIECE_LENGTH, **kwargs)
+        host, port = await seeder.start()
+        peer_id = b"-FS0001-%012d" % port
+        tracker.announce(torrent.info_hash[0], peer_id, compact_address(host, port), 0)
+        seeder.address = (host, port)
+        return seeder
+
+    async def run_swarm(self, torrent_file, output, first, **kwargs) -> bool:
+        """Download with a swarm manager that tries the `first` peer first."""
+        torrent = TorrentInfo.from_file(torrent_file)
+        storage = Storage(torrent.layout, output)
+        tracker = TrackerClient(torrent, b"-PY0001-000000000001")
+        download = Download(torrent, storage)
+        swarm = SwarmManager(torrent, download, tracker.peer_id, tracker, **kwargs)
+        swarm.add_peers([first.address])
+        try:
+            complete = await swarm.run()
+            storage.create_empty_files()
+            return complete
+        finally:
+            tracker.close()
+            download.close()
+            storage.close()
+
+    def assert_downloaded(self, payload, output):
+        for path in ("a.bin", "sub/b.bin", "z.bin"):
+            assert (output / "payload" / path).read_bytes() == (
+                payload / path
+            ).read_bytes()
+
+    async def test_download(self, tracker, torrent_file, payload, tmp_path):
+        """Test downloading every piece of a multi-file torrent."""
+        seeder = await self.add_seeder(tracker, torrent_file, payload)
+
+        output = tmp_path / "download"
+        assert await SimpleClient(peer_timeout=5).download(torrent_file, str(output))
+        seeder.close()
+
+        self.assert_downloaded(payload, output)
+        assert len(seeder.requests) == len(set(seeder.requests))
+        info_hash = TorrentInfo.from_file(torrent_file).info_hash[0]
+        stats = tracker.scrape([info_hash])[info_hash]
+        assert (stats.complete, stats.downloaded) == (2, 1)
+
+    async def test_resume(self, tracker, torrent_file, payload, tmp_path, monkeypatch):
+        """Test that only the pieces missing from disk are downloaded."""
+        threads = []
+        check = Download.check
+
+        def record_thread(download):
+            threads.append(threading.current_thread())
+            return check(download)
+
+        monkeypatch.setattr(Download, "check", record_thread)
+        seeder = await self.add_seeder(tracker, torrent_file, payload)
+        output = tmp_path / "download"
+        (output / "payload").mkdir(parents=True)
+        (output / "payload" / "a.bin").write_bytes((payload / "a.bin").read_bytes())
+
+        assert await SimpleClient(peer_timeout=5).download(torrent_file, str(output))
+        seeder.close()
+
+        self.assert_downloaded(payload, output)
+        # a.bin covers pieces 0 to 2 entirely and part of piece 3.
+        assert {index for index, _, _ in seeder.requests} == {3, 4}
+        # Existing data is hashed off the event loop.
+        assert threads and threads[0] is not threading.main_thread()
+
+    async def test_failover(self, tracker, torrent_file, payload, tmp_path):
+        """Test that corrupt and disconnecting peers are replaced by good ones."""
+        bad = [
+            await self.add_seeder(tracker, torrent_file, payload, corrupt={0, 1, 2}),
+            await self.add_seeder(tracker, torrent_file, payload, drop_after=3),
+        ]
+        partial = await self.add_seeder(tracker, torrent_file, payload, pieces={4})
+        good = await self.add_seeder(tracker, torrent_file, payload)
+
+        output = tmp_path / "download"
+        assert await SimpleClient(peer_timeout=5).download(torrent_file, str(output))
+        for seeder in [*bad, partial, good]:
+            seeder.close()
+
+        self.assert_downloaded(payload, output)
+
+    async def test_pipelining(self, tracker, torrent_file, payload, tmp_path):
+        """Test that requests are pipelined to hide the peer's latency."""
+        seeder = await self.add_seeder(tracker, torrent_file, payload, latency=0.05)
+
+        output = tmp_path / "download"
+        start = asyncio.get_running_loop().time()
+        assert await SimpleClient(peer_timeout=5).download(torrent_file, str(output))
+        elapsed = asyncio.get_running_loop().time() - start
+        seeder.close()
+
+        self.assert_downloaded(payload, output)
+        # Ten blocks one round trip at a time would take 0.5s.
+        assert seeder.max_in_flight > 4
+        assert elapsed < 0.35
+
+    async def test_many_peers(self, tracker, torrent_file, payload, tmp_path):
+        """Test that blocks are downloaded from every peer at the same time."""
+        seeders = [
+            await self.add_seeder(tracker, torrent_file, payload, latency=0.05)
+            for _ in range(3)
+        ]
+
+        output = tmp_path / "download"
+        assert await SimpleClient(peer_timeout=5).download(torrent_file, str(output))
+        for seeder in seeders:
+            seeder.close()
+
+        self.assert_downloaded(payload, output)
+        for seeder in seeders:
+            assert seeder.requests
+            assert len(seeder.requests) == len(set(seeder.requests))
+
+    async def test_connection_limit(self, tracker, torrent_file, payload, tmp_path):
+        """Test that no more than max_connections peers are connected to."""
+        seeders = [
+            await self.add_seeder(tracker, torrent_file, payload, latency=0.05)
+            for _ in range(3)
+        ]
+
+        output = tmp_path / "download"
+        client = SimpleClient(peer_timeout=5, max_connections=1)
+        assert await client.download(torrent_file, str(output))
+        for seeder in seeders:
+            seeder.close()
+
+        self.assert_downloaded(payload, output)
+        assert sum(seeder.connections for seeder in seeders) == 1
+
+    async def test_dead_peer_replaced(self, tracker, torrent_file, payload, tmp_path):
+        """Test that a peer leaving our requests unanswered is replaced."""
+        silent = await self.add_seeder(tracker, torrent_file, payload, latency=60)
+        good = await self.add_seeder(tracker, torrent_file, payload)
+
+        output = tmp_path / "download"
+        assert await self.run_swarm(
+            torrent_file, output, silent, max_connections=1, peer_timeout=0.2
+        )
+        silent.close()
+        good.close()
+
+        self.assert_downloaded(payload, output)
+        assert silent.requests and good.requests
+
+    async def test_slow_peer_replaced(self, tracker, torrent_file, payload, tmp_path):
+        """Test that the slowest peer makes room for a waiting one."""
+        slow = await self.add_seeder(tracker, torrent_file, payload, latency=0.5)
+        fast = await self.add_seeder(tracker, torrent_file, payload)
+
+        output = tmp_path / "download"
+        start = asyncio.get_running_loop().time()
+        assert await self.run_swarm(
+            torrent_file, output, slow, max_connections=1, rotate_interval=0.1
+        )
+        elapsed = asyncio.get_running_loop().time() - start
+        slow.close()
+        fast.close()
+
+        self.assert_downloaded(payload, output)
+        assert fast.requests
+        assert elapsed < 1
+
+    async def test_endgame(self, tracker, torrent_file, payload, tmp_path):
+        """Test that the last blocks are also requested from faster peers."""
+        slow = await self.add_seeder(tracker, torrent_file, payload, latency=1)
+        fast = await self.add_seeder(tracker, torrent_file, payload)
+
+        output = tmp_path / "download"
+        start = asyncio.get_running_loop().time()
+        assert await self.run_swarm(torrent_file, output, slow)
+        elapsed = asyncio.get_running_loop().time() - start
+        slow.close()
+        fast.close()
+
+        self.assert_downloaded(payload, output)
+        assert elapsed < 0.5
+        assert slow.cancels
+        assert set(slow.cancels) <= set(slow.requests)
+
+    async def test_announce_interval(
+        self, tracker, torrent_file, payload, tmp_path, monkeypatch
+    ):
+        """Test that a connected swarm waits for the tracker's interval."""
+        monkeypatch.setattr("src.swarm.RETRY_DELAY", 0.05)
+        seeder = await self.add_seeder(tracker, torrent_file, payload, latency=0.1)
+        tracker.announce = Mock(wraps=tracker.announce)
+
+        output = tmp_path / "download"
+        assert await self.run_swarm(torrent_file, output, seeder)
+        seeder.close()
+
+        self.assert_downloaded(payload, output)
+        assert tracker.announce.call_count == 1
+
+    async def test_verification_backpressure(
+        self, tracker, torrent_file, payload, tmp_path
+    ):
+        """Test that peers wait while too many pieces are being verified."""
+        seeder = await self.add_seeder(tracker, torrent_file, payload)
+
+        output = tmp_path / "download"
+        assert await self.run_swarm(torrent_file, output, seeder, max_verifying=1)
+        seeder.close()
+
+        self.assert_downloaded(payload, output)
@@ -0,0 +1,111 @@
+import os
+
+import libtorrent as lt
+import pytest
+
+from src.bencode import Encoder
+from src.create_torrent import choose_piece_length, create_torrent
+from src.torrent_info import TorrentInfo
+
+
+def libtorrent_info(path, piece_length: int) -> dict:
+    """The v1 info dictionary libtorrent creates for the same payload."""
+    fs = lt.file_storage()
+    lt.add_files(fs, str(path))
+    t = lt.create_torrent(fs, piece_length, flags=lt.create_torrent.v1_only)
+    lt.set_piece_hashes(t, str(path.parent))
+    return t.generate()[b"info"]
+
+
+class TestCreateTorrent:
+    """Test suite for creating metainfo with parallel piece hashing."""
+
+    PIECE_LENGTH = 32 * 2**10
+
+    @pytest.fixture
+    def payload(self, tmp_path):
+        """A directory whose files do not line up with piece boundaries."""
+        root = tmp_path / "payload"
+        (root / "sub").mkdir(parents=True)
+        (root / "a.bin").write_bytes(os.urandom(100_000))
+        (root / "sub" / "b.bin").write_bytes(os.urandom(5_000))
+        (root / "z.bin").write_bytes(os.urandom(70_000))
+        return root
+
+    def test_single_file_matches_libtorrent(self, payload):
+        """Test that a single-file torrent has the same info hash as libtorrent's."""
+        path = payload / "a.bin"
+        metainfo = create_torrent(str(path), self.PIECE_LENGTH, workers=4)
+
+        expected = libtorrent_info(path, self.PIECE_LENGTH)
+        assert metainfo[b"info"] == expected
+        assert (
+            TorrentInfo(metainfo).info_hash
+            == TorrentInfo({b"info": expected}).info_hash
+        )
+
+    def test_multi_file_pieces_match_libtorrent(self, payload):
+        """Test that pieces spanning several files are hashed correctly."""
+        metainfo = create_torrent(str(payload), self.PIECE_LENGTH, workers=3)
+
+        info = metainfo[b"info"]
+        assert info[b"pieces"] == libtorrent_info(payload, self.PIECE_LENGTH)[b"pieces"]
+        assert info[b"files"] == [
+            {b"length": 100_000, b"path": [b"a.bin"]},
+            {b"length": 70_000, b"path": [b"z.bin"]},
+            {b"length": 5_000, b"path": [b"sub", b"b.bin"]},
+        ]
+
+    def test_loadable(self, payload, tmp_path):
+        """Test that the written torrent loads and matches its layout."""
+        torrent_file = tmp_path / "payload.torrent"
+        with open(torrent_file, "wb") as f:
+            Encoder().dump(create_torrent(str(payload), self.PIECE_LENGTH), f)
+
+        ti = TorrentInfo.from_file(str(torrent_file))
+        assert ti.length == 175_000
+        assert len(ti.pieces) == ti.layout.piece_count == 6
+        assert lt.torrent_info(str(torrent_file)).num_pieces() == 6
+
+    def test_progress(self, payload):
+        """Test that progress is reported once per piece, in order."""
+        calls = []
+        create_torrent(
+            str(payload),
+            self.PIECE_LENGTH,
+            workers=2,
+            progress=lambda done, total: calls.append((done, total)),
+        )
+        assert calls == [(i, 6) for i in range(1, 7)]
+
+    def test_trackers(self, payload):
+        """Test announce and announce-list for plain URLs and tiers."""
+        single = create_torrent(str(payload), trackers=["http://a/announce"])
+        assert single[b"announce"] == b"http://a/announce"
+        assert b"announce-list" not in single
+
+        tiers = create_torrent(
+            str(payload),
+            trackers=[["http://a/announce", "http://b/announce"], ["udp://c:80"]],
+        )
+        assert tiers[b"announce"] == b"http://a/announce"
+        assert tiers[b"announce-list"] == [
+            [b"http://a/announce", b"http://b/announce"],
+            [b"udp://c:80"],
+        ]
+
+    def test_automatic_piece_length(self):
+        """Test piece length selection for small and very large payloads."""
+        assert choose_piece_length(1000) == 16 * 2**10
+        assert choose_piece_length(1500 * 2**20) == 2**20
+        assert choose_piece_length(2**42) == 16 * 2**20
+
+    def test_invalid_piece_length(self, payload):
+        """Test that piece lengths must be powers of two of at least 16 KiB."""
+        with pytest.raises(ValueError):
+            create_torrent(str(payload), 3 * 2**14)
+
+    def test_empty_directory(self, tmp_path):
+        """Test that there must be something to share."""
+        with pytest.raises(ValueError):
+            create_torrent(str(tmp_path))
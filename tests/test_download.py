@@ -0,0 +1,326 @@
+import hashlib
+import os
+import threading
+
+import pytest
+
+from src.bitfield import Bitfield
+from src.download import MISSING, RECEIVED, RECEIVING, REQUESTED, Download
+from src.file_layout import FileLayout
+from src.peer import BLOCK_SIZE
+from src.storage import Storage
+from src.torrent_info import TorrentInfo
+
+PIECE_LENGTH = 2 * BLOCK_SIZE
+
+
+def make_torrent(payload: bytes, files: list[tuple[str, int]]) -> TorrentInfo:
+    pieces = b"".join(
+        hashlib.sha1(payload[i : i + PIECE_LENGTH]).digest()
+        for i in range(0, len(payload), PIECE_LENGTH)
+    )
+    return TorrentInfo(
+        {
+            b"announce": b"http://127.0.0.1/announce",
+            b"info": {
+                b"name": b"root",
+                b"piece length": PIECE_LENGTH,
+                b"pieces": pieces,
+                b"files": [
+                    {b"length": length, b"path": path.encode().split(b"/")}
+                    for path, length in files
+                ],
+            },
+        }
+    )
+
+
+class TestBitfield:
+    """Test suite for piece bitfields."""
+
+    def test_set_and_iterate(self):
+        """Test adding pieces and iterating over them in order."""
+        bits = Bitfield(20)
+        for i in (19, 0, 9, 8):
+            bits.add(i)
+        assert list(bits) == [0, 8, 9, 19]
+        assert bits.count() == 4
+        assert bits[9] and not bits[10]
+        assert bits.to_bytes() == b"\x80\xc0\x10"
+
+        bits.discard(9)
+        assert list(bits) == [0, 8, 19]
+
+    def test_issubset(self):
+        """Test comparing the pieces of two bitfields."""
+        assert Bitfield(10, b"\x80\x40").issubset(Bitfield(10, b"\xc0\x40"))
+        assert not Bitfield(10, b"\x80\x40").issubset(Bitfield(10, b"\x80\x00"))
+
+    def test_complete(self):
+        """Test that a bitfield is complete once every piece is set."""
+        bits = Bitfield(3, b"\xe0")
+        assert bits.complete
+        assert not Bitfield(3, b"\xc0").complete
+
+    def test_invalid(self):
+        """Test that malformed bitfields are rejected."""
+        with pytest.raises(ValueError, match="2 bytes"):
+            Bitfield(3, b"\xe0\x00")
+        with pytest.raises(ValueError, match="Spare bits"):
+            Bitfield(3, b"\xf0")
+        with pytest.raises(IndexError):
+            Bitfield(3).add(3)
+
+
+class TestStorage:
+    """Test suite for reading and writing pieces across files."""
+
+    def test_write_across_files(self, tmp_path):
+        """Test that a write spanning several files lands in each of them."""
+        layout = FileLayout([("t/a", 5), ("t/b/c", 3), ("t/d", 10)], 8)
+        storage = Storage(layout, tmp_path)
+
+        storage.write(0, 3, b"0123456789")
+        assert storage.read(0, 3, 10) == b"0123456789"
+        storage.close()
+
+        assert (tmp_path / "t" / "a").read_bytes() == b"\0\0\x0001"
+        assert (tmp_path / "t" / "b" / "c").read_bytes() == b"234"
+        assert (tmp_path / "t" / "d").read_bytes() == b"56789"
+
+    def test_read_missing(self, tmp_path):
+        """Test that reading data never written returns None."""
+        layout = FileLayout([("a", 4), ("b", 4)], 4)
+        storage = Storage(layout, tmp_path)
+        storage.write(0, 0, b"abcd")
+
+        assert storage.read_piece(0) == b"abcd"
+        assert storage.read_piece(1) is None
+        storage.close()
+
+    def test_padding_not_stored(self, tmp_path):
+        """Test that padding files are neither created nor read."""
+        layout = FileLayout([("a", 2), ("pad", 2), ("b", 4)], 4, padding={1})
+        storage = Storage(layout, tmp_path)
+
+        storage.write(0, 0, b"ab\0\0")
+        assert storage.read_piece(0) == b"ab\0\0"
+        storage.close()
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["a"]
+
+    def test_unsafe_path(self, tmp_path):
+        """Test that paths escaping the download directory are refused."""
+        storage = Storage(FileLayout([("t/../../x", 4)], 4), tmp_path)
+        with pytest.raises(ValueError, match="Unsafe"):
+            storage.write(0, 0, b"abcd")
+
+
+class TestDownload:
+    """Test suite for piece and block bookkeeping."""
+
+    FILES = [("a.bin", 50_000), ("sub/b.bin", 30_000)]
+
+    @pytest.fixture
+    def payload(self):
+        return os.urandom(sum(length for _, length in self.FILES))
+
+    @pytest.fixture
+    def download(self, payload, tmp_path):
+        torrent = make_torrent(payload, self.FILES)
+        storage = Storage(torrent.layout, tmp_path)
+        download = Download(torrent, storage)
+        yield download
+        download.close()
+        storage.close()
+
+    async def receive(self, download, payload, request) -> bool | None:
+        """Deliver a block; whether its piece verified once it is complete."""
+        index, begin, length = request
+        start = index * PIECE_LENGTH + begin
+        piece = download.block_received(index, begin, payload[start : start + length])
+        return None if piece is None else await download.verify(piece)
+
+    def peer(self, download, pieces=range(3)) -> Bitfield:
+        """A peer's bitfield, counted in the piece availability."""
+        available = Bitfield(download.piece_count)
+        for index in pieces:
+            available.add(index)
+        download.picker.add_peer(available)
+        return available
+
+    def test_requests_finish_started_pieces(self, download):
+        """Test that blocks of a started piece are requested before new pieces."""
+        everything = self.peer(download)
+        self.peer(download, [2])
+        index, begin, length = download.next_request(everything)
+        assert (begin, length) == (0, BLOCK_SIZE)
+        assert download.next_request(everything) == (index, BLOCK_SIZE, BLOCK_SIZE)
+        assert download.next_request(everything)[0] != index
+
+    def test_rarest_first(self, download):
+        """Test that the piece the fewest peers have is started first."""
+        everything = self.peer(download)
+        self.peer(download, [0, 2])
+        assert download.next_request(everything)[0] == 1
+        assert download.next_request(everything)[0] == 1
+        self.peer(download, [0])
+        assert download.next_request(everything)[0] == 2
+
+    def test_peers_keep_to_their_pieces(self, download):
+        """Test that pieces are shared between peers only once none is left."""
+        everything = self.peer(download)
+        # Make the last piece, which has a single block, the least rare.
+        self.peer(download, [2])
+        first = download.next_request(everything, "a")
+        second = download.next_request(everything, "b")
+        assert first[0] != second[0]
+        assert download.next_request(everything, "a")[0] == first[0]
+        assert download.next_request(everything, "b")[0] == second[0]
+        assert download.next_request(everything, "c")[0] == 2
+        assert download.next_request(everything, "c") is None
+
+    def test_last_block_is_short(self, download):
+        """Test that the final block is cut at the end of the payload."""
+        last = self.peer(download, [2])
+        assert download.next_request(last) == (2, 0, 80_000 - 2 * PIECE_LENGTH)
+        assert download.next_request(last) is None
+
+    def test_unavailable_pieces_not_requested(self, download):
+        """Test that pieces are only requested once some peer is known to have them."""
+        assert download.next_request(Bitfield(download.piece_count, b"\xe0")) is None
+
+    def test_endgame(self, download):
+        """Test that once every block is requested, they are offered again."""
+        everything = self.peer(download)
+        pending = {}
+        while not download.endgame:
+            index, begin, length = download.next_request(everything)
+            pending[index, begin] = length
+
+        assert download.next_request(everything) is None
+        assert download.endgame_request(everything, pending) is None
+        index, begin, length = download.endgame_request(everything, {})
+        assert pending[index, begin] == length
+        only_last = self.peer(download, [2])
+        assert download.endgame_request(only_last, {})[0] == 2
+
+    @pytest.mark.asyncio
+    async def test_complete_download(self, download, payload, tmp_path):
+        """Test that verified pieces are written out and the download completes."""
+        everything = self.peer(download)
+        results = []
+        while request := download.next_request(everything):
+            results.append(await self.receive(download, payload, request))
+
+        assert results.count(True) == 3 and False not in results
+        assert download.complete
+        assert download.left == 0
+        assert download.downloaded == len(payload)
+        download.storage.close()
+        assert (tmp_path / "root" / "a.bin").read_bytes() == payload[:50_000]
+        assert (tmp_path / "root" / "sub" / "b.bin").read_bytes() == payload[50_000:]
+
+    @pytest.mark.asyncio
+    async def test_corrupt_piece_is_retried(self, download, payload):
+        """Test that a piece failing verification is downloaded again."""
+        first = self.peer(download, [0])
+        download.next_request(first)
+        download.next_request(first)
+        assert download.block_received(0, 0, bytes(BLOCK_SIZE)) is None
+        piece = download.block_received(0, BLOCK_SIZE, bytes(BLOCK_SIZE))
+        assert download.verifying == {0: piece}
+        assert download.next_request(first) is None
+        assert await download.verify(piece) is False
+
+        assert download.hash_failures == 1
+        assert download.strikes == {None: 1}
+        assert not download.have[0]
+        assert list(download.active[0].blocks) == [MISSING, MISSING]
+        assert download.next_request(first) == (0, 0, BLOCK_SIZE)
+
+    @pytest.mark.asyncio
+    async def test_incremental_hash(self, download, payload):
+        """Test that blocks are hashed as soon as the blocks before them arrive."""
+        first = self.peer(download, [0])
+        download.next_request(first)
+        download.next_request(first)
+        piece = download.active[0]
+
+        await self.receive(download, payload, (0, BLOCK_SIZE, BLOCK_SIZE))
+        assert piece.hashed == 0
+        await self.receive(download, payload, (0, 0, BLOCK_SIZE))
+        assert piece.hashed == PIECE_LENGTH
+        assert piece.hasher.digest() == download.torrent.pieces[0]
+        assert download.have[0]
+
+    @pytest.mark.asyncio
+    async def test_verified_off_the_event_loop(self, download, payload):
+        """Test that pieces are checked and written by a worker thread."""
+        threads = []
+        write = download.storage.write
+
+        def recording_write(*args):
+            threads.append(threading.current_thread())
+            write(*args)
+
+        download.storage.write = recording_write
+        last = self.peer(download, [2])
+        assert await self.receive(download, payload, download.next_request(last))
+        assert threads and threads[0] is not threading.main_thread()
+
+    def test_block_received_in_place(self, download, payload):
+        """Test receiving a block into the piece's buffer, or abandoning it."""
+        first = self.peer(download, [0])
+        download.next_request(first)
+        download.next_request(first)
+        piece = download.active[0]
+
+        buffer = download.block_buffer(0, 0, BLOCK_SIZE)
+        assert piece.blocks[0] == RECEIVING
+        assert download.block_buffer(0, 0, BLOCK_SIZE) is None
+        assert download.block_received(0, 0, payload[:BLOCK_SIZE]) is None
+        buffer[:] = payload[:BLOCK_SIZE]
+        assert download.block_written(0, 0) is None
+        assert list(piece.blocks) == [RECEIVED, REQUESTED]
+        assert piece.hashed == BLOCK_SIZE
+
+        download.block_buffer(0, BLOCK_SIZE, BLOCK_SIZE)
+        download.release(0, BLOCK_SIZE)
+        assert piece.blocks[1] == RECEIVING
+        download.abandon(0, BLOCK_SIZE)
+        assert piece.blocks[1] == MISSING
+        assert download.block_written(0, BLOCK_SIZE) is None
+
+    def test_release(self, download):
+        """Test that released blocks are requested again."""
+        first = self.peer(download, [0])
+        download.next_request(first)
+        assert download.active[0].blocks[0] == REQUESTED
+
+        download.release(0, 0)
+        assert download.active[0].blocks[0] == MISSING
+        assert download.next_request(first) == (0, 0, BLOCK_SIZE)
+
+    def test_unexpected_blocks_ignored(self, download, payload):
+        """Test that blocks of pieces not in progress or misaligned are dropped."""
+        download.next_request(self.peer(download, [0]))
+
+        assert download.block_received(1, 0, bytes(BLOCK_SIZE)) is None
+        assert download.block_received(0, 1, bytes(BLOCK_SIZE)) is None
+        assert download.block_received(0, 0, bytes(10)) is None
+        assert list(download.active[0].blocks) == [REQUESTED, MISSING]
+
+        download.block_received(0, 0, payload[:BLOCK_SIZE])
+        assert download.block_received(0, 0, bytes(BLOCK_SIZE)) is None
+        assert list(download.active[0].blocks) == [RECEIVED, MISSING]
+
+    def test_check_resumes(self, download, payload):
+        """Test that pieces already on disk are found by check()."""
+        download.storage.write(0, 0, payload[:PIECE_LENGTH])
+        download.storage.write(2, 0, bytes(payload[2 * PIECE_LENGTH :]))
+        download.storage.write(1, 0, bytes(PIECE_LENGTH))
+
+        assert download.check() == 2
+        assert list(download.have) == [0, 2]
+        assert download.left == PIECE_LENGTH
+        assert download.next_request(self.peer(download))[0] == 1
@@ -0,0 +1,75 @@
+import pytest
+
+from src.file_layout import Extent, FileLayout
+
+
+class TestFileLayout:
+    """Test suite for mapping piece ranges onto files."""
+
+    @pytest.fixture
+    def layout(self):
+        """Files of 10, 0, 25 and 5 bytes with 16 byte pieces."""
+        return FileLayout([("a", 10), ("empty", 0), ("b", 25), ("c", 5)], 16)
+
+    def test_offsets(self, layout):
+        """Test that file offsets are prefix sums of the lengths."""
+        assert [f.offset for f in layout.files] == [0, 10, 10, 35]
+        assert layout.total_length == 40
+        assert len(layout) == 4
+
+    def test_piece_sizes(self, layout):
+        """Test piece count and the size of the last, shorter piece."""
+        assert layout.piece_count == 3
+        assert [layout.piece_size(i) for i in range(3)] == [16, 16, 8]
+        with pytest.raises(IndexError):
+            layout.piece_size(3)
+
+    def test_extent_within_file(self, layout):
+        """Test a range that falls inside a single file."""
+        assert layout.extents(1, 0, 8) == [Extent(2, 6, 8)]
+
+    def test_extent_spanning_files(self, layout):
+        """Test a range crossing file boundaries, skipping empty files."""
+        assert layout.piece_extents(0) == [Extent(0, 0, 10), Extent(2, 0, 6)]
+        assert layout.piece_extents(2) == [Extent(2, 22, 3), Extent(3, 0, 5)]
+
+    def test_extent_starting_at_file_boundary(self, layout):
+        """Test a range that starts exactly where a file starts."""
+        assert layout.extents(0, 10, 2) == [Extent(2, 0, 2)]
+
+    def test_extent_out_of_range(self, layout):
+        """Test that ranges past the end of the payload are rejected."""
+        with pytest.raises(ValueError):
+            layout.extents(2, 0, 9)
+        with pytest.raises(ValueError):
+            layout.extents(0, -1, 1)
+
+    def test_from_info_single_file(self):
+        """Test the layout of a single-file torrent."""
+        info = {b"name": b"a.txt", b"length": 100, b"piece length": 32}
+        layout = FileLayout.from_info(info)
+        assert layout.files == [("a.txt", 100, 0)]
+        assert layout.piece_count == 4
+
+    def test_from_info_multi_file(self):
+        """Test that multi-file paths are placed under the torrent name."""
+        info = {
+            b"name": b"dir",
+            b"piece length": 32,
+            b"files": [
+                {b"length": 1, b"path": [b"x"]},
+                {b"length": 2, b"path": [b"y", b"z"]},
+            ],
+        }
+        layout = FileLayout.from_info(info)
+        assert [f.path for f in layout.files] == ["dir/x", "dir/y/z"]
+
+    def test_many_files(self):
+        """Test lookups stay correct with a large number of files."""
+        count = 100_000
+        layout = FileLayout([(f"f{i}", 3) for i in range(count)], 2**14)
+        piece = 10
+        extents = layout.piece_extents(piece)
+        start = piece * 2**14
+        assert extents[0] == Extent(start // 3, start % 3, 3 - start % 3)
+        assert sum(e.length for e in extents) == 2**14
@@ -0,0 +1,82 @@
+import hashlib
+
+import pytest
+
+from src import merkle
+from src.merkle import BLOCK_SIZE
+
+
+def h(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+class TestMerkle:
+    """Test suite for the BitTorrent v2 Merkle tree helpers."""
+
+    @pytest.fixture
+    def data(self):
+        """Five and a half blocks of distinct content."""
+        return b"".join(bytes([i]) * BLOCK_SIZE for i in range(5)) + b"tail"
+
+    def test_pad_hash(self):
+        """Test the roots of all-zero subtrees."""
+        zero = bytes(32)
+        assert merkle.pad_hash(0) == zero
+        assert merkle.pad_hash(1) == h(zero + zero)
+        assert merkle.pad_hash(2) == h(merkle.pad_hash(1) * 2)
+
+    def test_merkle_root_pads_with_zero_leaves(self):
+        """Test that missing leaves are zero hashes."""
+        a, b, c = h(b"a"), h(b"b"), h(b"c")
+        expected = h(h(a + b) + h(c + bytes(32)))
+        assert merkle.merkle_root([a, b, c]) == expected
+        assert merkle.merkle_root([a]) == a
+        assert merkle.merkle_root([a], leaf_count=2) == h(a + bytes(32))
+
+    def test_merkle_root_too_many_hashes(self):
+        """Test that hashes must fit in the requested number of leaves."""
+        with pytest.raises(ValueError):
+            merkle.merkle_root([bytes(32)] * 3, leaf_count=2)
+
+    def test_layer_root_matches_file_root(self, data):
+        """Test that hashing through the piece layer gives the file root."""
+        piece_length = 2 * BLOCK_SIZE
+        layer = merkle.piece_layer(data, piece_length)
+        assert len(layer) == 3
+        assert merkle.layer_root(layer, piece_length) == merkle.file_root(data)
+
+    def test_last_piece_padded_to_full_size(self, data):
+        """Test that a short last piece is padded to a full piece of leaves."""
+        piece_length = 4 * BLOCK_SIZE
+        last = data[piece_length:]
+        expected = merkle.merkle_root(merkle.block_hashes(last), 4)
+        assert merkle.piece_layer(data, piece_length)[-1] == expected
+
+    def test_proof_round_trip(self, data):
+        """Test that every leaf verifies with its proof."""
+        hashes = merkle.block_hashes(data)
+        root = merkle.merkle_root(hashes)
+        for i, leaf in enumerate(hashes):
+            uncles = merkle.proof(hashes, i)
+            assert merkle.verify_proof(leaf, i, uncles, root)
+            assert not merkle.verify_proof(h(b"bad"), i, uncles, root)
+
+    def test_bad_blocks(self, data):
+        """Test that only the corrupted block is reported."""
+        piece = data[: 4 * BLOCK_SIZE]
+        hashes = merkle.block_hashes(piece)
+        root = merkle.piece_root(piece, 4 * BLOCK_SIZE)
+
+        corrupted = bytearray(piece)
+        corrupted[BLOCK_SIZE * 2 + 10] ^= 0xFF
+        assert merkle.bad_blocks(corrupted, hashes, root, 4) == [2]
+        assert merkle.bad_blocks(piece, hashes, root, 4) == []
+
+    def test_bad_blocks_untrusted_hashes(self, data):
+        """Test that block hashes not matching the trusted root are rejected."""
+        piece = data[: 4 * BLOCK_SIZE]
+        hashes = merkle.block_hashes(piece)
+        root = merkle.piece_root(piece, 4 * BLOCK_SIZE)
+        hashes[1] = h(b"forged")
+        with pytest.raises(ValueError):
+            merkle.bad_blocks(piece, hashes, root, 4)
@@ -0,0 +1,321 @@
+import asyncio
+import struct
+
+import pytest
+
+from src.peer import (
+    BLOCK_SIZE,
+    INITIAL_QUEUE_DEPTH,
+    MAX_MESSAGE_SIZE,
+    MAX_QUEUED_MESSAGES,
+    PIECE,
+    RATE_INTERVAL,
+    RECEIVE_BUFFER_SIZE,
+    Block,
+    PeerConnection,
+    PeerError,
+    RequestQueue,
+)
+
+INFO_HASH = b"i" * 20
+PEER_ID = b"-PY0001-000000000001"
+
+
+class TestRequestQueue:
+    """Test suite for the adaptive request pipeline."""
+
+    def fill(self, queue: RequestQueue, start: int = 0) -> int:
+        n = queue.free()
+        for i in range(start, start + n):
+            queue.add(i, 0, BLOCK_SIZE)
+        return n
+
+    def test_initial_depth(self):
+        """Test that a new queue allows a few requests in flight."""
+        queue = RequestQueue()
+        assert self.fill(queue) == INITIAL_QUEUE_DEPTH
+        assert queue.free() == 0
+        assert len(queue) == INITIAL_QUEUE_DEPTH
+
+    def test_slow_start(self):
+        """Test that each received block grows the queue by one."""
+        queue = RequestQueue()
+        self.fill(queue)
+        now = queue.sample_start
+
+        assert queue.received(0, 0, BLOCK_SIZE, now)
+        assert queue.depth == INITIAL_QUEUE_DEPTH + 1
+        assert queue.free() == 2
+
+    def test_depth_follows_rate(self):
+        """Test that the depth settles at rate * queue_time once the rate plateaus."""
+        queue = RequestQueue(queue_time=2)
+        start = 0.0
+        received = 0
+        # 100 blocks per second, for a few sampling intervals.
+        for _ in range(4):
+            queue.sample_start = start
+            for i in range(100):
+                queue.add(received, 0, BLOCK_SIZE)
+                now = start + (i + 1) * RATE_INTERVAL / 100
+                assert queue.received(received, 0, BLOCK_SIZE, now)
+                received += 1
+            start = now
+
+        assert not queue.slow_start
+        assert queue.rate == pytest.approx(100 * BLOCK_SIZE)
+        assert queue.depth == 200
+
+    def test_depth_is_clamped(self):
+        """Test the minimum and maximum queue depths."""
+        queue = RequestQueue(min_depth=3, max_depth=50)
+        queue.slow_start = False
+        queue.update_rate(10_000 * BLOCK_SIZE)
+        assert queue.depth == 50
+
+        queue.rate = 0
+        queue.update_rate(1)
+        assert queue.depth == 3
+
+    def test_unexpected_blocks(self):
+        """Test that blocks not requested, or of the wrong size, are refused."""
+        queue = RequestQueue()
+        queue.add(1, 0, BLOCK_SIZE)
+
+        assert not queue.received(2, 0, BLOCK_SIZE)
+        assert not queue.received(1, 0, 100)
+        assert queue.received(1, 0, BLOCK_SIZE)
+        assert not queue.received(1, 0, BLOCK_SIZE)
+
+    def test_cancel(self):
+        """Test that cancelled requests are no longer pending."""
+        queue = RequestQueue()
+        queue.add(1, 0, BLOCK_SIZE)
+
+        assert queue.cancel(1, 0) == BLOCK_SIZE
+        assert queue.cancel(1, 0) is None
+        assert not queue.received(1, 0, BLOCK_SIZE)
+
+    def test_clear(self):
+        """Test that clearing returns the requests that were in flight."""
+        queue = RequestQueue()
+        queue.add(1, 0, BLOCK_SIZE)
+        queue.add(1, BLOCK_SIZE, BLOCK_SIZE)
+
+        assert queue.clear() == [(1, 0), (1, BLOCK_SIZE)]
+        assert len(queue) == 0
+
+
+@pytest.mark.asyncio
+class TestPeerConnection:
+    """Test suite for the peer wire protocol."""
+
+    async def serve(self, handler) -> tuple[str, int]:
+        server = await asyncio.start_server(handler, "127.0.0.1", 0)
+        self.server = server
+        return server.sockets[0].getsockname()[:2]
+
+    async def test_handshake_and_messages(self):
+        """Test the handshake and that state messages update the connection."""
+
+        async def handler(reader, writer):
+            handshake = await reader.readexactly(68)
+            writer.write(handshake[:48] + b"-XX0001-000000000002")
+            writer.write(struct.pack(">IBB", 2, 5, 0b10100000))
+            writer.write(struct.pack(">IBI", 5, 4, 1))
+            writer.write(struct.pack(">IBI", 5, 4, 1))
+            writer.write(struct.pack(">I", 0))
+            writer.write(struct.pack(">IB", 1, 1))
+            await writer.drain()
+
+        address = await self.serve(handler)
+        conn = await PeerConnection.open(address, INFO_HASH, PEER_ID, 3)
+        assert conn.peer_id == b"-XX0001-000000000002"
+
+        assert await conn.read_message() == (5, b"\xa0")
+        assert list(conn.bitfield) == [0, 2]
+        assert await conn.read_message() == (4, b"\x00\x00\x00\x01")
+        assert list(conn.bitfield) == [0, 1, 2]
+        # A second have for the same piece, then a keep-alive.
+        assert await conn.read_message() is None
+        assert await conn.read_message() is None
+        assert conn.choking
+        await conn.read_message()
+        assert not conn.choking
+
+        conn.close()
+        self.server.close()
+
+    async def test_wrong_info_hash(self):
+        """Test that a peer serving another torrent is rejected."""
+
+        async def handler(reader, writer):
+            handshake = await reader.readexactly(68)
+            writer.write(handshake[:28] + b"x" * 40)
+            await writer.drain()
+
+        address = await self.serve(handler)
+        with pytest.raises(PeerError, match="different info hash"):
+            await PeerConnection.open(address, INFO_HASH, PEER_ID, 3)
+        self.server.close()
+
+    async def test_invalid_messages(self):
+        """Test that oversized messages and bad bitfields are refused."""
+
+        async def handler(reader, writer):
+            handshake = await reader.readexactly(68)
+            writer.write(handshake)
+            writer.write(struct.pack(">IBB", 2, 5, 0xFF))
+            writer.write(struct.pack(">I", MAX_MESSAGE_SIZE + 1))
+            await writer.drain()
+
+        address = await self.serve(handler)
+        conn = await PeerConnection.open(address, INFO_HASH, PEER_ID, 3)
+        with pytest.raises(PeerError, match="Spare bits"):
+            await conn.read_message()
+        with pytest.raises(PeerError, match="too large"):
+            await conn.read_message()
+        conn.close()
+        self.server.close()
+
+    async def test_send_requests(self):
+        """Test that batched requests arrive as separate request messages."""
+        received = asyncio.get_running_loop().create_future()
+
+        async def handler(reader, writer):
+            handshake = await reader.readexactly(68)
+            writer.write(handshake)
+            await writer.drain()
+            received.set_result(await reader.readexactly(2 * 17))
+
+        address = await self.serve(handler)
+        conn = await PeerConnection.open(address, INFO_HASH, PEER_ID, 3)
+        conn.send_requests([(0, 0, BLOCK_SIZE), (2, BLOCK_SIZE, 100)])
+        await conn.drain()
+
+        data = await received
+        assert list(struct.iter_unpack(">IBIII", data)) == [
+            (13, 6, 0, 0, BLOCK_SIZE),
+            (13, 6, 2, BLOCK_SIZE, 100),
+        ]
+        conn.close()
+        self.server.close()
+
+    async def test_block_received_in_place(self):
+        """Test that a block sent in pieces lands straight in the sink's buffer."""
+        block = bytes(range(256)) * (BLOCK_SIZE // 256)
+        sent = asyncio.Event()
+
+        async def handler(reader, writer):
+            handshake = await reader.readexactly(68)
+            writer.write(handshake)
+            message = struct.pack(">IBII", BLOCK_SIZE + 9, PIECE, 3, BLOCK_SIZE)
+            message += block
+            for i in range(0, len(message), 5000):
+                writer.write(message[i : i + 5000])
+                await writer.drain()
+                await asyncio.sleep(0.01)
+            await sent.wait()
+
+        address = await self.serve(handler)
+        conn = await PeerConnection.open(address, INFO_HASH, PEER_ID, 4)
+        destination = bytearray(2 * BLOCK_SIZE)
+        sinks = []
+
+        def sink(index, begin, length):
+            sinks.append((index, begin, length))
+            return memoryview(destination)[begin : begin + length]
+
+        conn.sink = sink
+        assert await conn.read_message() == (
+            PIECE,
+            Block(3, BLOCK_SIZE, BLOCK_SIZE, None),
+        )
+        assert sinks == [(3, BLOCK_SIZE, BLOCK_SIZE)]
+        assert destination[BLOCK_SIZE:] == block
+        assert conn.abandoned_blocks() == []
+        sent.set()
+        conn.close()
+        self.server.close()
+
+    async def test_block_refused_by_sink(self):
+        """Test that blocks the sink doesn't want are returned as bytes."""
+
+        async def handler(reader, writer):
+            handshake = await reader.readexactly(68)
+            writer.write(handshake)
+            writer.write(struct.pack(">IBII", 13, PIECE, 1, 0) + b"abcd")
+            await writer.drain()
+
+        address = await self.serve(handler)
+        conn = await PeerConnection.open(address, INFO_HASH, PEER_ID, 4)
+        conn.sink = lambda index, begin, length: None
+        assert await conn.read_message() == (PIECE, Block(1, 0, 4, b"abcd"))
+        conn.close()
+        self.server.close()
+
+    async def test_abandoned_block(self):
+        """Test that a block cut short by a disconnection is reported."""
+
+        async def handler(reader, writer):
+            handshake = await reader.readexactly(68)
+            writer.write(handshake)
+            await reader.readexactly(5)
+            writer.write(struct.pack(">IBII", BLOCK_SIZE + 9, PIECE, 0, 0))
+            writer.write(bytes(100))
+            await writer.drain()
+            writer.close()
+
+        address = await self.serve(handler)
+        conn = await PeerConnection.open(address, INFO_HASH, PEER_ID, 4)
+        conn.sink = lambda index, begin, length: memoryview(bytearray(length))
+        conn.send_interested()
+        with pytest.raises(EOFError):
+            await conn.read_message()
+        assert conn.abandoned_blocks() == [Block(0, 0, BLOCK_SIZE, None)]
+        self.server.close()
+
+    async def test_large_message(self):
+        """Test that messages larger than the receive buffer are framed."""
+        piece_count = 8 * 2 * RECEIVE_BUFFER_SIZE
+        bitfield = b"\x55" * (piece_count // 8)
+
+        async def handler(reader, writer):
+            handshake = await reader.readexactly(68)
+            writer.write(handshake)
+            writer.write(struct.pack(">IB", len(bitfield) + 1, 5) + bitfield)
+            writer.write(struct.pack(">IBI", 5, 4, 0))
+            await writer.drain()
+
+        address = await self.serve(handler)
+        conn = await PeerConnection.open(address, INFO_HASH, PEER_ID, piece_count)
+        assert await conn.read_message() == (5, bitfield)
+        assert conn.bitfield.count() == piece_count // 2
+        await conn.read_message()
+        assert conn.bitfield[0]
+        conn.close()
+        self.server.close()
+
+    async def test_reading_pauses(self):
+        """Test that the socket isn't read while too many messages are unread."""
+
+        async def handler(reader, writer):
+            handshake = await reader.readexactly(68)
+            writer.write(handshake)
+            writer.write(struct.pack(">I", 0) * count)
+            await writer.drain()
+
+        # More keep-alives than fit in the receive buffer.
+        count = RECEIVE_BUFFER_SIZE
+        address = await self.serve(handler)
+        conn = await PeerConnection.open(address, INFO_HASH, PEER_ID, 4)
+        await asyncio.sleep(0.05)
+        assert conn.reading_paused
+        assert MAX_QUEUED_MESSAGES <= len(conn.messages) < count
+
+        for _ in range(count):
+            assert await conn.read_message() is None
+        assert not conn.reading_paused
+        assert not conn.messages
+        conn.close()
+        self.server.close()
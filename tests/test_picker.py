@@ -0,0 +1,94 @@
+import random
+
+from src.bitfield import Bitfield
+from src.picker import PiecePicker
+
+
+def bitfield(length: int, pieces) -> Bitfield:
+    bits = Bitfield(length)
+    for index in pieces:
+        bits.add(index)
+    return bits
+
+
+class TestPiecePicker:
+    """Test suite for rarest-first piece picking."""
+
+    def check_order(self, picker: PiecePicker):
+        """Assert that the wanted pieces are sorted by availability."""
+        wanted = picker.order[: len(picker)]
+        counts = [picker.availability[index] for index in wanted]
+        assert counts == sorted(counts)
+        for count in range(len(picker.starts) - 1):
+            for i in range(picker.starts[count], picker.starts[count + 1]):
+                assert picker.availability[picker.order[i]] == count
+        for i, index in enumerate(picker.order):
+            if i < len(picker):
+                assert picker.position[index] == i
+
+    def test_rarest_first(self):
+        """Test that the piece fewest peers have is picked first."""
+        picker = PiecePicker(8)
+        seeder = bitfield(8, range(8))
+        picker.add_peer(seeder)
+        picker.add_peer(seeder)
+        picker.add_peer(bitfield(8, [2, 5, 6]))
+        picker.add_peer(bitfield(8, [5, 6]))
+        self.check_order(picker)
+
+        assert picker.pick(bitfield(8, [5, 6])) in (5, 6)
+        assert picker.pick(bitfield(8, [2, 5])) == 2
+        assert picker.pick(seeder) in (0, 1, 3, 4, 7)
+
+    def test_unavailable_pieces_are_not_picked(self):
+        """Test that pieces no counted peer has are never picked."""
+        picker = PiecePicker(4)
+        picker.add_peer(bitfield(4, [1]))
+        assert picker.pick(bitfield(4, [0, 1])) == 1
+        assert picker.pick(bitfield(4, [0])) is None
+
+    def test_ties_are_random(self):
+        """Test that equally rare pieces are picked in a random order."""
+        picks = set()
+        for _ in range(20):
+            picker = PiecePicker(100)
+            picker.add_peer(bitfield(100, range(100)))
+            picks.add(picker.pick(bitfield(100, range(100))))
+        assert len(picks) > 1
+
+    def test_remove(self):
+        """Test that removed pieces are no longer picked but still counted."""
+        picker = PiecePicker(4)
+        picker.add_peer(bitfield(4, [0, 1, 2, 3]))
+        picker.add_peer(bitfield(4, [1, 2]))
+        picker.remove(1)
+        picker.remove(1)
+        self.check_order(picker)
+
+        assert len(picker) == 3
+        assert picker.pick(bitfield(4, [1, 2])) == 2
+        picker.increment(1)
+        picker.remove_peer(bitfield(4, [1, 2]))
+        assert picker.availability[1] == 2
+        assert picker.availability[2] == 1
+        self.check_order(picker)
+
+    def test_random_updates_keep_order(self):
+        """Test that availability runs stay sorted through random updates."""
+        rng = random.Random(42)
+        picker = PiecePicker(200)
+        peers = []
+        for _ in range(500):
+            action = rng.random()
+            if action < 0.5 or not peers:
+                peer = bitfield(200, rng.sample(range(200), rng.randrange(200)))
+                peers.append(peer)
+                picker.add_peer(peer)
+            elif action < 0.8:
+                picker.remove_peer(peers.pop(rng.randrange(len(peers))))
+            else:
+                picker.remove(rng.randrange(200))
+        self.check_order(picker)
+
+        for index in range(200):
+            assert picker.availability[index] == sum(peer[index] for peer in peers)
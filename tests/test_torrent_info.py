@@ -1,12 +1,16 @@
 import hashlib
+import os
+import pickle
 import tempfile
 from pathlib import Path
 from unittest.mock import Mock, patch
 
+import libtorrent as lt
 import pytest
 
+from src import merkle
 from src.bencode import Encoder
-from src.torrent_info import TorrentInfo
+from src.torrent_info import PieceHashes, TorrentInfo
 from .utils import create_torrent_file, create_payload
 
 
@@ -65,10 +69,19 @@ class TestTorrentInfo:
         assert torrent_info.length == 1024
 
     def test_length_property_multi_file(self, multi_file_metainfo):
-        """Test that accessing length on multi-file torrent raises KeyError."""
+        """Test that length on a multi-file torrent is the sum of its files."""
         ti = TorrentInfo(multi_file_metainfo)
-        with pytest.raises(KeyError):
-            _ = ti.length
+        assert ti.length == 512 + 256
+
+    def test_files_property(self, torrent_info, multi_file_metainfo):
+        """Test that files lists every file with its payload offset."""
+        assert torrent_info.files == [("test.txt", 1024, 0)]
+
+        ti = TorrentInfo(multi_file_metainfo)
+        assert ti.files == [
+            ("test_dir/file1.txt", 512, 0),
+            ("test_dir/subdir/file2.txt", 256, 512),
+        ]
 
     def test_piece_length_property(self, torrent_info):
         """Test the piece_length property."""
@@ -81,6 +94,24 @@ class TestTorrentInfo:
         assert all(len(piece) == 20 for piece in pieces)
         assert pieces[0] == b"12345678901234567890"
 
+    def test_derived_data_computed_once(self, torrent_info):
+        """Test that info_hash and pieces are not rebuilt on every access."""
+        assert torrent_info.info_hash is torrent_info.info_hash
+        assert torrent_info.pieces is torrent_info.pieces
+        assert not hasattr(torrent_info, "__dict__")
+
+    def test_pickle_round_trip(self, tmp_path, sample_metainfo):
+        """Test that a TorrentInfo loaded from a file can be pickled."""
+        torrent_file = tmp_path / "test.torrent"
+        torrent_file.write_bytes(Encoder().encode(sample_metainfo))
+        ti = TorrentInfo.from_file(str(torrent_file))
+
+        copy = pickle.loads(pickle.dumps(ti))
+        assert copy.metainfo == ti.metainfo
+        assert copy.raw_info == ti.raw_info
+        assert copy.info_hash == ti.info_hash
+        assert copy.pieces == ti.pieces
+
     def test_info_hash_property(self, torrent_info, sample_metainfo):
         """Test the info_hash property returns correct hash."""
         # Manually calculate expected hash
@@ -185,6 +216,50 @@ class TestTorrentInfo:
         assert ti.url == "http://test.com/announce"
         assert ti.length == 100
 
+    def test_from_file_non_canonical_info_hash(self, tmp_path):
+        """Test that the info hash covers the original, unsorted info bytes."""
+        pieces = b"6:pieces20:12345678901234567890"
+        info = b"d6:lengthi100e4:name8:test.txt12:piece lengthi16384e" + pieces + b"e"
+        # Keys out of order: re-encoding would sort them and change the hash.
+        raw_info = (
+            b"d4:name8:test.txt6:lengthi100e12:piece lengthi16384e" + pieces + b"e"
+        )
+
+        torrent_file = tmp_path / "test.torrent"
+        torrent_file.write_bytes(b"d8:announce3:url4:info" + raw_info + b"e")
+
+        ti = TorrentInfo.from_file(str(torrent_file))
+        assert ti.raw_info == raw_info
+        assert ti.info_hash[0] == hashlib.sha1(raw_info).digest()
+        assert ti.info_hash[0] != hashlib.sha1(info).digest()
+
+    @pytest.mark.parametrize("name", ["sample_metainfo", "multi_file_metainfo"])
+    def test_from_file_mmap(self, tmp_path, request, name):
+        """Test that a memory-mapped torrent matches the regular load."""
+        torrent_file = tmp_path / "test.torrent"
+        torrent_file.write_bytes(Encoder().encode(request.getfixturevalue(name)))
+
+        ti = TorrentInfo.from_file(str(torrent_file))
+        mapped = TorrentInfo.from_file(str(torrent_file), use_mmap=True)
+
+        assert isinstance(mapped.info[b"pieces"], memoryview)
+        # Hashing reads the whole info dictionary, so it waits until needed.
+        assert mapped.hashes is None
+        assert mapped.url == ti.url
+        assert mapped.file == ti.file
+        assert mapped.piece_length == ti.piece_length
+        assert mapped.pieces == ti.pieces
+        assert mapped.info_hash == ti.info_hash
+        assert mapped.metainfo == ti.metainfo
+
+    def test_from_file_mmap_empty(self, tmp_path):
+        """Test that an empty file is rejected when memory-mapping."""
+        torrent_file = tmp_path / "empty.torrent"
+        torrent_file.write_bytes(b"")
+
+        with pytest.raises(ValueError):
+            TorrentInfo.from_file(str(torrent_file), use_mmap=True)
+
     def test_from_file_not_found(self):
         """Test from_file with non-existent file."""
         with pytest.raises(FileNotFoundError):
@@ -199,6 +274,225 @@ class TestTorrentInfo:
             TorrentInfo.from_file(str(invalid_file))
 
 
+class TestPieceHashes:
+    """Test suite for the compact piece hash table."""
+
+    @pytest.fixture
+    def blob(self):
+        return b"".join(hashlib.sha1(bytes([i])).digest() for i in range(4))
+
+    def test_piece_hash_is_view(self, blob):
+        """Test that piece hashes are views into one backing buffer."""
+        pieces = PieceHashes(blob)
+        h = pieces.piece_hash(2)
+        assert isinstance(h, memoryview)
+        assert h.obj is blob
+        assert h == hashlib.sha1(bytes([2])).digest()
+
+    def test_indexing(self, blob):
+        """Test sequence behaviour and bounds checking."""
+        pieces = PieceHashes(blob)
+        assert len(pieces) == 4
+        assert pieces[-1] == blob[60:]
+        assert list(pieces) == [blob[i : i + 20] for i in range(0, 80, 20)]
+        with pytest.raises(IndexError):
+            pieces[4]
+        with pytest.raises(IndexError):
+            pieces[-5]
+
+    def test_slicing(self, blob):
+        """Test that slices return the hashes of a range of pieces."""
+        pieces = PieceHashes(blob)
+        assert pieces[1:3] == [blob[20:40], blob[40:60]]
+        assert pieces[-2:] == [blob[40:60], blob[60:]]
+        assert pieces[::-2] == [blob[60:], blob[20:40]]
+        assert pieces[5:] == []
+
+    def test_verify(self, blob):
+        """Test verifying piece data against its hash."""
+        pieces = PieceHashes(blob)
+        assert pieces.verify(1, bytes([1]))
+        assert not pieces.verify(1, bytes([2]))
+
+    def test_malformed_pieces(self):
+        """Test that a pieces string of the wrong length is rejected."""
+        with pytest.raises(ValueError):
+            PieceHashes(b"x" * 21)
+
+
+class TestLoadMany:
+    """Test suite for parsing batches of torrent files in worker processes."""
+
+    def write_torrent(self, tmp_path, name: str, length: int) -> str:
+        metainfo = {
+            b"announce": b"http://test.com/announce",
+            b"info": {
+                b"name": name.encode(),
+                b"length": length,
+                b"piece length": 16384,
+                b"pieces": b"12345678901234567890",
+            },
+        }
+        path = tmp_path / f"{name}.torrent"
+        path.write_bytes(Encoder().encode(metainfo))
+        return str(path)
+
+    def test_load_many(self, tmp_path):
+        """Test that every file is parsed and hashed."""
+        paths = [self.write_torrent(tmp_path, f"f{i}", i) for i in range(10)]
+
+        results = list(TorrentInfo.load_many(paths, workers=2))
+
+        assert sorted(r.path for r in results) == sorted(paths)
+        for r in results:
+            assert r.error is None
+            assert r.torrent.hashes is not None
+            expected = TorrentInfo.from_file(r.path)
+            assert r.torrent.length == expected.length
+            assert r.torrent.info_hash == expected.info_hash
+
+    def test_load_many_reports_errors(self, tmp_path):
+        """Test that bad files are reported without aborting the batch."""
+        good = self.write_torrent(tmp_path, "good", 1)
+        invalid = tmp_path / "invalid.torrent"
+        invalid.write_bytes(b"not a valid torrent file")
+        missing = str(tmp_path / "missing.torrent")
+
+        results = {
+            r.path: r
+            for r in TorrentInfo.load_many([good, str(invalid), missing], workers=2)
+        }
+
+        assert results[good].torrent.length == 1
+        assert isinstance(results[str(invalid)].error, ValueError)
+        assert isinstance(results[missing].error, FileNotFoundError)
+        assert results[missing].torrent is None
+
+    def test_load_many_stops_early(self, tmp_path):
+        """Test that files are queued lazily and dropped when iteration stops."""
+        path = self.write_torrent(tmp_path, "f", 1)
+        pulled = 0
+
+        def paths():
+            nonlocal pulled
+            for _ in range(400):
+                pulled += 1
+                yield path
+
+        results = TorrentInfo.load_many(paths(), workers=2)
+        assert next(results).error is None
+        results.close()
+
+        assert pulled <= 5
+
+
+class TestTorrentInfoV2:
+    """Test suite for BitTorrent v2 and hybrid torrents created by libtorrent."""
+
+    PIECE_SIZE = 32 * 2**10
+
+    @pytest.fixture
+    def payload(self, tmp_path):
+        """A directory with a multi-piece file, a small file and an empty one."""
+        root = tmp_path / "payload"
+        (root / "sub").mkdir(parents=True)
+        (root / "a.bin").write_bytes(os.urandom(100_000))
+        (root / "sub" / "b.bin").write_bytes(os.urandom(5000))
+        (root / "sub" / "c.bin").write_bytes(b"")
+        return root
+
+    def create(self, payload, flags=0) -> TorrentInfo:
+        torrent_file = create_torrent_file(
+            str(payload), "http://localhost/announce", "", self.PIECE_SIZE, flags
+        )
+        return TorrentInfo.from_file(torrent_file)
+
+    def test_hybrid(self, payload):
+        """Test parsing the v1 and v2 parts of a hybrid torrent."""
+        ti = self.create(payload)
+
+        assert ti.meta_version == 2
+        assert ti.is_hybrid
+        assert ti.swarm_hash == ti.info_hash[0]
+        assert ti.info_hash_v2[0] == hashlib.sha256(ti.raw_info).digest()
+        assert ti.length == 105_000
+        assert ti.layout.padding == {1, 3}
+        assert len(ti.pieces) == ti.layout.piece_count
+
+    def test_v2_files(self, payload):
+        """Test that the file tree is flattened with its Merkle roots."""
+        ti = self.create(payload)
+
+        paths = [f.path for f in ti.v2_files]
+        assert paths == ["payload/a.bin", "payload/sub/b.bin", "payload/sub/c.bin"]
+        for f in ti.v2_files[:2]:
+            data = (payload.parent / f.path).read_bytes()
+            assert f.length == len(data)
+            assert f.pieces_root == merkle.file_root(data)
+        assert ti.v2_files[2].pieces_root is None
+
+    def test_verify_piece_v2(self, payload):
+        """Test verifying v2 pieces against the piece layers."""
+        ti = self.create(payload)
+        big = (payload / "a.bin").read_bytes()
+        small = (payload / "sub" / "b.bin").read_bytes()
+
+        assert len(ti.piece_layer(0)) == 4
+        for i in range(4):
+            piece = big[i * self.PIECE_SIZE : (i + 1) * self.PIECE_SIZE]
+            assert ti.verify_piece_v2(0, i, piece)
+        assert not ti.verify_piece_v2(0, 1, big[: self.PIECE_SIZE])
+
+        assert ti.piece_layer(1) == [ti.v2_files[1].pieces_root]
+        assert ti.verify_piece_v2(1, 0, small)
+        assert ti.piece_layer(2) == []
+
+    def test_piece_layer_checked_once(self, payload):
+        """Test that a piece layer is hashed up to its root only once."""
+        ti = self.create(payload)
+        big = (payload / "a.bin").read_bytes()
+
+        with patch("src.merkle.layer_root", wraps=merkle.layer_root) as layer_root:
+            for i in range(4):
+                piece = big[i * self.PIECE_SIZE : (i + 1) * self.PIECE_SIZE]
+                assert ti.verify_piece_v2(0, i, piece)
+        assert layer_root.call_count == 1
+        assert ti.piece_layer(0) is ti.piece_layer(0)
+
+    def test_corrupted_piece_layer(self, payload):
+        """Test that a piece layer not matching its root is rejected."""
+        ti = self.create(payload)
+        layers = ti.metainfo[b"piece layers"]
+        root = ti.v2_files[0].pieces_root
+        layers[root] = bytes(len(layers[root]))
+
+        with pytest.raises(ValueError):
+            ti.piece_layer(0)
+
+    def test_v2_only(self, payload):
+        """Test a v2-only torrent: truncated swarm hash, piece-aligned files."""
+        ti = self.create(payload, lt.create_torrent.v2_only)
+
+        assert not ti.is_hybrid
+        assert len(ti.pieces) == 0
+        assert ti.swarm_hash == ti.info_hash_v2[0][:20]
+        assert ti.length == 105_000
+        assert [
+            f.offset for f in ti.files if not f.path.startswith("payload/.pad")
+        ] == [
+            0,
+            4 * self.PIECE_SIZE,
+            5 * self.PIECE_SIZE,
+        ]
+        assert lt.torrent_info(Encoder().encode(ti.metainfo)).info_hashes().has_v2()
+
+    def test_v2_single_file(self, payload):
+        """Test that a single-file v2 torrent is not placed in a directory."""
+        ti = self.create(payload / "a.bin", lt.create_torrent.v2_only)
+        assert [f.path for f in ti.v2_files] == ["a.bin"]
+        assert ti.files == [("a.bin", 100_000, 0)]
+
+
 class TestTorrentInfoIntegration:
     """Integration tests using real torrent files."""
 
@@ -0,0 +1,532 @@
+import asyncio
+import socket
+import struct
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from src.bencode import Encoder
+from src.torrent_info import TorrentInfo
+from src.tracker import (
+    UDP_MAX_SCRAPE,
+    UDP_PROTOCOL_ID,
+    HTTPConnectionPool,
+    TrackerClient,
+    TrackerError,
+    UDPTrackerPool,
+    decode_peers,
+    decode_peers6,
+    parse_announce_response,
+)
+
+PEER_ID = b"-PY0001-123456789012"
+
+
+class FakeTracker:
+    """Minimal keep-alive HTTP tracker answering with canned responses.
+
+    Bodies are sent with a Content-Length, `chunked`, or, when `unframed`, in
+    two writes ended by closing the connection.
+    """
+
+    def __init__(
+        self,
+        response: dict,
+        delay: float = 0,
+        chunked: bool = False,
+        unframed: bool = False,
+    ):
+        self.response = response
+        self.delay = delay
+        self.chunked = chunked
+        self.unframed = unframed
+        self.connections = 0
+        self.requests = []
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while line := await reader.readline():
+                target = line.split()[1].decode()
+                while await reader.readline() != b"\r\n":
+                    pass
+                self.requests.append(parse_qs(urlsplit(target).query))
+                await asyncio.sleep(self.delay)
+
+                body = Encoder().encode(self.response)
+                if self.unframed:
+                    writer.write(b"HTTP/1.1 200 OK\r\n\r\n" + body[:10])
+                    await writer.drain()
+                    await asyncio.sleep(0.05)
+                    writer.write(body[10:])
+                    break
+                if self.chunked:
+                    head = b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                    half = len(body) // 2
+                    chunks = [body[:half], body[half:], b""]
+                    body = b"".join(b"%x\r\n%s\r\n" % (len(c), c) for c in chunks)
+                else:
+                    head = b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body)
+                writer.write(head + body)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/announce"
+
+    def close(self):
+        self.server.close()
+
+
+class FakeUDPTracker(asyncio.DatagramProtocol):
+    """Minimal BEP 15 tracker; `drop` requests are ignored before answering."""
+
+    CONNECTION_ID = 0x1122334455667788
+
+    def __init__(self, peers: bytes = b"", drop: int = 0, error: bytes = b""):
+        self.peers = peers
+        self.drop = drop
+        self.error = error
+        self.packets = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.packets.append(data)
+        if self.drop:
+            self.drop -= 1
+            return
+
+        connection_id, action, transaction_id = struct.unpack_from(">QII", data)
+        header = struct.pack(">II", action, transaction_id)
+        if action == 0:
+            assert connection_id == UDP_PROTOCOL_ID
+            reply = header + struct.pack(">Q", self.CONNECTION_ID)
+        elif connection_id != self.CONNECTION_ID:
+            reply = struct.pack(">II", 3, transaction_id) + b"bad connection id"
+        elif self.error:
+            reply = struct.pack(">II", 3, transaction_id) + self.error
+        elif action == 1:
+            reply = header + struct.pack(">III", 1800, 2, 5) + self.peers
+        else:
+            hashes = len(data[16:]) // 20
+            reply = header + b"".join(
+                struct.pack(">III", i, 10 * i, 100 * i) for i in range(hashes)
+            )
+        self.transport.sendto(reply, addr)
+
+    def actions(self) -> list[int]:
+        return [struct.unpack_from(">I", p, 8)[0] for p in self.packets]
+
+    async def start(self) -> str:
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=("127.0.0.1", 0))
+        port = self.transport.get_extra_info("sockname")[1]
+        return f"udp://127.0.0.1:{port}/announce"
+
+    def close(self):
+        self.transport.close()
+
+
+def compact(*peers: tuple[str, int]) -> bytes:
+    return b"".join(
+        bytes(int(x) for x in ip.split(".")) + port.to_bytes(2, "big")
+        for ip, port in peers
+    )
+
+
+def make_torrent(*tiers: list[str]) -> TorrentInfo:
+    metainfo = {
+        b"announce": tiers[0][0].encode(),
+        b"info": {
+            b"name": b"test.txt",
+            b"length": 1024,
+            b"piece length": 16384,
+            b"pieces": b"12345678901234567890",
+        },
+    }
+    if len(tiers) > 1 or len(tiers[0]) > 1:
+        metainfo[b"announce-list"] = [[u.encode() for u in t] for t in tiers]
+    return TorrentInfo(metainfo)
+
+
+class TestParseAnnounce:
+    """Test suite for decoding tracker responses."""
+
+    def test_parse_response(self):
+        """Test that peers and intervals are extracted."""
+        body = Encoder().encode(
+            {
+                b"interval": 900,
+                b"min interval": 60,
+                b"complete": 3,
+                b"peers": compact(("10.0.0.1", 6881)),
+            }
+        )
+        response = parse_announce_response(body)
+        assert response.peers == [("10.0.0.1", 6881)]
+        assert response.interval == 900
+        assert response.min_interval == 60
+        assert response.complete == 3
+        assert response.incomplete is None
+
+    def test_failure_reason(self):
+        """Test that a failure reason is raised as TrackerError."""
+        body = Encoder().encode({b"failure reason": b"unregistered torrent"})
+        with pytest.raises(TrackerError, match="unregistered torrent"):
+            parse_announce_response(body)
+
+    def test_decode_peers(self):
+        """Test decoding compact IPv4 peers."""
+        peers = compact(("127.0.0.1", 6881), ("192.168.1.2", 6882))
+        assert decode_peers(peers) == [("127.0.0.1", 6881), ("192.168.1.2", 6882)]
+
+    def test_decode_peers_truncated(self):
+        """Test that a trailing partial entry is ignored."""
+        peers = compact(("10.0.0.1", 1)) + b"\x0a\x00"
+        assert decode_peers(peers) == [("10.0.0.1", 1)]
+
+    def test_decode_peers6(self):
+        """Test decoding compact IPv6 peers (BEP 7)."""
+        peers = socket.inet_pton(socket.AF_INET6, "2001:db8::1") + b"\x1a\xe1"
+        peers += socket.inet_pton(socket.AF_INET6, "::1") + b"\x00\x50"
+        assert decode_peers6(peers) == [("2001:db8::1", 6881), ("::1", 80)]
+
+    def test_parse_peers6(self):
+        """Test that IPv6 peers are returned after IPv4 ones."""
+        body = Encoder().encode(
+            {
+                b"peers": compact(("10.0.0.1", 6881)),
+                b"peers6": socket.inet_pton(socket.AF_INET6, "fe80::2") + b"\x00\x01",
+            }
+        )
+        assert parse_announce_response(body).peers == [
+            ("10.0.0.1", 6881),
+            ("fe80::2", 1),
+        ]
+
+    def test_parse_dictionary_peers(self):
+        """Test the non-compact peer list of dictionaries."""
+        body = Encoder().encode(
+            {
+                b"peers": [
+                    {b"ip": b"10.0.0.1", b"peer id": b"x" * 20, b"port": 6881},
+                    {b"ip": b"tracker.example.com", b"port": 80},
+                    {b"port": 1},
+                ]
+            }
+        )
+        assert parse_announce_response(body).peers == [
+            ("10.0.0.1", 6881),
+            ("tracker.example.com", 80),
+        ]
+
+
+@pytest.mark.asyncio
+class TestTrackerClient:
+    """Test suite for the asyncio tracker client."""
+
+    async def test_announce(self):
+        """Test a single announce and the parameters sent."""
+        tracker = FakeTracker({b"interval": 1800, b"peers": compact(("1.2.3.4", 80))})
+        url = await tracker.start()
+        torrent = make_torrent([url])
+        client = TrackerClient(torrent, PEER_ID, port=6889)
+
+        peers = await client.announce("started")
+        client.close()
+        tracker.close()
+
+        assert peers == [("1.2.3.4", 80)]
+        params = tracker.requests[0]
+        assert params["peer_id"] == [PEER_ID.decode()]
+        assert params["port"] == ["6889"]
+        assert params["left"] == ["1024"]
+        assert params["event"] == ["started"]
+        assert params["compact"] == ["1"]
+
+    async def test_connection_reused(self):
+        """Test that consecutive announces share one keep-alive connection."""
+        tracker = FakeTracker({b"interval": 1800, b"peers": b""})
+        url = await tracker.start()
+        client = TrackerClient(make_torrent([url]), PEER_ID)
+
+        for _ in range(3):
+            await client.announce()
+        client.close()
+        tracker.close()
+
+        assert len(tracker.requests) == 3
+        assert tracker.connections == 1
+
+    async def test_chunked_response(self):
+        """Test decoding a chunked transfer-encoded response."""
+        tracker = FakeTracker(
+            {b"interval": 1800, b"peers": compact(("1.2.3.4", 80))}, chunked=True
+        )
+        url = await tracker.start()
+        pool = HTTPConnectionPool()
+
+        status, body = await pool.get(url)
+        pool.close()
+        tracker.close()
+
+        assert status == 200
+        assert parse_announce_response(body).peers == [("1.2.3.4", 80)]
+
+    async def test_response_until_eof(self):
+        """Test reading a body without length until the connection closes."""
+        tracker = FakeTracker(
+            {b"interval": 1800, b"peers": compact(("1.2.3.4", 80))}, unframed=True
+        )
+        url = await tracker.start()
+        pool = HTTPConnectionPool()
+
+        status, body = await pool.get(url)
+        pool.close()
+        tracker.close()
+
+        assert status == 200
+        assert parse_announce_response(body).peers == [("1.2.3.4", 80)]
+
+    async def test_tiers_announced_concurrently(self):
+        """Test that all tiers are queried at once and peers are merged."""
+        a = FakeTracker({b"peers": compact(("1.1.1.1", 1), ("2.2.2.2", 2))}, 0.3)
+        b = FakeTracker({b"peers": compact(("2.2.2.2", 2), ("3.3.3.3", 3))}, 0.3)
+        client = TrackerClient(
+            make_torrent([await a.start()], [await b.start()]), PEER_ID
+        )
+
+        start = asyncio.get_running_loop().time()
+        peers = await client.announce()
+        elapsed = asyncio.get_running_loop().time() - start
+        client.close()
+        a.close()
+        b.close()
+
+        assert sorted(peers) == [("1.1.1.1", 1), ("2.2.2.2", 2), ("3.3.3.3", 3)]
+        assert elapsed < 0.55
+
+    async def test_failover_within_tier(self):
+        """Test that a dead tracker is skipped and the working one promoted."""
+        tracker = FakeTracker({b"interval": 1800, b"peers": compact(("1.2.3.4", 80))})
+        url = await tracker.start()
+        dead = "http://127.0.0.1:1/announce"
+        client = TrackerClient(make_torrent([dead, url]), PEER_ID, timeout=1)
+        client.tiers[0].sort(key=lambda t: t.url != dead)
+
+        peers = await client.announce()
+        client.close()
+        tracker.close()
+
+        assert peers == [("1.2.3.4", 80)]
+        assert client.tiers[0][0].url == url
+        assert client.tiers[0][1].failures == 1
+
+    async def test_timeout(self):
+        """Test that a tracker slower than the timeout counts as failed."""
+        tracker = FakeTracker({b"peers": b""}, delay=2)
+        client = TrackerClient(
+            make_torrent([await tracker.start()]), PEER_ID, timeout=0.2
+        )
+
+        assert await client.announce() == []
+        client.close()
+        tracker.close()
+        assert client.tiers[0][0].failures == 1
+
+    async def test_intervals(self):
+        """Test that interval schedules announces and min interval limits them."""
+        tracker = FakeTracker({b"interval": 300, b"min interval": 120, b"peers": b""})
+        client = TrackerClient(make_torrent([await tracker.start()]), PEER_ID)
+
+        await client.announce()
+        t = client.tiers[0][0]
+        assert client.next_announce() == pytest.approx(t.last_announce + 300)
+        assert not t.can_announce(t.last_announce + 60)
+        assert t.can_announce(t.last_announce + 120)
+
+        await client.announce()
+        client.close()
+        tracker.close()
+        assert len(tracker.requests) == 1
+
+
+@pytest.mark.asyncio
+class TestUDPTracker:
+    """Test suite for the UDP tracker protocol (BEP 15)."""
+
+    async def test_announce(self):
+        """Test connecting, announcing and the announce packet layout."""
+        server = FakeUDPTracker(compact(("1.2.3.4", 80), ("5.6.7.8", 90)))
+        url = await server.start()
+        tracker = UDPTrackerPool().get(url)
+
+        response = await tracker.announce(
+            b"h" * 20, PEER_ID, 6889, 1, 2, 3, "started", key=7
+        )
+        tracker.close()
+        server.close()
+
+        assert response.peers == [("1.2.3.4", 80), ("5.6.7.8", 90)]
+        assert response.interval == 1800
+        assert (response.incomplete, response.complete) == (2, 5)
+
+        assert server.actions() == [0, 1]
+        packet = server.packets[1]
+        assert len(packet) == 98
+        fields = struct.unpack(">QII20s20sQQQIIIiH", packet)
+        assert fields[0] == FakeUDPTracker.CONNECTION_ID
+        assert fields[3:] == (b"h" * 20, PEER_ID, 2, 3, 1, 2, 0, 7, -1, 6889)
+
+    async def test_connection_id_cached(self):
+        """Test that the connection id is reused by later requests."""
+        server = FakeUDPTracker()
+        url = await server.start()
+        tracker = UDPTrackerPool().get(url)
+
+        for _ in range(3):
+            await tracker.announce(b"h" * 20, PEER_ID, 6881, 0, 0, 0)
+        tracker.close()
+        server.close()
+
+        assert server.actions() == [0, 1, 1, 1]
+
+    async def test_connection_id_expired(self):
+        """Test that an expired connection id is renewed."""
+        server = FakeUDPTracker()
+        url = await server.start()
+        tracker = UDPTrackerPool().get(url)
+
+        await tracker.announce(b"h" * 20, PEER_ID, 6881, 0, 0, 0)
+        tracker.connection_expiry = 0
+        await tracker.announce(b"h" * 20, PEER_ID, 6881, 0, 0, 0)
+        tracker.close()
+        server.close()
+
+        assert server.actions() == [0, 1, 0, 1]
+
+    async def test_retransmission(self):
+        """Test that lost requests are resent with growing timeouts."""
+        server = FakeUDPTracker(compact(("1.2.3.4", 80)), drop=2)
+        url = await server.start()
+        tracker = UDPTrackerPool(timeout=0.05).get(url)
+
+        start = asyncio.get_running_loop().time()
+        response = await tracker.announce(b"h" * 20, PEER_ID, 6881, 0, 0, 0)
+        elapsed = asyncio.get_running_loop().time() - start
+        tracker.close()
+        server.close()
+
+        assert response.peers == [("1.2.3.4", 80)]
+        # The connect request was sent three times: after 0.05s and 0.1s.
+        assert server.actions() == [0, 0, 0, 1]
+        assert elapsed >= 0.15
+
+    async def test_no_response(self):
+        """Test that a tracker that never answers raises after all retries."""
+        server = FakeUDPTracker(drop=100)
+        url = await server.start()
+        tracker = UDPTrackerPool(timeout=0.01, max_retries=2).get(url)
+
+        with pytest.raises(TrackerError, match="No response"):
+            await tracker.announce(b"h" * 20, PEER_ID, 6881, 0, 0, 0)
+        tracker.close()
+        server.close()
+        assert len(server.packets) == 3
+
+    async def test_error_response(self):
+        """Test that an error action is raised as TrackerError."""
+        server = FakeUDPTracker(error=b"torrent not registered")
+        url = await server.start()
+        tracker = UDPTrackerPool().get(url)
+
+        with pytest.raises(TrackerError, match="torrent not registered"):
+            await tracker.announce(b"h" * 20, PEER_ID, 6881, 0, 0, 0)
+        tracker.close()
+        server.close()
+
+    async def test_scrape_batches(self):
+        """Test that scrapes are split into requests of at most 74 hashes."""
+        server = FakeUDPTracker()
+        url = await server.start()
+        tracker = UDPTrackerPool().get(url)
+        hashes = [i.to_bytes(20, "big") for i in range(100)]
+
+        result = await tracker.scrape(hashes)
+        tracker.close()
+        server.close()
+
+        assert server.actions().count(0) == 1
+        scrapes = [p for p in server.packets if struct.unpack_from(">I", p, 8)[0] == 2]
+        assert sorted(len(p[16:]) // 20 for p in scrapes) == [100 - UDP_MAX_SCRAPE, 74]
+        assert list(result) == hashes
+        assert result[hashes[0]] == (0, 0, 0)
+        assert result[hashes[UDP_MAX_SCRAPE + 1]] == (1, 10, 100)
+
+    async def test_tracker_client(self):
+        """Test that the tracker client announces to UDP and HTTP tiers."""
+        server = FakeUDPTracker(compact(("1.2.3.4", 80)))
+        http = FakeTracker({b"peers": compact(("5.6.7.8", 90))})
+        torrent = make_torrent([await server.start()], [await http.start()])
+        client = TrackerClient(torrent, PEER_ID)
+
+        peers = await client.announce("started")
+        client.close()
+        server.close()
+        http.close()
+
+        assert sorted(peers) == [("1.2.3.4", 80), ("5.6.7.8", 90)]
+        assert server.actions() == [0, 1]
+        assert server.packets[1][16:36] == torrent.swarm_hash
+
+    async def test_silent_tier_does_not_block(self):
+        """Test that an unanswering UDP tier times out like an HTTP tracker."""
+        server = FakeUDPTracker(drop=100)
+        http = FakeTracker({b"peers": compact(("5.6.7.8", 90))})
+        torrent = make_torrent([await server.start()], [await http.start()])
+        client = TrackerClient(torrent, PEER_ID, timeout=0.2)
+
+        start = asyncio.get_running_loop().time()
+        peers = await client.announce("started")
+        elapsed = asyncio.get_running_loop().time() - start
+        client.close()
+        server.close()
+        http.close()
+
+        assert peers == [("5.6.7.8", 90)]
+        assert elapsed < 1
+        assert client.tiers[0][0].failures == 1
+
+    async def test_tracker_client_retransmits(self):
+        """Test that the tracker client leaves time for a lost request."""
+        server = FakeUDPTracker(compact(("1.2.3.4", 80)), drop=1)
+        client = TrackerClient(
+            make_torrent([await server.start()]), PEER_ID, timeout=0.4
+        )
+
+        peers = await client.announce("started")
+        client.close()
+        server.close()
+
+        assert peers == [("1.2.3.4", 80)]
+        assert server.actions() == [0, 0, 1]
+
+    async def test_close_during_request(self):
+        """Test that closing the tracker cancels its pending connect cleanly."""
+        server = FakeUDPTracker(drop=100)
+        url = await server.start()
+        tracker = UDPTrackerPool(timeout=10).get(url)
+        task = asyncio.create_task(tracker.announce(b"h" * 20, PEER_ID, 6881, 0, 0, 0))
+        await asyncio.sleep(0.05)
+        connecting = tracker.connecting
+
+        tracker.close()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        server.close()
+        assert connecting.cancelled()
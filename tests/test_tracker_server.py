@@ -0,0 +1,297 @@
+import asyncio
+import struct
+import time
+from urllib.parse import urlencode
+
+import pytest
+
+from src.bencode import Decoder
+from src.torrent_info import TorrentInfo
+from src.tracker import (
+    UDP_PROTOCOL_ID,
+    HTTPConnectionPool,
+    TrackerClient,
+    TrackerError,
+    UDPTrackerPool,
+)
+from src.tracker_server import Swarm, TrackerServer, compact_address
+
+
+def make_torrent(url: str, name: bytes = b"test.txt") -> TorrentInfo:
+    return TorrentInfo(
+        {
+            b"announce": url.encode(),
+            b"info": {
+                b"name": name,
+                b"length": 1024,
+                b"piece length": 16384,
+                b"pieces": b"12345678901234567890",
+            },
+        }
+    )
+
+
+def peer_id(n: int) -> bytes:
+    return b"-PY0001-%012d" % n
+
+
+class TestSwarm:
+    """Test suite for the in-memory swarm table."""
+
+    def test_update_and_counts(self):
+        """Test that seeders and leechers are counted as peers change state."""
+        swarm = Swarm()
+        swarm.update(b"a", b"", seeder=False, expires=0)
+        swarm.update(b"b", b"", seeder=True, expires=0)
+        assert (swarm.complete, swarm.incomplete) == (1, 1)
+
+        swarm.update(b"a", b"", seeder=True, expires=0)
+        assert (swarm.complete, swarm.incomplete) == (2, 0)
+        assert len(swarm) == 2
+
+    def test_remove(self):
+        """Test that removing a peer keeps the index consistent."""
+        swarm = Swarm()
+        for i in range(5):
+            swarm.update(bytes([i]), bytes([i]), seeder=i % 2 == 0, expires=0)
+
+        swarm.remove(bytes([1]))
+        swarm.remove(bytes([4]))
+        swarm.remove(b"unknown")
+
+        assert sorted(p.peer_id for p in swarm.peers) == [b"\x00", b"\x02", b"\x03"]
+        assert all(swarm.peers[i].peer_id == k for k, i in swarm.index.items())
+        assert (swarm.complete, swarm.incomplete) == (2, 1)
+
+    def test_sample_excludes_requester(self):
+        """Test that a peer is never handed its own address."""
+        swarm = Swarm()
+        for i in range(3):
+            swarm.update(bytes([i]), bytes([i]), seeder=False, expires=0)
+
+        for _ in range(20):
+            sample = swarm.sample(2, exclude=b"\x00")
+            assert len(sample) == 2
+            assert b"\x00" not in [p.peer_id for p in sample]
+        assert len(swarm.sample(10)) == 3
+
+    def test_expire(self):
+        """Test that peers past their expiry time are dropped."""
+        swarm = Swarm()
+        swarm.update(b"old", b"", seeder=True, expires=10)
+        swarm.update(b"new", b"", seeder=False, expires=20)
+
+        assert swarm.expire(15) == 1
+        assert [p.peer_id for p in swarm.peers] == [b"new"]
+        assert swarm.complete == 0
+
+
+class TestTrackerServer:
+    """Test suite for announce bookkeeping independent of the transport."""
+
+    def test_announce_lifecycle(self):
+        """Test started, completed and stopped events."""
+        server = TrackerServer()
+        info_hash = b"h" * 20
+        a = compact_address("10.0.0.1", 6881)
+        b = compact_address("10.0.0.2", 6882)
+
+        swarm, peers = server.announce(info_hash, peer_id(1), a, 100, "started")
+        assert peers == []
+        swarm, peers = server.announce(info_hash, peer_id(2), b, 100, "started")
+        assert [p.compact for p in peers] == [a]
+
+        server.announce(info_hash, peer_id(1), a, 0, "completed")
+        assert server.scrape([info_hash])[info_hash] == (1, 1, 1)
+
+        server.announce(info_hash, peer_id(2), b, 100, "stopped")
+        assert server.scrape([info_hash])[info_hash] == (1, 1, 0)
+
+    def test_numwant(self):
+        """Test that the number of returned peers is capped."""
+        server = TrackerServer(max_numwant=5)
+        for i in range(20):
+            addr = compact_address("10.0.0.1", i)
+            _, peers = server.announce(b"h" * 20, peer_id(i), addr, 1)
+
+        assert len(peers) == 5
+        _, peers = server.announce(b"h" * 20, peer_id(0), addr, 1, numwant=2)
+        assert len(peers) == 2
+
+    def test_expire_removes_empty_swarms(self):
+        """Test that silent peers expire and empty swarms are dropped."""
+        server = TrackerServer(peer_timeout=0.01)
+        server.announce(b"h" * 20, peer_id(1), compact_address("::1", 1), 1)
+        time.sleep(0.02)
+
+        assert server.expire() == 1
+        assert server.swarms == {}
+
+    def test_compact_address(self):
+        """Test compact encoding of IPv4, IPv6 and IPv4-mapped addresses."""
+        assert compact_address("1.2.3.4", 80) == b"\x01\x02\x03\x04\x00\x50"
+        assert compact_address("::ffff:1.2.3.4", 80) == b"\x01\x02\x03\x04\x00\x50"
+        assert len(compact_address("2001:db8::1", 80)) == 18
+
+
+@pytest.mark.asyncio
+class TestHTTPTracker:
+    """Test suite for the HTTP side of the tracker, using the tracker client."""
+
+    async def test_announce(self):
+        """Test that clients announcing the same torrent find each other."""
+        server = TrackerServer(interval=600, min_interval=60)
+        await server.start("127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.http_port()}/announce"
+        torrent = make_torrent(url)
+
+        first = TrackerClient(torrent, peer_id(1), port=7001)
+        second = TrackerClient(torrent, peer_id(2), port=7002)
+        assert await first.announce("started") == []
+        assert await second.announce("started") == [("127.0.0.1", 7001)]
+
+        tracker = second.tiers[0][0]
+        assert (tracker.interval, tracker.min_interval) == (600, 60)
+
+        first.close()
+        second.close()
+        await server.close()
+
+    async def test_swarms_are_separate(self):
+        """Test that peers of other torrents are not returned."""
+        server = TrackerServer()
+        await server.start("127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.http_port()}/announce"
+
+        first = TrackerClient(make_torrent(url, b"a"), peer_id(1))
+        second = TrackerClient(make_torrent(url, b"b"), peer_id(2))
+        await first.announce("started")
+        assert await second.announce("started") == []
+
+        first.close()
+        second.close()
+        await server.close()
+
+    async def test_scrape(self):
+        """Test the scrape convention of replacing announce with scrape."""
+        server = TrackerServer()
+        await server.start("127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.http_port()}/announce"
+        torrent = make_torrent(url)
+
+        client = TrackerClient(torrent, peer_id(1))
+        await client.announce("started", left=0)
+        pool = HTTPConnectionPool()
+        query = urlencode({"info_hash": torrent.info_hash[0]})
+        status, body = await pool.get(url.replace("announce", "scrape") + "?" + query)
+
+        client.close()
+        pool.close()
+        await server.close()
+
+        assert status == 200
+        files = Decoder(body).read_dict()[b"files"]
+        assert files == {
+            torrent.info_hash[0]: {b"complete": 1, b"downloaded": 0, b"incomplete": 0}
+        }
+
+    async def test_invalid_announce(self):
+        """Test that a malformed announce gets a failure reason."""
+        server = TrackerServer()
+        await server.start("127.0.0.1", 0)
+        pool = HTTPConnectionPool()
+
+        url = f"http://127.0.0.1:{server.http_port()}"
+        status, body = await pool.get(f"{url}/announce?info_hash=short")
+        bad_ports = []
+        for port in (70000, -1):
+            query = urlencode(
+                {"info_hash": b"h" * 20, "peer_id": peer_id(1), "port": port, "left": 0}
+            )
+            bad_ports.append(await pool.get(f"{url}/announce?{query}"))
+        missing, _ = await pool.get(f"{url}/other")
+        pool.close()
+        await server.close()
+
+        assert status == 200
+        assert b"failure reason" in Decoder(body).read_dict()
+        for status, body in bad_ports:
+            assert status == 200
+            assert b"invalid port" in Decoder(body).read_dict()[b"failure reason"]
+        assert missing == 404
+        assert server.swarms == {}
+
+    async def test_close_with_idle_client(self):
+        """Test that closing the server drops idle keep-alive connections."""
+        server = TrackerServer()
+        await server.start("127.0.0.1", 0)
+        pool = HTTPConnectionPool()
+        status, _ = await pool.get(f"http://127.0.0.1:{server.http_port()}/scrape")
+        assert status == 200
+
+        await asyncio.wait_for(server.close(), 1)
+        pool.close()
+
+    async def test_keep_alive_timeout(self):
+        """Test that a client sending no request is disconnected."""
+        server = TrackerServer(keep_alive_timeout=0.1)
+        await server.start("127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.http_port())
+        writer.write(b"GET /scrape HTTP/1.1\r\n")
+
+        assert await asyncio.wait_for(reader.read(), 1) == b""
+        writer.close()
+        await server.close()
+
+
+@pytest.mark.asyncio
+class TestUDPTrackerServer:
+    """Test suite for the UDP side of the tracker (BEP 15)."""
+
+    async def test_announce_and_scrape(self):
+        """Test announcing and scraping through the UDP tracker client."""
+        server = TrackerServer(interval=600)
+        await server.start("127.0.0.1", 0, udp_port=0)
+        pool = UDPTrackerPool(timeout=1, max_retries=1)
+        tracker = pool.get(f"udp://127.0.0.1:{server.udp_port()}/announce")
+
+        await tracker.announce(b"h" * 20, peer_id(1), 7001, 0, 0, 0, "started")
+        response = await tracker.announce(b"h" * 20, peer_id(2), 7002, 0, 0, 10)
+        stats = await tracker.scrape([b"h" * 20, b"x" * 20])
+
+        pool.close()
+        await server.close()
+
+        assert response.peers == [("127.0.0.1", 7001)]
+        assert response.interval == 600
+        assert (response.complete, response.incomplete) == (1, 1)
+        assert stats == {b"h" * 20: (1, 0, 1), b"x" * 20: (0, 0, 0)}
+
+    async def test_invalid_connection_id(self):
+        """Test that requests with a forged connection id are refused."""
+        server = TrackerServer()
+        packet = struct.pack(">QII", 1234, 1, 99) + bytes(82)
+
+        reply = server.handle_datagram(packet, ("127.0.0.1", 1))
+        assert struct.unpack_from(">II", reply) == (3, 99)
+
+        connect = server.handle_datagram(
+            struct.pack(">QII", UDP_PROTOCOL_ID, 0, 5), ("127.0.0.1", 1)
+        )
+        (connection_id,) = struct.unpack_from(">Q", connect, 8)
+        assert server.valid_connection_id(connection_id, ("127.0.0.1", 1))
+        assert not server.valid_connection_id(connection_id, ("127.0.0.1", 2))
+
+    async def test_error_raised_by_client(self):
+        """Test that an error reply surfaces as TrackerError in the client."""
+        server = TrackerServer()
+        await server.start("127.0.0.1", 0, udp_port=0)
+        pool = UDPTrackerPool(timeout=1, max_retries=1)
+        tracker = pool.get(f"udp://127.0.0.1:{server.udp_port()}/announce")
+        await tracker.connect()
+        tracker.connection_id ^= 1
+
+        with pytest.raises(TrackerError, match="Invalid connection id"):
+            await tracker.announce(b"h" * 20, peer_id(1), 7001, 0, 0, 0)
+        pool.close()
+        await server.close()
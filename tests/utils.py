@@ -1,6 +1,8 @@
+import asyncio
 import hashlib
 import logging
 import shutil
+import struct
 from pathlib import Path
 
 import libtorrent as lt
@@ -8,14 +10,20 @@ import libtorrent as lt
 logger = logging.getLogger(__name__)
 
 
-def create_torrent_file(payload_file: str, tracker: str, workspace: str) -> str:
+def create_torrent_file(
+    payload_file: str,
+    tracker: str,
+    workspace: str,
+    piece_size: int = 0,
+    flags: int = 0,
+) -> str:
     """Create the torrent file for the content of the payload in the workspace"""
     payload_path = Path(workspace) / payload_file
 
     fs = lt.file_storage()
     lt.add_files(fs, str(payload_path))
 
-    t = lt.create_torrent(fs)
+    t = lt.create_torrent(fs, piece_size, flags=flags)
     t.add_tracker(tracker)
     t.set_creator("test-setup")
 
@@ -67,3 +75,93 @@ def calculate_sha256(file_path: str) -> str:
         while chunk := f.read(8192):
             sha256.update(chunk)
     return sha256.hexdigest()
+
+
+class FakeSeeder:
+    """Peer serving `payload` over the wire protocol, with injectable faults.
+
+    `pieces` limits the pieces it has, `corrupt` pieces are served with bad
+    data and the connection is dropped after `drop_after` blocks. Blocks are
+    sent `latency` seconds after they are requested.
+    """
+
+    def __init__(
+        self,
+        info_hash: bytes,
+        payload: bytes,
+        piece_length: int,
+        pieces: set[int] | None = None,
+        corrupt: set[int] = frozenset(),
+        drop_after: int | None = None,
+        latency: float = 0,
+    ):
+        self.info_hash = info_hash
+        self.payload = payload
+        self.piece_length = piece_length
+        piece_count = -(-len(payload) // piece_length)
+        self.pieces = set(range(piece_count)) if pieces is None else pieces
+        self.piece_count = piece_count
+        self.corrupt = corrupt
+        self.drop_after = drop_after
+        self.latency = latency
+        self.requests = []
+        self.cancels = []
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def bitfield(self) -> bytes:
+        bits = bytearray(-(-self.piece_count // 8))
+        for i in self.pieces:
+            bits[i // 8] |= 0x80 >> (i % 8)
+        return bytes(bits)
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            handshake = await reader.readexactly(68)
+            if handshake[28:48] != self.info_hash:
+                return
+            writer.write(handshake[:48] + b"-FS0001-%012d" % self.connections)
+            writer.write(struct.pack(">IB", len(self.bitfield()) + 1, 5))
+            writer.write(self.bitfield())
+
+            while True:
+                length, msg_id = struct.unpack(">IB", await reader.readexactly(5))
+                payload = await reader.readexactly(length - 1)
+                if msg_id == 2:
+                    writer.write(struct.pack(">IB", 1, 1))
+                elif msg_id == 6:
+                    index, begin, size = struct.unpack(">III", payload)
+                    self.requests.append((index, begin, size))
+                    if len(self.requests) == self.drop_after:
+                        return
+                    start = index * self.piece_length + begin
+                    block = self.payload[start : start + size]
+                    if index in self.corrupt:
+                        block = bytes(len(block))
+                    message = struct.pack(">IBII", len(block) + 9, 7, index, begin)
+                    self.in_flight += 1
+                    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                    asyncio.get_running_loop().call_later(
+                        self.latency, self.reply, writer, message + block
+                    )
+                elif msg_id == 8:
+                    self.cancels.append(struct.unpack(">III", payload))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def reply(self, writer, message: bytes):
+        self.in_flight -= 1
+        if not writer.is_closing():
+            writer.write(message)
+
+    async def start(self) -> tuple[str, int]:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[:2]
+
+    def close(self):
+        self.server.close()